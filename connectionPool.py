@@ -0,0 +1,130 @@
+"""
+/***************************************************************************
+
+ConnectionPool
+
+This module defines the ConnectionPool class, which hands out one
+persistent SQLite connection per thread for the IntelliGeo database.
+
+Classes:
+    ConnectionPool: Opens a connection the first time a thread asks for it,
+                    configures it for concurrent readers and writers, and
+                    runs the schema bootstrap once per process.
+
+Usage:
+    - Get the pool of a database file with `getConnectionPool(path,
+      bootstrap)`.
+    - Use `getConnection()` / `getCursor()` from any thread, the same
+      connection is returned for the lifetime of that thread.
+    - Call `release()` to close the calling thread's connection, or
+      `closeAll()` when the plugin is unloaded.
+
+Note:
+    Connections use WAL journaling with `synchronous=NORMAL`, so the GUI
+    thread can read while a worker thread writes. Prepared statements are
+    reused through the statement cache of each connection.
+***************************************************************************/
+"""
+
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    def __init__(self, databasePath, bootstrap=None):
+        self.databasePath = databasePath
+        self.bootstrap = bootstrap
+        self.busyTimeout = 30
+        self.cachedStatements = 256
+
+        self.local = threading.local()
+        self.connections = []
+        self.connectionsLock = threading.Lock()
+
+        self.bootstrapped = False
+        self.bootstrapping = False
+        self.bootstrapLock = threading.RLock()
+
+    def _open(self):
+        connection = sqlite3.connect(self.databasePath,
+                                     timeout=self.busyTimeout,
+                                     cached_statements=self.cachedStatements)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def getConnection(self):
+        """
+        Return the connection of the calling thread, opening it (and bootstrapping the schema if nobody did yet)
+        when needed.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self._open()
+            self.local.connection = connection
+            self.local.cursor = connection.cursor()
+            with self.connectionsLock:
+                self.connections.append(connection)
+
+        if not self.bootstrapped:
+            # re-entrant: the bootstrap itself goes through `getConnection`
+            with self.bootstrapLock:
+                if not self.bootstrapped and not self.bootstrapping:
+                    self.bootstrapping = True
+                    try:
+                        if self.bootstrap is not None:
+                            self.bootstrap(connection)
+                        self.bootstrapped = True
+                    finally:
+                        self.bootstrapping = False
+
+        return connection
+
+    def getCursor(self):
+        self.getConnection()
+        return self.local.cursor
+
+    def release(self):
+        """
+        Close the connection of the calling thread.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            return
+
+        with self.connectionsLock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+        self.local.connection = None
+        self.local.cursor = None
+        connection.close()
+
+    def closeAll(self):
+        """
+        Close every connection of the pool. Only safe when no other thread uses the database anymore.
+        """
+        with self.connectionsLock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.ProgrammingError:
+                # connections belonging to other threads can only be closed by garbage collection
+                pass
+        self.local = threading.local()
+
+
+_pools = {}
+_poolsLock = threading.Lock()
+
+
+def getConnectionPool(databasePath, bootstrap=None) -> ConnectionPool:
+    """
+    Return the process-wide pool of `databasePath`, creating it on first use.
+    """
+    with _poolsLock:
+        if databasePath not in _pools:
+            _pools[databasePath] = ConnectionPool(databasePath, bootstrap)
+        elif _pools[databasePath].bootstrap is None:
+            _pools[databasePath].bootstrap = bootstrap
+        return _pools[databasePath]
@@ -0,0 +1,77 @@
+"""
+/***************************************************************************
+
+Python console output watcher
+
+Event-driven replacement of the console polling: the watcher listens to
+`textChanged` of the console output (a QsciScintilla) and only reads the
+text appended after the position it has already processed.
+
+Classes:
+    ConsoleOutputWatcher: Emits `outputAppended(text)` with the output
+                          written since the last emission. Output usually
+                          arrives in several writes (a traceback is
+                          written line by line), so the watcher waits
+                          until the console has been quiet for
+                          `settleInterval` ms before emitting.
+
+Usage:
+    - `watch(outputWidget)` starts from the current end of the output,
+      `stop()` disconnects the watcher. Nothing runs while the console is
+      idle.
+    - Clearing the console resets the processed position to its start.
+***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+
+
+class ConsoleOutputWatcher(QObject):
+    outputAppended = pyqtSignal(str)
+
+    def __init__(self, settleInterval: int = 250, parent=None):
+        super().__init__(parent)
+        self.outputWidget = None
+        # processed position, as (line, index in the line) so that no full copy of the output is needed
+        self.line, self.index = 0, 0
+
+        self.settleTimer = QTimer(self)
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(settleInterval)
+        self.settleTimer.timeout.connect(self._emitAppended)
+
+    def _endPosition(self) -> tuple[int, int]:
+        lastLine = max(self.outputWidget.lines() - 1, 0)
+        return lastLine, len(self.outputWidget.text(lastLine))
+
+    def watch(self, outputWidget) -> None:
+        self.stop()
+        self.outputWidget = outputWidget
+        self.line, self.index = self._endPosition()
+        self.outputWidget.textChanged.connect(self.settleTimer.start)
+
+    def stop(self) -> None:
+        self.settleTimer.stop()
+        if self.outputWidget is not None:
+            try:
+                self.outputWidget.textChanged.disconnect(self.settleTimer.start)
+            except (TypeError, RuntimeError):
+                # already disconnected, or the console was closed
+                pass
+            self.outputWidget = None
+
+    def _emitAppended(self) -> None:
+        if self.outputWidget is None:
+            return
+
+        lineCount = self.outputWidget.lines()
+        if lineCount <= self.line or len(self.outputWidget.text(self.line)) < self.index:
+            # the console was cleared
+            self.line, self.index = 0, 0
+
+        appendedText = self.outputWidget.text(self.line)[self.index:]
+        appendedText += "".join(self.outputWidget.text(line) for line in range(self.line + 1, lineCount))
+        self.line, self.index = self._endPosition()
+
+        if appendedText:
+            self.outputAppended.emit(appendedText)
@@ -7,13 +7,14 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_cohere.embeddings import CohereEmbeddings
 from langchain_openai import ChatOpenAI
 
-from .utils import getCurrentTimeStamp, getVersion, pack, show_variable_popup, extractCode
+from .utils import getCurrentTimeStamp, getVersion, pack, show_variable_popup
 from .processor import Processor
 from .workflowManager import WorkflowManager
 
 
 class Conversation(QObject):
     llmResponse = pyqtSignal(str, str, str)
+    llmToken = pyqtSignal(str)
     llmReflection = pyqtSignal(str, str, str)
     llmInterrupted = pyqtSignal(str)
 
@@ -35,11 +36,12 @@ class Conversation(QObject):
         self.llmProvider, self.llmName = self.dataloader.getLLMInfo(self.llmID)
         # ONWORKING: model chooser logic
 
-        self.Processor = Processor(self.llmID, self.ID, retrivalDatabase, self.dataloader)
+        # the Processor is only built when the conversation talks to the llm, see `Processor`
+        self.retrivalDatabase = retrivalDatabase
+        self._processor = None
         self.workflowManager = WorkflowManager()
 
         self.modified = getCurrentTimeStamp()
-        self.codeList = []
 
     def __getattr__(self, name):
         # available variables: "ID", "llmID", "title", "description", "created", "modified", "messageCount",
@@ -57,6 +59,14 @@ class Conversation(QObject):
         else:
             super().__setattr__(name, value)
 
+    @property
+    def Processor(self) -> Processor:
+        if self._processor is None:
+            self._processor = Processor(self.llmID, self.ID, self.retrivalDatabase, self.dataloader)
+            # tokens of the response being generated, streamed to the dock
+            self._processor.tokenReceived.connect(self.llmToken)
+        return self._processor
+
     def updateUserPrompt(self, message, responseType):
         # TODO: make a queue for LLM reaction & user input
         if self.LLMFinished:
@@ -97,16 +107,22 @@ class Conversation(QObject):
         """
         Get entire conversation history from local database
         """
-        log = ""
-        interactionHistory = self.dataloader.selectInteraction(self.ID)
+        return self.fetchSince(None)
+
+    def fetchPage(self, beforeSeq=None, limit: int = 50) -> list[tuple]:
+        """
+        Get the `limit` interactions preceding the interaction `beforeSeq`, the newest ones when `beforeSeq` is `None`.
+        """
+        return self.dataloader.selectInteractionPage(self.ID, beforeSeq, limit)
 
-        # when fetching also get the models
-        for interaction in interactionHistory:
-            interactionDict = pack(interaction, "interaction")
-            if interactionDict["workflow"] in ["withModel", "withCode", "withToolbox"]:
-                self.codeList.append(extractCode(interactionDict["responseText"]))
+    def fetchSince(self, seq) -> list[tuple]:
+        """
+        Get the interactions stored after the interaction `seq`, the last element of each row is its `seq`.
+        """
+        return self.dataloader.selectInteractionSince(self.ID, seq)
 
-        return interactionHistory
+    def searchInteractionSeqs(self, keyword: str) -> list[int]:
+        return self.dataloader.searchInteractionSeqs(self.ID, keyword)
 
     def fetchTail(self):
         latestInteraction = self.dataloader.selectLatestInteraction(self.ID, self.Processor.latestInteractionID)
@@ -134,16 +150,18 @@ class Conversation(QObject):
     def updateReflection(self,
                          logMessage: str,
                          executedCode: str,
-                         responseType: str = "code") -> None:
+                         responseType: str = "code",
+                         interactionID: str = None) -> None:
         """
-        When reflection loop is triggered, go to processor for a bug-fix
+        When reflection loop is triggered, go to processor for a bug-fix of the workflow of `interactionID`
+        (the latest one when `None`)
         """
         if self.LLMFinished:
             self.messageCount += 1
             self.LLMFinished = False
 
             self.Processor.reflectionReady.connect(self.onReflectionReady)
-            self.Processor.asyncReflect(logMessage, executedCode, responseType)
+            self.Processor.asyncReflect(logMessage, executedCode, responseType, interactionID)
 
     def onReflectionReady(self, logMessage, responseType, response, workflow):
         self.LLMFinished = True
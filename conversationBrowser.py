@@ -0,0 +1,223 @@
+"""
+/***************************************************************************
+
+Conversation browser
+
+Model/view replacement of the conversation cards of the "Conversations"
+tab. A card is not a widget anymore: the list view asks the delegate to
+paint the cards that are visible, so opening, searching and cancelling a
+search only reset the rows of the model.
+
+Classes:
+    ConversationListModel: List of the conversation meta-information, in
+                           the order given by the Dataloader (most
+                           recently modified first).
+    ConversationCardDelegate: Paints a card (title, description, metadata
+                              and the "Edit", "Delete" and "Open" buttons)
+                              and emits `buttonClicked(action, ID)` when
+                              one of the painted buttons is clicked,
+                              unless `buttonsEnabled` is False.
+
+Usage:
+    - All cards have the same height, so the view can be used with
+      `setUniformItemSizes(True)`; long descriptions are cut to
+      `descriptionLines` lines.
+    - `highlightRule` of the model is applied to the escaped title and
+      description, e.g. to highlight the keyword of a search.
+    - A search result carries the "snippet" of the message that matched,
+      which replaces the description on its card, see
+      `Dataloader.searchConversations`.
+***************************************************************************/
+"""
+
+import html
+
+from .dataloader import SNIPPET_MARKERS
+
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QEvent, QModelIndex, QRect, QRectF, QSize, pyqtSignal
+from qgis.PyQt.QtGui import QAbstractTextDocumentLayout, QColor, QFont, QPainter, QPalette, QTextDocument
+from qgis.PyQt.QtWidgets import QStyledItemDelegate
+
+
+def snippetHtml(snippet: str) -> str:
+    """
+    HTML of a search snippet, the terms between `SNIPPET_MARKERS` are highlighted.
+    """
+    startMarker, endMarker = SNIPPET_MARKERS
+    return (html.escape(snippet)
+            .replace(startMarker, '<span style="background-color: yellow">')
+            .replace(endMarker, "</span>"))
+
+
+class ConversationListModel(QAbstractListModel):
+    MetaInfoRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.conversations = []
+        self.highlightRule = lambda text: text
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.conversations)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.conversations):
+            return None
+
+        metaInfo = self.conversations[index.row()]
+        if role == Qt.DisplayRole:
+            return metaInfo["title"]
+        elif role == Qt.ToolTipRole:
+            return metaInfo["description"]
+        elif role == self.MetaInfoRole:
+            return metaInfo
+        return None
+
+    def setConversations(self, conversations: list, highlightRule=None) -> None:
+        self.beginResetModel()
+        self.conversations = list(conversations)
+        self.highlightRule = highlightRule if highlightRule is not None else (lambda text: text)
+        self.endResetModel()
+
+    def rowOf(self, conversationID: str) -> int:
+        for row, metaInfo in enumerate(self.conversations):
+            if metaInfo["ID"] == conversationID:
+                return row
+        return -1
+
+    def upsertConversation(self, metaInfo: dict) -> None:
+        """
+        Put the card of `metaInfo` on top, replacing the previous card of the same conversation.
+        """
+        self.removeConversation(metaInfo["ID"])
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.conversations.insert(0, dict(metaInfo))
+        self.endInsertRows()
+
+    def removeConversation(self, conversationID: str) -> None:
+        row = self.rowOf(conversationID)
+        if row == -1:
+            return
+
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.conversations[row]
+        self.endRemoveRows()
+
+
+class ConversationCardDelegate(QStyledItemDelegate):
+    buttonClicked = pyqtSignal(str, str)
+
+    # (action, text, background color), from right to left the buttons are "Open", "Delete" and "Edit"
+    BUTTONS = [("edit", "Edit", "#9DDE8B"), ("delete", "Delete", "#FA7070"), ("open", "Open", None)]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.margin = 4
+        self.padding = 8
+        self.descriptionLines = 2
+        # the buttons are disabled with the other buttons of the dock while the llm responds
+        self.buttonsEnabled = True
+
+    def _layout(self, rect: QRect, fontMetrics) -> dict:
+        """
+        Rectangles of the parts of the card painted in `rect`.
+        """
+        lineHeight = fontMetrics.height()
+        buttonHeight = lineHeight + 8
+        card = rect.adjusted(self.margin, self.margin, -self.margin, -self.margin)
+        inner = card.adjusted(self.padding, self.padding, -self.padding, -self.padding)
+
+        top = inner.top()
+        titleRect = QRect(inner.left(), top, inner.width(), lineHeight)
+        top += lineHeight + 2
+        descriptionRect = QRect(inner.left(), top, inner.width(), lineHeight * self.descriptionLines)
+        top += lineHeight * self.descriptionLines + 4
+        metadataRect = QRect(inner.left(), top, inner.width(), lineHeight * 2)
+        top += lineHeight * 2 + 4
+
+        buttonRects = {}
+        right = inner.right() + 1
+        for action, text, _ in reversed(self.BUTTONS):
+            width = fontMetrics.horizontalAdvance(text) + 24
+            buttonRects[action] = QRect(right - width, top, width, buttonHeight)
+            right -= width + 6
+
+        return {"card": card, "title": titleRect, "description": descriptionRect, "metadata": metadataRect,
+                "buttons": buttonRects}
+
+    def sizeHint(self, option, index) -> QSize:
+        lineHeight = option.fontMetrics.height()
+        height = (2 * (self.margin + self.padding) + lineHeight + 2 + lineHeight * self.descriptionLines + 4
+                  + lineHeight * 2 + 4 + lineHeight + 8)
+        return QSize(option.rect.width(), height)
+
+    def _drawHtml(self, painter: QPainter, rect: QRect, htmlText: str, font: QFont, palette: QPalette) -> None:
+        document = QTextDocument()
+        document.setDefaultFont(font)
+        document.setDocumentMargin(0)
+        document.setTextWidth(rect.width())
+        document.setHtml(htmlText)
+
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette = palette
+        context.clip = QRectF(0, 0, rect.width(), rect.height())
+
+        painter.save()
+        painter.translate(rect.topLeft())
+        painter.setClipRect(context.clip)
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+    def paint(self, painter, option, index) -> None:
+        metaInfo = index.data(ConversationListModel.MetaInfoRole)
+        if metaInfo is None:
+            return
+
+        highlight = index.model().highlightRule
+        palette = option.palette
+        layout = self._layout(option.rect, option.fontMetrics)
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(palette.color(QPalette.Mid))
+        painter.setBrush(palette.color(QPalette.Base))
+        painter.drawRoundedRect(layout["card"], 4, 4)
+
+        titleFont = QFont(option.font)
+        titleFont.setBold(True)
+        self._drawHtml(painter, layout["title"], highlight(html.escape(metaInfo["title"])), titleFont, palette)
+        if metaInfo.get("snippet"):
+            descriptionHtml = snippetHtml(metaInfo["snippet"])
+        else:
+            descriptionHtml = highlight(html.escape(metaInfo["description"]))
+        self._drawHtml(painter, layout["description"], descriptionHtml, option.font, palette)
+
+        metadata = (f"Created: {metaInfo['created']} | LLM: {metaInfo['llmID']} \n "
+                    f"Messages: {metaInfo['messageCount']} | Workflow: {metaInfo['workflowCount']} ")
+        painter.setFont(option.font)
+        painter.setPen(palette.color(QPalette.Text))
+        painter.drawText(layout["metadata"], Qt.AlignRight | Qt.AlignVCenter, metadata)
+
+        painter.setOpacity(1.0 if self.buttonsEnabled else 0.4)
+        for action, text, color in self.BUTTONS:
+            buttonRect = layout["buttons"][action]
+            painter.setPen(palette.color(QPalette.Mid))
+            painter.setBrush(QColor(color) if color else palette.color(QPalette.Button))
+            painter.drawRoundedRect(buttonRect, 3, 3)
+            painter.setPen(QColor("black") if color else palette.color(QPalette.ButtonText))
+            painter.drawText(buttonRect, Qt.AlignCenter, text)
+
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        if (not self.buttonsEnabled or event.type() != QEvent.MouseButtonRelease
+                or event.button() != Qt.LeftButton):
+            return super().editorEvent(event, model, option, index)
+
+        metaInfo = index.data(ConversationListModel.MetaInfoRole)
+        for action, buttonRect in self._layout(option.rect, option.fontMetrics)["buttons"].items():
+            if metaInfo is not None and buttonRect.contains(event.pos()):
+                self.buttonClicked.emit(action, metaInfo["ID"])
+                return True
+
+        return super().editorEvent(event, model, option, index)
@@ -1,18 +1,31 @@
-import copy
 import sqlite3
 import os
+import re
 import json
+import time
+import threading
 import requests
 import logging
 from .utils import (getCurrentTimeStamp, pack, unpack, tuple2Dict, getSystemInfo, captchaPopup, getIntelligeoEnvVar,
-                    show_variable_popup)
+                    show_variable_popup, extractCode, extractXml, toBackendTimeStamp)
+from .connectionPool import getConnectionPool
+from .httpSession import getSession
+from .intentClassifier import LOCAL_PROMPT_ID
+from .migrations import migrate
+from .telemetry import getTelemetrySender
+from . import log_manager
+
+# marks the matched terms of a search snippet, see `Dataloader.searchConversations`
+SNIPPET_MARKERS = ("\x02", "\x03")
 
 
 class Dataloader:
+    # (promptType, clientVersion) pairs currently revalidated in a background thread
+    _revalidatingPrompts = set()
+    _revalidationLock = threading.Lock()
+
     def __init__(self, databaseName: str):
         self.databaseName = databaseName
-        self.connection = None
-        self.cursor = None
         self.llmFullDict = None
         self.llmEndpointDict = None
         self.apiKeyDict = None
@@ -21,6 +34,7 @@ class Dataloader:
             os.makedirs(folderPath)
 
         self.databasePath = os.path.join(folderPath, self.databaseName)
+        self._loadLLMConfig()
 
         # llm table
         self.llmTableName = "llm"
@@ -29,24 +43,56 @@ class Dataloader:
         # prompt table
         self.promptTableName = "prompt"
         self.promptTableColname = ["ID", "llmID", "version", "template", "promptType"]
+        # columns that cached the backend prompts in the prompt table, until migration 12 moved them to "promptCache"
+        self.promptCacheColname = ["clientVersion", "etag", "fetchedAt"]
+        # prompts fetched from the backend, keyed by (promptType, clientVersion)
+        self.promptCacheTableName = "promptCache"
+        # seconds before a cached prompt is revalidated against the backend
+        self.promptCacheTTL = 60 * 60
 
         # conversation table
         self.conversationTableName = "conversation"
         self.conversationTableColname = ["ID", "llmID", "title", "description", "created", "modified", "userID"]
+        # sortable form of "MM DD YYYY HH:MM:SS", indexed by migration 9 until migration 11 converted the timestamps
+        self.conversationModifiedKey = ("(substr(modified, 7, 4) || substr(modified, 1, 2) || substr(modified, 4, 2) "
+                                        "|| substr(modified, 12))")
 
         # interaction table
         self.interactionTableName = "interaction"
         self.interactionTableColname = ["ID", "conversationID", "promptID", "requestText", "contextText", "requestTime",
                                         "typeMessage", "responseText", "responseTime", "workflow", "executionLog"]
 
+        # interaction sequence table, next interaction index of each conversation
+        self.sequenceTableName = "interactionSequence"
+        self.sequenceTableColName = ["conversationID", "nextSeq"]
+
+        # full-text indexes of "conversation" and "interaction", see `migrations._fullTextSearch`
+        self.conversationSearchTableName = "conversationSearch"
+        self.interactionSearchTableName = "interactionSearch"
+        self._fullTextSearch = None
+
+        # workflow table, artifact extracted from each interaction that produced a workflow
+        self.workflowTableName = "workflow"
+        self.workflowTableColName = ["interactionID", "conversationID", "workflowType", "artifact"]
+
         # credential table
         self.credentialTableName = "credential"
         self.credentialTableColName = ["ID", "sessionID", "sessionKey"]
 
+        # outbox table, telemetry waiting to be sent to the backend
+        self.outboxTableName = "outbox"
+        self.outboxTableColName = ["ID", "endpoint", "payload", "created", "attempts"]
+        # telemetry fields holding a timestamp, converted by `postData`
+        self.timestampFields = {"created", "modified", "requestTime", "responseTime"}
+
         # backend url
         self.backendURL = "https://owsgip.itc.utwente.nl/intelligeo/"
+        self.requestTimeout = 10
         self.fromdev = getIntelligeoEnvVar("intelliGeo_fromdev") == "true"
 
+        # one persistent connection per thread, shared by every Dataloader of this database
+        self.pool = getConnectionPool(self.databasePath, self._bootstrap)
+
     def _checkExistence(self, tableName):
         """
         Checks whether a table with the specified name exists in the SQLite database.
@@ -69,25 +115,49 @@ class Dataloader:
         # Return True if the table exists, False otherwise
         return result is not None
 
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Connection of the calling thread, taken from the connection pool.
+        """
+        return self.pool.getConnection()
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        return self.pool.getCursor()
+
     def connect(self) -> None:
         """
         Connect and Initialization
-        If there is no existing database then create one.
+        If there is no existing database then create one. The schema is only created by the first connection of the
+        process, later calls (e.g. from worker threads) reuse the pooled connection of their thread.
         """
+        self.pool.getConnection()
 
-        self.connection = sqlite3.connect(self.databasePath)
-        self.cursor = self.connection.cursor()
+        # start delivering telemetry left in the outbox by a previous session
+        getTelemetrySender(self.databasePath, self.backendURL)
+
+    def _bootstrap(self, connection) -> None:
+        """
+        Bring the schema up to date, run once per process by the connection pool. Only the migrations newer than the
+        database's `PRAGMA user_version` are applied, so a warm start costs a single pragma read.
+        """
+        migrate(connection, self)
 
+    def _createInitialSchema(self) -> None:
+        """
+        Tables of the first schema version, see `migrations.py` for everything added since. Runs inside the
+        transaction of the migration, so nothing here commits.
+        """
         self._createLLMTable()
         self._createConversationTable()
         self._createPromptTable()
         self._createInteractionTable()
         self._createCrendentialTable()
 
-    def _createLLMTable(self):
+    def _loadLLMConfig(self):
         """
-        Create "llm" table if d not exist and insert "llm ID" and "llm ame".
-        Each row in table should look like: Cohere::command-r-plus, command-r-plus, ..., ...
+        Providers, model names, endpoints and default API keys of the supported llms.
         """
         # Full dict of llm names and providers. Will be used in `.getLLMInfo()`
         self.llmFullDict = dict()
@@ -99,6 +169,19 @@ class Dataloader:
                                     "deepseek-r1-distill-llama-70b-specdec", "llama-3.3-70b-versatile"]
         self.llmFullDict["default"] = ["default"]
 
+        # context window (tokens) of every model in `llmFullDict`, used to size the prompts
+        self.llmContextWindowDict = dict()
+        self.llmContextWindowDict.update({"gpt-4": 8192, "gpt-3.5-turbo": 16385, "o1": 200000})
+        self.llmContextWindowDict.update({"command-r-plus": 128000, "command-r": 128000, "command": 4096,
+                                          "command-nightly": 128000, "command-light": 4096,
+                                          "command-light-nightly": 4096})
+        self.llmContextWindowDict.update({"deepseek-chat": 64000, "deepseek-reasoner": 64000})
+        self.llmContextWindowDict.update({"mixtral-8x7b-32768": 32768, "qwen-2.5-32b": 128000,
+                                          "deepseek-r1-distill-qwen-32b": 128000,
+                                          "deepseek-r1-distill-llama-70b-specdec": 128000,
+                                          "llama-3.3-70b-versatile": 128000})
+        self.llmContextWindowDict["default"] = 8192
+
         self.llmEndpointDict = dict()
         self.llmEndpointDict["OpenAI"] = "https://api.openai.com/v1/chat/completions"
         self.llmEndpointDict["Cohere"] = "https://api.cohere.com/v1/chat"
@@ -113,6 +196,11 @@ class Dataloader:
         self.apiKeyDict["Groq"] = os.getenv("GROQ_API_KEY", "")
         self.apiKeyDict["default"] = "default"
 
+    def _createLLMTable(self):
+        """
+        Create "llm" table if d not exist and insert "llm ID" and "llm ame".
+        Each row in table should look like: Cohere::command-r-plus, command-r-plus, ..., ...
+        """
         # Create the table if it doesn't exist.
         columns = [
             "ID TEXT NOT NULL PRIMARY KEY",
@@ -123,6 +211,12 @@ class Dataloader:
         creationSQL = f"CREATE TABLE IF NOT EXISTS {self.llmTableName} ({', '.join(columns)})"
         self.cursor.execute(creationSQL)
 
+        self._insertLLMRows()
+
+    def _insertLLMRows(self):
+        """
+        Insert a row for every llm of `llmFullDict` that is not in the "llm" table yet.
+        """
         # Prepare the rows to be inserted.
         rowToInsert = []
         for llmProvider, llmNameList in self.llmFullDict.items():
@@ -138,8 +232,6 @@ class Dataloader:
             VALUES (?, ?, ?, ?)
         """, rowToInsert)
 
-        self.connection.commit()
-
     def _createPromptTable(self) -> None:
         """
         Create "prompt" table if not exist and insert "ID".
@@ -184,7 +276,6 @@ class Dataloader:
                             INSERT INTO {self.promptTableName} (ID, llmID, version, template, promptType)
                             VALUES (?, ?, ?, ?, ?)
                             """, rowToInsert)
-            self.connection.commit()
 
     def _createConversationTable(self):
         if not self._checkExistence(self.conversationTableName):
@@ -200,7 +291,6 @@ class Dataloader:
                        f"FOREIGN KEY (llmID) REFERENCES {self.llmTableName}(ID)"]
             createTableSql = f"CREATE TABLE IF NOT EXISTS {self.conversationTableName} ({', '.join(columns)})"
             self.cursor.execute(createTableSql)
-            self.connection.commit()
 
     def _createInteractionTable(self):
         if not self._checkExistence(self.interactionTableName):
@@ -225,7 +315,6 @@ class Dataloader:
             createIndexSql = (f"CREATE INDEX IF NOT EXISTS idxConversationID"
                               f" ON {self.interactionTableName} (conversationID)")
             self.cursor.execute(createIndexSql)
-            self.connection.commit()
 
     def _createCrendentialTable(self):
         if not self._checkExistence(self.credentialTableName):
@@ -243,20 +332,132 @@ class Dataloader:
             return "default", "default"
 
     def fetchPrompt(self, llmID, promptType, clientVersion: str = "0.0.3", testing: bool = False):
+        """
+        Return the prompt row of `promptType` as a dict with the keys of the "prompt" table.
+
+        Prompts are cached in the local "promptCache" table keyed by (promptType, clientVersion). A fresh cache entry is
+        returned without any network call; a stale one is returned immediately while it is revalidated against the
+        backend in a background thread (using the stored ETag). If the backend cannot be reached and nothing is cached,
+        the last known prompt of that type, or the one shipped with the plugin, is used instead.
+        `testing=True` bypasses the cache and always asks the backend.
+        """
         # note if newer version of intelligeo is developed the backend prompt table should also be renewed.
         # for easy-testing prompts, now all llms calling the same prompt stored under Cohere::command-r-plus
         # if any further commit updated this to each llm should use unique prompt please change this method
+        cachedPrompt = None if testing else self._selectCachedPrompt(self.cursor, promptType, clientVersion)
+        if cachedPrompt is not None:
+            promptRow, _, fetchedAt = cachedPrompt
+            if time.time() - fetchedAt > self.promptCacheTTL:
+                self._revalidatePromptInBackground(promptType, clientVersion)
+            return promptRow
+
+        try:
+            promptRow, etag = self._requestPrompt(promptType, clientVersion)
+        except (requests.exceptions.RequestException, ValueError) as error:
+            fallbackRow = self._selectFallbackPrompt(promptType)
+            if fallbackRow is None:
+                raise
+            log_manager.log_error(f"Prompt '{promptType}' served from local fallback", error)
+            return fallbackRow
+
+        self._storePrompt(self.connection, promptRow, promptType, clientVersion, etag)
+        return promptRow
+
+    def _requestPrompt(self, promptType, clientVersion, etag=None):
+        """
+        GET the prompt from the backend. Returns `(promptRow, etag)`, or `(None, etag)` when the backend answers
+        304 Not Modified to the `If-None-Match` revalidation.
+        """
         params = {
             'llmID': 'Cohere::command-r-plus',
             'promptType': promptType,
             'client_version': clientVersion
         }
+        headers = {"If-None-Match": etag} if etag else {}
 
         endpoint = f"{self.backendURL}/prompt_by/"
         # Send the GET request
-        response = requests.get(endpoint, params=params)
+        response = getSession().get(endpoint, params=params, headers=headers, timeout=self.requestTimeout)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+
+        return response.json(), response.headers.get("ETag")
+
+    def _selectCachedPrompt(self, cursor, promptType, clientVersion):
+        selectSQL = (f"SELECT ID, llmID, version, template, promptType, etag, fetchedAt "
+                     f"FROM {self.promptCacheTableName} WHERE promptType = ? AND clientVersion = ?")
+        cursor.execute(selectSQL, (promptType, clientVersion))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        return pack(row[:5], "prompt"), row[5], row[6] or 0.0
+
+    def _selectFallbackPrompt(self, promptType):
+        """
+        Offline fallback: the most recently fetched prompt of this type for any client version, otherwise the prompt
+        shipped with the plugin.
+        """
+        selectSQL = (f"SELECT ID, llmID, version, template, promptType FROM {self.promptCacheTableName} "
+                     f"WHERE promptType = ? ORDER BY fetchedAt DESC LIMIT 1")
+        self.cursor.execute(selectSQL, (promptType,))
+        row = self.cursor.fetchone()
+        if row is None:
+            selectSQL = (f"SELECT ID, llmID, version, template, promptType FROM {self.promptTableName} "
+                         f"WHERE promptType = ? AND llmID = 'Cohere::command-r-plus' LIMIT 1")
+            self.cursor.execute(selectSQL, (promptType,))
+            row = self.cursor.fetchone()
 
-        return response.json()
+        return pack(row, "prompt") if row is not None else None
+
+    def _storePrompt(self, connection, promptRow, promptType, clientVersion, etag):
+        # replaces the cached prompt of (promptType, clientVersion) only, whatever its backend ID
+        insertSQL = (f"INSERT OR REPLACE INTO {self.promptCacheTableName} "
+                     f"(ID, llmID, version, template, promptType, clientVersion, etag, fetchedAt) "
+                     f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+        connection.execute(insertSQL, (promptRow["ID"],
+                                       promptRow.get("llmID", "Cohere::command-r-plus"),
+                                       promptRow.get("version", 0),
+                                       promptRow["template"],
+                                       promptType,
+                                       clientVersion,
+                                       etag,
+                                       time.time()))
+        connection.commit()
+
+    def _revalidatePromptInBackground(self, promptType, clientVersion):
+        key = (promptType, clientVersion)
+        with Dataloader._revalidationLock:
+            if key in Dataloader._revalidatingPrompts:
+                return
+            Dataloader._revalidatingPrompts.add(key)
+
+        thread = threading.Thread(target=self._revalidatePrompt, args=(promptType, clientVersion), daemon=True)
+        thread.start()
+
+    def _revalidatePrompt(self, promptType, clientVersion):
+        # runs in its own thread, `self.connection` is the pooled connection of this thread, released by `close()`
+        connection = self.connection
+        try:
+            cachedPrompt = self._selectCachedPrompt(connection.cursor(), promptType, clientVersion)
+            etag = cachedPrompt[1] if cachedPrompt is not None else None
+            promptRow, etag = self._requestPrompt(promptType, clientVersion, etag)
+            if promptRow is None:
+                # 304 Not Modified, only renew the timestamp
+                connection.execute(f"UPDATE {self.promptCacheTableName} SET fetchedAt = ? "
+                                   f"WHERE promptType = ? AND clientVersion = ?",
+                                   (time.time(), promptType, clientVersion))
+                connection.commit()
+            else:
+                self._storePrompt(connection, promptRow, promptType, clientVersion, etag)
+        except Exception as error:
+            # keep serving the stale prompt, it is retried after the next lookup
+            log_manager.log_error(f"Failed to revalidate prompt '{promptType}'", error)
+        finally:
+            self.close()
+            with Dataloader._revalidationLock:
+                Dataloader._revalidatingPrompts.discard((promptType, clientVersion))
 
     def insertConversationInfo(self, conversationInfoDict):
         insertSQL = f"""
@@ -266,14 +467,13 @@ class Dataloader:
             """
         conversationInfoList = unpack(conversationInfoDict, "conversation")
         self.cursor.execute(insertSQL, conversationInfoList)
-        self.connection.commit()
 
         # TODO: remove after v0.0.4
-        if conversationInfoDict["llmID"] in ["DeepSeek::deepseek-chat", "DeepSeek::deepseek-reasoner"]:
-            conversationInfoDict["llmID"] = "Cohere::command-r"
-
+        telemetryDict = dict(conversationInfoDict)
+        if telemetryDict["llmID"] in ["DeepSeek::deepseek-chat", "DeepSeek::deepseek-reasoner"]:
+            telemetryDict["llmID"] = "Cohere::command-r"
 
-        self.postData("conversation", conversationInfoDict)
+        self.postData("conversation", telemetryDict)
 
     def updateAPIKey(self, apiKey, ID):
         _, oldAPIKey = self.fetchAPIKey(ID)
@@ -312,34 +512,139 @@ class Dataloader:
         return rows
 
     def selectConversationInfo(self, conversationID=None):
+        """
+        Select conversation meta-information. `messageCount` and `workflowCount` are aggregated from the
+        "interaction" table in the same statement, so the query count does not depend on the number of conversations.
+        All conversations are returned most recently modified first.
+        """
         if self.conversationTableName is None:
-            rowList = []
+            return []
+
+        if conversationID is None:
+            self.cursor.execute(self._conversationInfoSQL() + " ORDER BY c.modified DESC")
         else:
-            if conversationID is None:
-                selectSQL = f"SELECT * FROM {self.conversationTableName}"
-                self.cursor.execute(selectSQL)
-                rowList = tuple2Dict(self.cursor.fetchall(), "conversation")
-            else:
-                selectSQL = f"SELECT * FROM {self.conversationTableName} WHERE ID = ?"
-                self.cursor.execute(selectSQL, (conversationID,))
-                rowList = tuple2Dict(self.cursor.fetchall(), "conversation")
+            self.cursor.execute(self._conversationInfoSQL("conversationID = ?") + " WHERE c.ID = ?",
+                                (conversationID, conversationID))
+        rowList = tuple2Dict(self.cursor.fetchall(), "conversation")
+
+        return rowList if conversationID is None else rowList[0]
+
+    def _conversationInfoSQL(self, interactionFilter: str = None) -> str:
+        """
+        Select statement of the conversation meta-information, `interactionFilter` restricts the aggregated
+        interactions and must select the same conversations as the WHERE clause appended by the caller.
+        """
+        return f"""
+            SELECT c.ID, c.llmID, c.title, c.description, c.created, c.modified,
+                   COALESCE(counts.messageCount, 0), COALESCE(counts.workflowCount, 0), c.userID
+            FROM {self.conversationTableName} AS c
+            LEFT JOIN (
+                SELECT conversationID,
+                       SUM(typeMessage != 'internal') AS messageCount,
+                       SUM(workflow != 'empty') AS workflowCount
+                FROM {self.interactionTableName}
+                {"WHERE " + interactionFilter if interactionFilter else ""}
+                GROUP BY conversationID
+            ) AS counts ON counts.conversationID = c.ID
+            """
 
-            for row in rowList:
-                rowConversationID = row["ID"]
+    def hasFullTextSearch(self) -> bool:
+        if self._fullTextSearch is None:
+            self._fullTextSearch = (self._checkExistence(self.conversationSearchTableName)
+                                    and self._checkExistence(self.interactionSearchTableName))
+        return self._fullTextSearch
 
-                # Query to count rows with a specific conversationID
-                messageCountQuery = (f"SELECT COUNT(*) FROM {self.interactionTableName} WHERE conversationID = ?"
-                                     f"AND typeMessage != 'internal'")
-                self.cursor.execute(messageCountQuery, (rowConversationID,))
-                row["messageCount"] = self.cursor.fetchone()[0]
+    @staticmethod
+    def _ftsQuery(keyword: str) -> str:
+        """
+        FTS5 query matching every word of `keyword` as a prefix, the words are quoted so that the FTS5 syntax in user
+        input is not interpreted.
+        """
+        return " ".join(f'"{word}"*' for word in re.findall(r"\w+", keyword))
 
-                # Query to count rows with a specific conversationID and non-empty workflow
-                workflowCountQuery = (f"SELECT COUNT(*) FROM {self.interactionTableName} WHERE conversationID = ?"
-                                      f"AND workflow != 'empty'")
-                self.cursor.execute(workflowCountQuery, (rowConversationID,))
-                row["workflowCount"] = self.cursor.fetchone()[0]
+    @staticmethod
+    def _likePattern(keyword: str) -> str:
+        escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"%{escaped}%"
 
-        return rowList if conversationID is None else rowList[0]
+    def searchConversations(self, keyword: str, limit: int = 200) -> list[dict]:
+        """
+        Conversations whose title, description or displayed messages match `keyword`, best match first. Every
+        meta-information dict gets a "snippet" key: the matching part of the best message, the matched terms
+        surrounded by `SNIPPET_MARKERS`, or `None` when the title or description matched best. Without FTS5 the
+        conversations containing `keyword` are returned most recently modified first, without snippets.
+        """
+        if self.hasFullTextSearch():
+            query = self._ftsQuery(keyword)
+            if not query:
+                return []
+
+            startMarker, endMarker = SNIPPET_MARKERS
+            # SQLite takes the bare "snippet" column from the row holding MIN(rank)
+            searchSQL = f"""
+                WITH hits(conversationID, rank, snippet) AS (
+                    SELECT c.ID, {self.conversationSearchTableName}.rank, NULL
+                    FROM {self.conversationSearchTableName}
+                    JOIN {self.conversationTableName} AS c ON c.rowid = {self.conversationSearchTableName}.rowid
+                    WHERE {self.conversationSearchTableName} MATCH ?
+                    UNION ALL
+                    SELECT i.conversationID, {self.interactionSearchTableName}.rank,
+                           snippet({self.interactionSearchTableName}, -1, ?, ?, '...', 16)
+                    FROM {self.interactionSearchTableName}
+                    JOIN {self.interactionTableName} AS i ON i.rowid = {self.interactionSearchTableName}.rowid
+                    WHERE {self.interactionSearchTableName} MATCH ?
+                )
+                SELECT conversationID, MIN(rank) AS bestRank, snippet FROM hits
+                GROUP BY conversationID ORDER BY bestRank LIMIT ?
+                """
+            self.cursor.execute(searchSQL, (query, startMarker, endMarker, query, limit))
+        else:
+            pattern = self._likePattern(keyword)
+            searchSQL = f"""
+                SELECT c.ID, NULL, NULL FROM {self.conversationTableName} AS c
+                WHERE c.title LIKE ? ESCAPE '\\' OR c.description LIKE ? ESCAPE '\\' OR EXISTS (
+                    SELECT 1 FROM {self.interactionTableName} AS i
+                    WHERE i.conversationID = c.ID AND i.typeMessage IN ('input', 'return')
+                      AND (i.requestText LIKE ? ESCAPE '\\' OR i.responseText LIKE ? ESCAPE '\\'))
+                ORDER BY c.modified DESC LIMIT ?
+                """
+            self.cursor.execute(searchSQL, (pattern, pattern, pattern, pattern, limit))
+        hits = self.cursor.fetchall()
+        if not hits:
+            return []
+
+        placeholders = ", ".join("?" for _ in hits)
+        conversationIDs = [conversationID for conversationID, _, _ in hits]
+        self.cursor.execute(self._conversationInfoSQL(f"conversationID IN ({placeholders})")
+                            + f" WHERE c.ID IN ({placeholders})", conversationIDs + conversationIDs)
+        metaInfoDict = {metaInfo["ID"]: metaInfo for metaInfo in tuple2Dict(self.cursor.fetchall(), "conversation")}
+
+        results = []
+        for conversationID, _, snippet in hits:
+            if conversationID in metaInfoDict:
+                metaInfoDict[conversationID]["snippet"] = snippet
+                results.append(metaInfoDict[conversationID])
+        return results
+
+    def searchInteractionSeqs(self, conversationID: str, keyword: str) -> list[int]:
+        """
+        `seq` of the displayed interactions of `conversationID` matching `keyword`, in conversation order.
+        """
+        if self.hasFullTextSearch():
+            query = self._ftsQuery(keyword)
+            if not query:
+                return []
+            searchSQL = (f"SELECT i.seq FROM {self.interactionSearchTableName} "
+                         f"JOIN {self.interactionTableName} AS i ON i.rowid = {self.interactionSearchTableName}.rowid "
+                         f"WHERE {self.interactionSearchTableName} MATCH ? AND i.conversationID = ? ORDER BY i.seq")
+            self.cursor.execute(searchSQL, (query, conversationID))
+        else:
+            pattern = self._likePattern(keyword)
+            searchSQL = (f"SELECT seq FROM {self.interactionTableName} "
+                         f"WHERE conversationID = ? AND typeMessage IN ('input', 'return') "
+                         f"AND (requestText LIKE ? ESCAPE '\\' OR responseText LIKE ? ESCAPE '\\') ORDER BY seq")
+            self.cursor.execute(searchSQL, (conversationID, pattern, pattern))
+        return [row[0] for row in self.cursor.fetchall() if row[0] is not None]
 
     def deleteConversationInfo(self, conversationID):
         deleteSQL = f"DELETE FROM {self.conversationTableName} WHERE ID = ?"
@@ -366,6 +671,14 @@ class Dataloader:
                              messageCount, workflowCount, userID, conversationID))
         self.connection.commit()
 
+    def updateExecutionLog(self, interactionID: str, executionLog: dict) -> None:
+        """
+        Store the structured log of a workflow execution, see `executionEngine.CodeExecutionTask`, as JSON.
+        """
+        updateSQL = f"UPDATE {self.interactionTableName} SET executionLog = ? WHERE ID = ?"
+        self.cursor.execute(updateSQL, (json.dumps(executionLog), interactionID))
+        self.connection.commit()
+
     def loadCredential(self):
         querySQL = f"SELECT * FROM {self.credentialTableName} ORDER BY ID LIMIT 1"
         self.cursor.execute(querySQL)
@@ -399,29 +712,86 @@ class Dataloader:
         deleteSQL = f"DELETE from {self.interactionTableName} WHERE conversationID = ?"
         self.cursor.execute(deleteSQL, (conversationID,))
 
-    def insertInteraction(self, interactionInfo: list, conversationID: str) -> str:
-        # Get interaction index
-        messageCountQuery = (f"SELECT COUNT(*) FROM {self.interactionTableName} WHERE conversationID = ?"
-                             f"AND typeMessage != 'internal'")
-        self.cursor.execute(messageCountQuery, (conversationID,))
-        interactionIndex = conversationID + str(self.cursor.fetchone()[0])
-
-        # Insert row into "interaction" tablet
-        allColname = ", ".join(self.interactionTableColname)
-        insertSQL = (f"INSERT INTO {self.interactionTableName} ({allColname}) "
-                     f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
-        interaction = tuple([interactionIndex] + interactionInfo)
+        deleteSQL = f"DELETE from {self.sequenceTableName} WHERE conversationID = ?"
+        self.cursor.execute(deleteSQL, (conversationID,))
 
-        self.cursor.execute(insertSQL, interaction)
+        deleteSQL = f"DELETE from {self.workflowTableName} WHERE conversationID = ?"
+        self.cursor.execute(deleteSQL, (conversationID,))
         self.connection.commit()
 
-        interactionDict = pack(interaction, "interaction")
-        interactionDict["fromdev"] = self.fromdev
-        
-        self.postData("interaction", interactionDict)
+    def _allocateInteractionSeq(self, conversationID: str) -> int:
+        """
+        Reserve the next sequence number of `conversationID`. Must run inside the write transaction of the insert so
+        that concurrent workers never get the same number.
+        """
+        self.cursor.execute(f"INSERT OR IGNORE INTO {self.sequenceTableName} (conversationID, nextSeq) VALUES (?, 0)",
+                            (conversationID,))
+        self.cursor.execute(f"SELECT nextSeq FROM {self.sequenceTableName} WHERE conversationID = ?",
+                            (conversationID,))
+        seq = self.cursor.fetchone()[0]
+        self.cursor.execute(f"UPDATE {self.sequenceTableName} SET nextSeq = nextSeq + 1 WHERE conversationID = ?",
+                            (conversationID,))
+
+        return seq
+
+    def insertInteraction(self, interactionInfo: list, conversationID: str, tokenUsage: dict = None) -> str:
+        # take the write lock first, the sequence number and the row are written in one transaction
+        if self.connection.in_transaction:
+            self.connection.commit()
+        self.cursor.execute("BEGIN IMMEDIATE")
+
+        try:
+            # Get interaction index, the ID keeps the historic "<conversationID><index>" format
+            seq = self._allocateInteractionSeq(conversationID)
+            interactionIndex = conversationID + str(seq)
+
+            # Insert row into "interaction" tablet
+            allColname = ", ".join(self.interactionTableColname + ["seq", "tokenUsage"])
+            insertSQL = (f"INSERT INTO {self.interactionTableName} ({allColname}) "
+                         f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+            interaction = tuple([interactionIndex] + interactionInfo)
+            tokenUsageText = json.dumps(tokenUsage) if tokenUsage is not None else None
+
+            self.cursor.execute(insertSQL, interaction + (seq, tokenUsageText))
+
+            interactionDict = pack(interaction, "interaction")
+            self._insertWorkflow(interactionDict)
+
+            interactionDict["fromdev"] = self.fromdev
+
+            self.postData("interaction", interactionDict)
+        except Exception:
+            self.connection.rollback()
+            raise
 
         return interactionIndex
 
+    def _insertWorkflow(self, interactionDict: dict) -> None:
+        """
+        Extract the workflow of a "return" interaction once, so that opening it later is a primary key lookup.
+        """
+        workflowType = interactionDict["workflow"]
+        if interactionDict["typeMessage"] != "return" or workflowType not in ["withModel", "withCode", "withToolbox"]:
+            return
+
+        if workflowType == "withModel":
+            artifact = extractXml(interactionDict["responseText"])
+        else:
+            artifact = extractCode(interactionDict["responseText"])
+
+        insertSQL = (f"INSERT OR REPLACE INTO {self.workflowTableName} ({', '.join(self.workflowTableColName)}) "
+                     f"VALUES (?, ?, ?, ?)")
+        self.cursor.execute(insertSQL, (interactionDict["ID"], interactionDict["conversationID"], workflowType,
+                                        artifact))
+
+    def selectWorkflow(self, interactionID) -> tuple[str, str]:
+        """
+        Return `(workflowType, artifact)` of the interaction `interactionID`, `None` when it has no workflow.
+        """
+        selectSQL = f"SELECT workflowType, artifact FROM {self.workflowTableName} WHERE interactionID = ?"
+        self.cursor.execute(selectSQL, (interactionID,))
+        return self.cursor.fetchone()
+
     def selectInteraction(self, conversationID, columns=None):
         if columns:
             selectSQL = (f"SELECT {', '.join(columns)} FROM {self.interactionTableName} "
@@ -433,6 +803,44 @@ class Dataloader:
         rows = self.cursor.fetchall()
         return rows
 
+    def _displayedInteractionColumns(self) -> str:
+        """
+        Select list of the chat log: the columns of `interactionTableColname` followed by `seq`, with the large
+        "contextText" and "executionLog" replaced by empty strings.
+        """
+        columns = [f"'' AS {column}" if column in ["contextText", "executionLog"] else column
+                   for column in self.interactionTableColname]
+        return ", ".join(columns + ["seq"])
+
+    def selectInteractionSince(self, conversationID, seq=None) -> list:
+        """
+        Displayed interactions ("input" and "return") with a `seq` greater than `seq`, all of them when `seq` is
+        `None`, in conversation order. See `_displayedInteractionColumns` for the row layout.
+        """
+        selectSQL = (f"SELECT {self._displayedInteractionColumns()} FROM {self.interactionTableName} "
+                     f"WHERE conversationID = ? AND typeMessage IN (?, ?)")
+        parameters = [conversationID, "input", "return"]
+        if seq is not None:
+            selectSQL += " AND seq > ?"
+            parameters.append(seq)
+        self.cursor.execute(selectSQL + " ORDER BY seq", parameters)
+        return self.cursor.fetchall()
+
+    def selectInteractionPage(self, conversationID, beforeSeq=None, limit: int = 50) -> list:
+        """
+        The newest `limit` displayed interactions with a `seq` lower than `beforeSeq` (the newest of all when
+        `None`), returned in conversation order. Walks `idxConversationSeq`, so a page costs the same in long and
+        short conversations.
+        """
+        selectSQL = (f"SELECT {self._displayedInteractionColumns()} FROM {self.interactionTableName} "
+                     f"WHERE conversationID = ? AND typeMessage IN (?, ?)")
+        parameters = [conversationID, "input", "return"]
+        if beforeSeq is not None:
+            selectSQL += " AND seq < ?"
+            parameters.append(beforeSeq)
+        self.cursor.execute(selectSQL + " ORDER BY seq DESC LIMIT ?", parameters + [limit])
+        return self.cursor.fetchall()[::-1]
+
     def selectLatestInteraction(self, conversationID, interactionID=None):
         if interactionID is not None:
             selectSQL = (f"SELECT * FROM {self.interactionTableName} "
@@ -442,53 +850,46 @@ class Dataloader:
             if row is not None:
                 return row
 
-        rows = self.selectInteraction(conversationID)
-        processedRows = []
-        for row in rows:
-            packedRow = pack(row, "interaction")
-            if packedRow["conversationID"] in packedRow["ID"]:
-                processedRows.append(list(row) + [int(packedRow["ID"][len(packedRow["conversationID"]):])])
+        selectSQL = (f"SELECT * FROM {self.interactionTableName} "
+                     f"WHERE conversationID = ? AND typeMessage IN (?, ?) "
+                     f"ORDER BY seq DESC LIMIT 1")
+        self.cursor.execute(selectSQL, (conversationID, "input", "return"))
+        return self.cursor.fetchone()
+
+    def selectClassifierPairs(self) -> list:
+        """
+        `(requestText, decision)` of every decision the LLM classifier took, used to train the local classifier.
+        """
+        selectSQL = (f"SELECT requestText, responseText FROM {self.interactionTableName} "
+                     f"WHERE typeMessage = ? AND promptID != ?")
+        self.cursor.execute(selectSQL, ("input", LOCAL_PROMPT_ID))
+        return self.cursor.fetchall()
 
-        sortedRows = sorted(processedRows, key=lambda x: x[-1])
-        return sortedRows[-1][:-1]
+    def countClassifierPairs(self) -> int:
+        selectSQL = (f"SELECT COUNT(*) FROM {self.interactionTableName} "
+                     f"WHERE typeMessage = ? AND promptID != ?")
+        self.cursor.execute(selectSQL, ("input", LOCAL_PROMPT_ID))
+        return self.cursor.fetchone()[0]
 
     def postData(self, endpoint, data):
-        payload = data
-        header = getSystemInfo()
-
-        while True:
-            dataDict = copy.deepcopy(data)
-            sessionID, sessionKey = self.loadCredential()
-            dataDict["sessionID"] = sessionID
-            dataDict["sessionKey"] = sessionKey
-            try:
-                response = requests.post(f"{self.backendURL}/{endpoint}", json=dataDict, headers=header)
-                if response.status_code == 200:
-                    break
-                else:
-                    errorResponse = response.json()
-                    captchaDict = errorResponse.get('detail', {})
-                    answer = captchaPopup(captchaDict)
-                    body = {"answer": answer}
-
-                    header = getSystemInfo()
-                    header["sendtime"] = getCurrentTimeStamp()
-
-                    response = requests.post(f"{self.backendURL}/register", headers=header, json=body)
-                    if response.status_code == 200:
-                        response_data = response.json()
-
-                        # Extract the credentials
-                        sessionID = response_data.get("sessionID")
-                        sessionKey = response_data.get("sessionKey")
-                        self.updateCredential(sessionID, sessionKey)
-
-            except requests.exceptions.HTTPError as httpErr:
-                continue
+        """
+        Queue `data` for the backend `endpoint` in the "outbox" table and return immediately. The pending
+        transaction (e.g. the row the telemetry describes) is committed together with the outbox row, the
+        background `TelemetrySender` delivers it. Timestamps are sent in the format of the backend.
+        """
+        data = {key: toBackendTimeStamp(value) if key in self.timestampFields else value for key, value in data.items()}
+        insertSQL = (f"INSERT INTO {self.outboxTableName} (endpoint, payload, created) "
+                     f"VALUES (?, ?, ?)")
+        self.cursor.execute(insertSQL, (endpoint, json.dumps(data), getCurrentTimeStamp()))
+        self.connection.commit()
+
+        getTelemetrySender(self.databasePath, self.backendURL).notify()
 
     def updateData(self, endpoint, ID, data):
-        response = requests.put(f"{self.backendURL}/{endpoint}/{ID}", json=data)
+        response = getSession().put(f"{self.backendURL}/{endpoint}/{ID}", json=data, timeout=self.requestTimeout)
 
     def close(self):
-        if self.connection:
-            self.connection.close()
+        """
+        Close the pooled connection of the calling thread.
+        """
+        self.pool.release()
@@ -1,3 +1,5 @@
+import threading
+
 from qgis.core import QgsProject, QgsMapLayer, Qgis
 
 
@@ -16,56 +18,188 @@ class QgisEnvironment():
         self.layers = self.project.mapLayers().values()
 
     def getLayerAttributes(self):
-        envInfo = ''
-        envInfo += f'Total number of layers: {len(self.layers)}\n'
+        envInfo = [f'Total number of layers: {len(self.layers)}\n']
         for layer in self.layers:
-            envInfo += '\n'
-            layerName = layer.name()
-            envInfo += f'Layer Name: {layerName};\n'
-            envInfo += f'    Layer Type: {str(layer.type())};\n'
-            if layer.type() == QgsMapLayer.VectorLayer:
-                # get EPSG
-                crs = layer.crs()
-                epsgCode = crs.authid().split(':')[-1]
-                envInfo += f'    EPSG Code: {epsgCode};\n'
-
-                # get extent
-                extent = layer.extent()
-                xmin, ymin = extent.xMinimum(), extent.yMinimum()
-                xmax, ymax = extent.xMaximum(), extent.yMaximum()
-                envInfo += f'    Extent: {xmin}, {ymin}, {xmax}, {ymax};\n'
-
-                # get geometry type
-                geometryType = str(layer.geometryType())
-                envInfo += f'    Geometry Type: {geometryType};\n'
-
-            elif layer.type() == QgsMapLayer.RasterLayer:
-                # get EPSG
-                crs = layer.crs()
-                epsgCode = crs.authid().split(':')[-1]
-                envInfo += f'    EPSG Code: {epsgCode};\n'
-
-                # get extent
-                extent = layer.extent()
-                xmin, ymin = extent.xMinimum(), extent.yMinimum()
-                xmax, ymax = extent.xMaximum(), extent.yMaximum()
-                envInfo += f'    Extent: {xmin}, {ymin}, {xmax}, {ymax};\n'
-
-                # get resolution
-                pixelSizeX = str(layer.rasterUnitsPerPixelX())
-                pixelSizeY = str(layer.rasterUnitsPerPixelY())
-                envInfo += f'    Resolution: {pixelSizeX}, {pixelSizeY};\n'
-
-                # get attributes
-                provider = layer.dataProvider()
-                bandCount = provider.bandCount()
-                envInfo += f'    Attributes:\n'
-                for i in range(1, bandCount + 1):
-                    bandType = provider.sourceDataType(i)
-                    envInfo += f'        Band Number: {str(i)}, Data Type: {bandType};\n'
-
-            else:
-                envInfo += f"Layer name: {layerName} - Type: Unknown;"
-
-        return envInfo
+            envInfo.append(describeLayer(layer))
+
+        return "".join(envInfo)
+
+
+def describeLayer(layer) -> str:
+    """
+    Description of one layer in the format of `QgisEnvironment.getLayerAttributes`.
+    """
+    layerInfo = ['\n']
+    layerName = layer.name()
+    layerInfo.append(f'Layer Name: {layerName};\n')
+    layerInfo.append(f'    Layer Type: {str(layer.type())};\n')
+    if layer.type() in [QgsMapLayer.VectorLayer, QgsMapLayer.RasterLayer]:
+        # get EPSG
+        crs = layer.crs()
+        epsgCode = crs.authid().split(':')[-1]
+        layerInfo.append(f'    EPSG Code: {epsgCode};\n')
+
+        # get extent
+        extent = layer.extent()
+        xmin, ymin = extent.xMinimum(), extent.yMinimum()
+        xmax, ymax = extent.xMaximum(), extent.yMaximum()
+        layerInfo.append(f'    Extent: {xmin}, {ymin}, {xmax}, {ymax};\n')
+
+    if layer.type() == QgsMapLayer.VectorLayer:
+        # get geometry type
+        geometryType = str(layer.geometryType())
+        layerInfo.append(f'    Geometry Type: {geometryType};\n')
+
+    elif layer.type() == QgsMapLayer.RasterLayer:
+        # get resolution
+        pixelSizeX = str(layer.rasterUnitsPerPixelX())
+        pixelSizeY = str(layer.rasterUnitsPerPixelY())
+        layerInfo.append(f'    Resolution: {pixelSizeX}, {pixelSizeY};\n')
+
+        # get attributes
+        provider = layer.dataProvider()
+        bandCount = provider.bandCount()
+        layerInfo.append(f'    Attributes:\n')
+        for i in range(1, bandCount + 1):
+            bandType = provider.sourceDataType(i)
+            layerInfo.append(f'        Band Number: {str(i)}, Data Type: {bandType};\n')
+
+    else:
+        layerInfo.append(f"Layer name: {layerName} - Type: Unknown;")
+
+    return "".join(layerInfo)
+
+
+class EnvironmentSnapshot:
+    """
+    Cached `QgisEnvironment.getLayerAttributes` text. The description of each layer is kept and only rebuilt after
+    one of the layer's change signals fired, the full text is only recomposed after a change, so reading an
+    unchanged project is O(1).
+
+    The signals are delivered to the thread that connected them, `attach` must therefore run on the main thread.
+    Until it did, `text` describes every layer on each call.
+    """
+    # per-layer signals invalidating the description, looked up by name as they differ between QGIS versions
+    layerSignalNames = ["nameChanged", "crsChanged", "extentChanged", "dataSourceChanged", "dataChanged"]
+
+    def __init__(self):
+        self.project = QgsProject.instance()
+        self.attached = False
+        self.layerDescriptions = {}
+        self.layerConnections = {}
+        self.dirtyLayerIDs = set()
+        self.cachedText = None
+        self.lock = threading.RLock()
+
+    def attach(self) -> None:
+        if self.attached:
+            return
+
+        self.project.layersAdded.connect(self.onLayersAdded)
+        self.project.layersRemoved.connect(self.onLayersRemoved)
+        self.project.crsChanged.connect(self.invalidate)
+        self.project.cleared.connect(self.reset)
+        self.attached = True
+        self.reset()
+
+    def detach(self) -> None:
+        if not self.attached:
+            return
+
+        self.project.layersAdded.disconnect(self.onLayersAdded)
+        self.project.layersRemoved.disconnect(self.onLayersRemoved)
+        self.project.crsChanged.disconnect(self.invalidate)
+        self.project.cleared.disconnect(self.reset)
+        for layerID in list(self.layerConnections):
+            self._disconnectLayer(layerID)
+        self.attached = False
+        self.invalidate()
+
+    def _connectLayer(self, layer) -> None:
+        layerID = layer.id()
+        connections = []
+        for signalName in self.layerSignalNames:
+            signal = getattr(layer, signalName, None)
+            if signal is None:
+                continue
+            slot = lambda *args, changedLayerID=layerID: self.markDirty(changedLayerID)
+            signal.connect(slot)
+            connections.append((signal, slot))
+        self.layerConnections[layerID] = connections
+
+    def _disconnectLayer(self, layerID) -> None:
+        for signal, slot in self.layerConnections.pop(layerID, []):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                # the layer object is already deleted
+                pass
+
+    def reset(self) -> None:
+        with self.lock:
+            for layerID in list(self.layerConnections):
+                self._disconnectLayer(layerID)
+            self.layerDescriptions = {}
+            self.dirtyLayerIDs = set()
+            self.cachedText = None
+            if self.attached:
+                self.onLayersAdded(list(self.project.mapLayers().values()))
+
+    def onLayersAdded(self, layers) -> None:
+        with self.lock:
+            for layer in layers:
+                self._connectLayer(layer)
+                self.dirtyLayerIDs.add(layer.id())
+            self.cachedText = None
+
+    def onLayersRemoved(self, layerIDs) -> None:
+        with self.lock:
+            for layerID in layerIDs:
+                self._disconnectLayer(layerID)
+                self.layerDescriptions.pop(layerID, None)
+                self.dirtyLayerIDs.discard(layerID)
+            self.cachedText = None
+
+    def markDirty(self, layerID) -> None:
+        with self.lock:
+            self.dirtyLayerIDs.add(layerID)
+            self.cachedText = None
+
+    def invalidate(self, *args) -> None:
+        with self.lock:
+            self.cachedText = None
+
+    def text(self) -> str:
+        if not self.attached:
+            environment = QgisEnvironment()
+            return environment.getLayerAttributes()
+
+        with self.lock:
+            if self.cachedText is not None:
+                return self.cachedText
+
+            layers = self.project.mapLayers()
+            for layerID in self.dirtyLayerIDs:
+                if layerID in layers:
+                    self.layerDescriptions[layerID] = describeLayer(layers[layerID])
+            self.dirtyLayerIDs = set()
+
+            envInfo = [f'Total number of layers: {len(layers)}\n']
+            for layerID, layer in layers.items():
+                if layerID not in self.layerDescriptions:
+                    self.layerDescriptions[layerID] = describeLayer(layer)
+                envInfo.append(self.layerDescriptions[layerID])
+            self.cachedText = "".join(envInfo)
+            return self.cachedText
+
+
+_environmentSnapshot = None
+_environmentSnapshotLock = threading.Lock()
+
 
+def getEnvironmentSnapshot() -> EnvironmentSnapshot:
+    global _environmentSnapshot
+    with _environmentSnapshotLock:
+        if _environmentSnapshot is None:
+            _environmentSnapshot = EnvironmentSnapshot()
+        return _environmentSnapshot
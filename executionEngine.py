@@ -0,0 +1,347 @@
+"""
+/***************************************************************************
+
+Execution engine
+
+Runs the PyQGIS code of a generated workflow in a QgsTask, so long
+processing calls do not freeze QGIS. The task appears in the task manager
+of the status bar, which shows its progress and lets the user cancel it.
+
+Classes:
+    CodeExecutionTask: QgsTask executing one code block and producing a
+                       structured execution log (status, error type,
+                       message, line, traceback of the generated code and
+                       printed output).
+    ExecutionEngine: Starts the tasks and emits
+                     `executionFinished(interactionID, conversationID,
+                     executionLog)` on the main thread.
+
+Usage:
+    - The code is rewritten before it runs (see `prepareCode`): the calls
+      on `iface`, on the GUI objects taken from it (`IFACE_GUI_OBJECTS`,
+      e.g. `canvas = iface.mapCanvas()`) and the layer calls of
+      `MAIN_THREAD_METHODS` run on the main thread while the task waits for
+      their result, so `layer = iface.addVectorLayer(...)` gets the layer.
+      Statements that only change the GUI (`GUI_CHANGING_PREFIXES`, e.g.
+      `canvas.refresh()`) and whose result is not used are queued and
+      replayed once the task finished. `processing.run` receives the
+      feedback of the task, so its progress is shown and it can be
+      cancelled. `processing.runAndLoadResults` runs in the task and only
+      the loading of its results is queued.
+    - GUI objects reached in another way (attributes, function arguments,
+      loop variables, ...) are not tracked, their calls run in the task.
+    - `formatExecutionLog` renders an execution log for the reflection
+      prompt, see `Processor.reflect`.
+***************************************************************************/
+"""
+
+import ast
+import os
+import time
+import traceback
+
+from qgis.core import (QgsApplication, QgsMapLayer, QgsProcessingFeedback, QgsProject, QgsRasterLayer, QgsTask,
+                       QgsVectorLayer)
+from qgis.PyQt.QtCore import Qt, QCoreApplication, QObject, QThread, pyqtSignal
+
+CODE_FILENAME = "<IntelliGeo workflow>"
+MAIN_THREAD_METHODS = {"addMapLayer", "addMapLayers", "removeMapLayer", "removeMapLayers"}
+# `iface` methods returning GUI objects, the names these are assigned to are routed like `iface`
+IFACE_GUI_OBJECTS = {"mapCanvas", "mainWindow", "messageBar", "layerTreeView", "layerTreeCanvasBridge",
+                     "statusBarIface", "mapNavToolToolBar"}
+# calls with these prefixes change the GUI and are queued when their result is not used, the other main thread
+# calls run there right away. `add*Layer` calls always run right away, their layer is used by the next lines.
+GUI_CHANGING_PREFIXES = ("add", "remove", "set", "push", "show", "open", "close", "clear", "refresh", "redraw",
+                         "reload", "zoom", "pan", "insert", "delete", "newProject", "save")
+# output kept in the execution log, from the end
+OUTPUT_LIMIT = 4000
+
+
+def _rootName(node):
+    while isinstance(node, (ast.Attribute, ast.Call)):
+        node = node.value if isinstance(node, ast.Attribute) else node.func
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _isGuiChanging(function) -> bool:
+    if not isinstance(function, ast.Attribute):
+        return False
+    if function.attr.startswith("add") and function.attr.endswith(("Layer", "Layers")):
+        return False
+    return function.attr.startswith(GUI_CHANGING_PREFIXES) or function.attr in MAIN_THREAD_METHODS
+
+
+class _MainThreadCallTransformer(ast.NodeTransformer):
+    def __init__(self):
+        super().__init__()
+        # names bound to a GUI object of `iface`, see `IFACE_GUI_OBJECTS`
+        self.guiNames = {"iface"}
+
+    def _isGuiObject(self, node) -> bool:
+        return (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in IFACE_GUI_OBJECTS and _rootName(node.func) in self.guiNames)
+
+    def visit_Assign(self, node):
+        isGuiObject = self._isGuiObject(node.value)
+        self.generic_visit(node)
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if isGuiObject:
+                    self.guiNames.add(target.id)
+                else:
+                    self.guiNames.discard(target.id)
+        return node
+
+    def visit_Expr(self, node):
+        # the result of a bare call is not used, so it can be queued
+        if isinstance(node.value, ast.Call):
+            node.value = self._visitCall(node.value, resultUsed=False)
+            return node
+        self.generic_visit(node)
+        return node
+
+    def visit_Call(self, node):
+        return self._visitCall(node, resultUsed=True)
+
+    def _visitCall(self, node, resultUsed: bool):
+        function = node.func
+        isMainThreadMethod = isinstance(function, ast.Attribute) and function.attr in MAIN_THREAD_METHODS
+        if _rootName(function) in self.guiNames or isMainThreadMethod:
+            # the callee is resolved in the task, the call itself is queued or run on the main thread
+            if isinstance(function, ast.Attribute):
+                function.value = self.visit(function.value)
+            node.args = [self.visit(argument) for argument in node.args]
+            node.keywords = [self.visit(keyword) for keyword in node.keywords]
+            if not resultUsed and _isGuiChanging(function):
+                wrapper = "__deferToMainThread__"
+            else:
+                wrapper = "__callOnMainThread__"
+            return ast.copy_location(ast.Call(func=ast.Name(id=wrapper, ctx=ast.Load()),
+                                              args=[function] + node.args, keywords=node.keywords), node)
+
+        self.generic_visit(node)
+        if (isinstance(function, ast.Attribute) and isinstance(function.value, ast.Name)
+                and function.value.id == "processing" and function.attr in ["run", "runAndLoadResults"]):
+            if function.attr == "runAndLoadResults":
+                node.func = ast.copy_location(ast.Name(id="__runAndLoadResults__", ctx=ast.Load()), function)
+            if not any(keyword.arg == "feedback" for keyword in node.keywords):
+                node.keywords.append(ast.keyword(arg="feedback", value=ast.Name(id="__feedback__", ctx=ast.Load())))
+        return node
+
+
+def prepareCode(code: str):
+    """
+    Parse `code` and route its main thread calls, see the module documentation. Raises `SyntaxError`.
+    """
+    tree = _MainThreadCallTransformer().visit(ast.parse(code, CODE_FILENAME))
+    return ast.fix_missing_locations(tree)
+
+
+def _loadLayer(path: str, name: str) -> None:
+    layer = QgsVectorLayer(path, name, "ogr")
+    if not layer.isValid():
+        layer = QgsRasterLayer(path, name)
+    if layer.isValid():
+        QgsProject.instance().addMapLayer(layer)
+
+
+def formatExecutionLog(executionLog: dict) -> str:
+    lines = [f"{executionLog.get('errorType', 'Error')}: {executionLog.get('message', '')}"]
+    if executionLog.get("line"):
+        lines.append(f"  at line {executionLog['line']}: {executionLog.get('code', '')}")
+    # a single frame is the line above
+    frames = executionLog.get("traceback", [])
+    for frame in frames if len(frames) > 1 else []:
+        lines.append(f"  line {frame['line']}, in {frame['function']}: {frame['code']}")
+    if executionLog.get("output"):
+        lines.append("Output:")
+        lines.append(executionLog["output"])
+    return "\n".join(lines)
+
+
+def _moveToMainThread(values) -> None:
+    mainThread = QCoreApplication.instance().thread()
+    for value in values:
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            # objects created in the task belong to its thread until they are moved
+            if isinstance(item, QObject) and item.thread() != mainThread:
+                item.moveToThread(mainThread)
+
+
+class _MainThreadInvoker(QObject):
+    """
+    Runs a call on the thread of the invoker (the main thread), the calling thread waits for its result.
+    """
+    invoke = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.invoke.connect(self._invoke, Qt.BlockingQueuedConnection)
+
+    def _invoke(self, call) -> None:
+        call()
+
+    def call(self, function, *args, **kwargs):
+        if QThread.currentThread() == self.thread():
+            return function(*args, **kwargs)
+
+        outcome = {}
+
+        def call():
+            try:
+                outcome["result"] = function(*args, **kwargs)
+            except BaseException as error:
+                outcome["error"] = error
+
+        self.invoke.emit(call)
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+
+class CodeExecutionTask(QgsTask):
+    executionFinished = pyqtSignal(str, str, object)
+
+    def __init__(self, code: str, interactionID: str, conversationID: str):
+        super().__init__(f"IntelliGeo: run workflow {interactionID}", QgsTask.CanCancel)
+        self.code = code
+        self.interactionID = interactionID
+        self.conversationID = conversationID
+        self.codeLines = code.splitlines()
+
+        self.feedback = QgsProcessingFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+        self.deferredCalls = []
+        # created here, on the main thread
+        self.invoker = _MainThreadInvoker()
+        self.outputParts = []
+        self.executionLog = {}
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def _print(self, *values, sep=" ", end="\n", **kwargs):
+        # print() of the generated code, kept for the log instead of writing to the shared sys.stdout
+        self.outputParts.append(sep.join(str(value) for value in values) + end)
+
+    def _deferToMainThread(self, function, *args, **kwargs):
+        _moveToMainThread(list(args) + list(kwargs.values()))
+        self.deferredCalls.append((function, args, kwargs))
+
+    def _callOnMainThread(self, function, *args, **kwargs):
+        _moveToMainThread(list(args) + list(kwargs.values()))
+        return self.invoker.call(function, *args, **kwargs)
+
+    def _runAndLoadResults(self, algorithm, parameters, *args, **kwargs):
+        import processing
+
+        results = processing.run(algorithm, parameters, *args, **kwargs)
+        for name, value in results.items():
+            if isinstance(value, QgsMapLayer):
+                self._deferToMainThread(QgsProject.instance().addMapLayer, value)
+            elif isinstance(value, str) and os.path.isfile(value):
+                self.deferredCalls.append((_loadLayer, (value, name), {}))
+        return results
+
+    def _namespace(self) -> dict:
+        from qgis.utils import iface
+
+        return {"__name__": "__intelligeo__",
+                "iface": iface,
+                "print": self._print,
+                "__feedback__": self.feedback,
+                "__deferToMainThread__": self._deferToMainThread,
+                "__callOnMainThread__": self._callOnMainThread,
+                "__runAndLoadResults__": self._runAndLoadResults}
+
+    def _output(self) -> str:
+        return "".join(self.outputParts)[-OUTPUT_LIMIT:]
+
+    def _errorLog(self, error: BaseException, startTime: float) -> dict:
+        line = getattr(error, "lineno", None) if isinstance(error, SyntaxError) else None
+        frames = []
+        for frame in traceback.extract_tb(error.__traceback__):
+            if frame.filename == CODE_FILENAME:
+                frames.append({"line": frame.lineno, "function": frame.name, "code": self._codeLine(frame.lineno)})
+                line = frame.lineno
+
+        return {"status": "error",
+                "errorType": type(error).__name__,
+                "message": str(error),
+                "line": line,
+                "code": self._codeLine(line),
+                "traceback": frames,
+                "output": self._output(),
+                "duration": round(time.monotonic() - startTime, 3)}
+
+    def _codeLine(self, line) -> str:
+        if line and 0 < line <= len(self.codeLines):
+            return self.codeLines[line - 1].strip()
+        return ""
+
+    def run(self) -> bool:
+        startTime = time.monotonic()
+        try:
+            codeObject = compile(prepareCode(self.code), CODE_FILENAME, "exec")
+            exec(codeObject, self._namespace())
+        except BaseException as error:
+            # also `sys.exit()` of the generated code, which must not end the task manager thread
+            if self.isCanceled():
+                self.executionLog = {"status": "cancelled", "output": self._output()}
+            else:
+                self.executionLog = self._errorLog(error, startTime)
+            return False
+
+        if self.isCanceled():
+            self.executionLog = {"status": "cancelled", "output": self._output()}
+            return False
+
+        self.executionLog = {"status": "success",
+                             "output": self._output(),
+                             "deferredCalls": len(self.deferredCalls),
+                             "duration": round(time.monotonic() - startTime, 3)}
+        return True
+
+    def finished(self, result: bool) -> None:
+        # main thread
+        if result:
+            startTime = time.monotonic()
+            for function, args, kwargs in self.deferredCalls:
+                try:
+                    function(*args, **kwargs)
+                except Exception as error:
+                    self.executionLog = self._errorLog(error, startTime)
+                    self.executionLog["stage"] = "mainThread"
+                    break
+        elif not self.executionLog:
+            # cancelled before `run` started
+            self.executionLog = {"status": "cancelled", "output": ""}
+
+        self.executionFinished.emit(self.interactionID, self.conversationID, self.executionLog)
+
+
+class ExecutionEngine(QObject):
+    executionFinished = pyqtSignal(str, str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # the task manager does not keep the Python wrappers alive
+        self.tasks = {}
+
+    def run(self, code: str, interactionID: str, conversationID: str) -> None:
+        task = CodeExecutionTask(code, interactionID, conversationID)
+        task.executionFinished.connect(self._onTaskFinished)
+        self.tasks[interactionID] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def isRunning(self) -> bool:
+        return bool(self.tasks)
+
+    def cancel(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+
+    def _onTaskFinished(self, interactionID: str, conversationID: str, executionLog: dict) -> None:
+        self.tasks.pop(interactionID, None)
+        self.executionFinished.emit(interactionID, conversationID, executionLog)
@@ -22,11 +22,11 @@ class HoverComboBox(QComboBox):
                 self.last_hovered_item = item_text
                 self.hovered.emit(item_text)  # Emit the signal with the new item
 
-    def add_item_with_action(self, item_text, hoverAction):
+    def add_item_with_action(self, item_text, hoverAction, item_data=None):
         """
         Add an item to the combo box and connect it to a hover action.
         """
-        self.addItem(item_text)  # Add the new item
+        self.addItem(item_text, item_data)  # Add the new item
         self.hovered.connect(hoverAction)  # Connect the hover signal to the action
 
     def clear_hover_state(self):
@@ -0,0 +1,31 @@
+"""
+/***************************************************************************
+
+Shared HTTP session
+
+Every call to the IntelliGeo backend (prompts, retrieval, telemetry) goes
+through the `requests.Session` returned by `getSession()`, so TCP and TLS
+connections are kept alive and reused instead of being opened per
+request. The connection pool is sized for the concurrent retrieval
+fan-out of the Processor.
+***************************************************************************/
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def getSession() -> requests.Session:
+    global _session
+    with _sessionLock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
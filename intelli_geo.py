@@ -54,7 +54,6 @@ from qgis.PyQt.QtCore import (
     QCoreApplication,
     Qt,
     QThread,
-    QTimer,
     pyqtSignal,
 )
 from qgis.PyQt.QtGui import QIcon, QTextCursor, QClipboard, QKeyEvent
@@ -104,7 +103,10 @@ from .utils import (
 from .retrievalVectorbase import RetrievalVectorbase
 from .debugDialog import DebugDialog
 
-from .environment import QgisEnvironment
+from .environment import QgisEnvironment, getEnvironmentSnapshot
+from .consoleWatcher import ConsoleOutputWatcher
+from .executionEngine import ExecutionEngine, formatExecutionLog
+from .telemetry import stopTelemetrySenders
 
 
 class IntelliGeo:
@@ -156,8 +158,12 @@ class IntelliGeo:
         version = getVersion()
         self.retrievalVectorbase = RetrievalVectorbase(version)
 
-        self.consoleText = ""
-        self.consoleTracker = QTimer()
+        # errors of the code pasted in the console editor are sent back to the llm, see `onConsoleOutput`
+        self.consoleWatcher = ConsoleOutputWatcher()
+        self.consoleWatcher.outputAppended.connect(self.onConsoleOutput)
+        # workflows started with the "Run" button, executed in a QgsTask
+        self.executionEngine = ExecutionEngine()
+        self.executionEngine.executionFinished.connect(self.onExecutionFinished)
         self.newEditor = None
 
     # noinspection PyMethodMayBeStatic
@@ -288,6 +294,12 @@ class IntelliGeo:
         # remove the toolbar
         del self.toolbar
 
+        getEnvironmentSnapshot().detach()
+        self.consoleWatcher.stop()
+        self.executionEngine.cancel()
+        self.retrievalVectorbase.flush()
+        stopTelemetrySenders()
+
     # --------------------------------------------------------------------------
 
     def run(self):
@@ -317,6 +329,9 @@ class IntelliGeo:
 
             self.dataloader.connect()
 
+            # keep the layer descriptions of the readEnvironment tool up to date, connected on the main thread
+            getEnvironmentSnapshot().attach()
+
             # connect push button send to onNewMessageSend action
             self.dockwidget.pbSend.clicked.connect(self.onNewMessageSend)
             self.dockwidget.enterPressed.connect(self.onNewMessageSend)
@@ -347,6 +362,8 @@ class IntelliGeo:
             self.dockwidget.displayConversationCard(self.dataloader, slotsFunctions)
 
             self.dockwidget.modelClicked.connect(self.onOpenWorkflow)
+            self.dockwidget.runWorkflowClicked.connect(self.onRunWorkflow)
+            self.dockwidget.cancelWorkflowClicked.connect(self.executionEngine.cancel)
 
     def onNewMessageSend(self):
         message = self.dockwidget.ptMessage.toPlainText()
@@ -371,6 +388,8 @@ class IntelliGeo:
         if self.liveConversation is not None:
             self.liveConversation.llmResponse.connect(self.onNewResponseReceived)
             self.liveConversation.llmInterrupted.connect(self.onNewResponseNotReceived)
+            self.liveConversation.llmToken.connect(self.dockwidget.appendResponseToken)
+            self.dockwidget.appendUserMessage(message, getCurrentTimeStamp())
             self.liveConversation.updateUserPrompt(message, responseType)
             self.dockwidget.disableAllButtons()
             self.dockwidget.disableAllTextEdit()
@@ -383,11 +402,11 @@ class IntelliGeo:
             self.liveConversation.llmInterrupted.disconnect(
                 self.onNewResponseNotReceived
             )
+            self.liveConversation.llmToken.disconnect(self.dockwidget.appendResponseToken)
             # Python Console Interface: Load python code from response
             if workflow == "withCode":
                 code = extractCode(response)
-                self.consoleText = self.activateConsole(code, False)
-                self.startConsoleTracker()
+                self.startConsoleTracker(self.activateConsole(code, False))
 
             if workflow == "withToolbox":
                 code = extractCode(response)
@@ -419,6 +438,7 @@ class IntelliGeo:
         self.dockwidget.enableAllTextEdit()
         self.liveConversation.llmResponse.disconnect(self.onNewResponseReceived)
         self.liveConversation.llmInterrupted.disconnect(self.onNewResponseNotReceived)
+        self.liveConversation.llmToken.disconnect(self.dockwidget.appendResponseToken)
 
         # TODO: popup window
         showErrorMessage(errorMessage)
@@ -580,20 +600,8 @@ class IntelliGeo:
         if searchText == "":
             return
 
-        # Generate the filter function for search keyword
-        def searchFilter(metaInfo, keyword=searchText):
-            titleLower, descriptionLower = (
-                metaInfo["title"].lower(),
-                metaInfo["description"].lower(),
-            )
-            keywordLower = keyword.lower()
-            if (
-                titleLower.find(keywordLower) != -1
-                or descriptionLower.find(keywordLower) != -1
-            ):
-                return True
-            else:
-                return False
+        # Dataloader: ranked hits in the titles, descriptions and messages of all conversations
+        searchResult = self.dataloader.searchConversations(searchText)
 
         # Generate the highlight rule for content in conversation cards
         def highlight(fullText, keyword=searchText):
@@ -610,9 +618,7 @@ class IntelliGeo:
             self.onConversationDeleted,
             self.onConversationEdited,
         ]
-        self.dockwidget.displayConversationCard(
-            self.dataloader, slotsFunctions, searchFilter, highlight
-        )
+        self.dockwidget.displaySearchResult(searchResult, slotsFunctions, highlight)
 
         # Dock Interface: Turn 'Search' button into 'Clear button'
         self.dockwidget.pbSearchConversationCard.clicked.disconnect(
@@ -637,7 +643,10 @@ class IntelliGeo:
 
         self.dockwidget.pbSearchConversationCard.setText("Search")
 
-    def activateConsole(self, code: str, run: bool) -> str:
+    def activateConsole(self, code: str, run: bool):
+        """
+        Paste `code` in a new "IntelliGeo" tab of the console editor and return the console output widget.
+        """
         consoleWidget = iface.mainWindow().findChild(QDockWidget, "PythonConsole")
         if not consoleWidget or not consoleWidget.isVisible():
             iface.actionShowPythonDialog().trigger()
@@ -660,70 +669,77 @@ class IntelliGeo:
         QApplication.clipboard().setText(code)
         pythonConsole.pasteEditor()
 
-        return shellOutputWidget.text()
+        return shellOutputWidget
 
-    def startConsoleTracker(self):
-        self.consoleTracker.timeout.connect(self.comparePythonConsoleOutput)
+    def startConsoleTracker(self, shellOutputWidget):
+        """
+        Watch the output written to the console from now on, the next output is handled by `onConsoleOutput`.
+        """
+        self.consoleWatcher.watch(shellOutputWidget)
 
-        interval = 300
-        self.consoleTracker.start(interval)
+    def onConsoleOutput(self, newLogText):
+        # only the first output after the code was pasted belongs to it
+        self.consoleWatcher.stop()
+        if self.newEditor is None:
+            return
 
-    def comparePythonConsoleOutput(self):
-        consoleWidget = iface.mainWindow().findChild(QDockWidget, "PythonConsole")
-        if not consoleWidget or not consoleWidget.isVisible():
-            self.consoleTracker.stop()
+        if (newLogText.count("\n") >= 2) and ("Error" in newLogText):
+            executedCode = self.newEditor.text()
+            self.activateDebugDialog(newLogText, executedCode)
+
+    def onRunWorkflow(self, interactionID):
+        if self.liveConversation is None or self.executionEngine.isRunning():
             return
-        pythonConsole = consoleWidget.findChild(console.console.PythonConsoleWidget)
-        editorWidget = pythonConsole.findChild(console.console_editor.Editor)
 
-        if not editorWidget or not editorWidget.isVisible:
-            self.consoleTracker.stop()
+        workflow = self.dataloader.selectWorkflow(interactionID)
+        if workflow is None or workflow[0] != "withCode":
+            log_manager.log_debug(f"onRunWorkflow: no code workflow stored for interaction {interactionID}")
             return
 
-        shellOutputWidget = pythonConsole.findChild(
-            console.console_output.ShellOutputScintilla
-        )
-        currentFullLogMessage = shellOutputWidget.text()
-
-        if (currentFullLogMessage != self.consoleText) and (
-            self.consoleText in currentFullLogMessage
-        ):
-            if currentFullLogMessage.find(self.consoleText) == 0:
-                newLogText = currentFullLogMessage[len(self.consoleText) :]
-                self.consoleText = currentFullLogMessage
-                if len(newLogText) == 0:
-                    self.consoleTracker.stop()
-                    return
-
-                self.consoleTracker.stop()
-                if (newLogText.count("\n") >= 2) and ("Error" in newLogText):
-                    executedCode = self.newEditor.text()
-                    self.activateDebugDialog(newLogText, executedCode)
+        self.executionEngine.run(workflow[1], interactionID, self.liveConversationID)
+        self.dockwidget.setWorkflowRunning(True)
 
-        return
+    def onExecutionFinished(self, interactionID, conversationID, executionLog):
+        self.dockwidget.setWorkflowRunning(False)
+        self.dataloader.updateExecutionLog(interactionID, executionLog)
+
+        if executionLog["status"] != "error":
+            return
+        if self.liveConversation is None or self.liveConversationID != conversationID:
+            return
+
+        workflow = self.dataloader.selectWorkflow(interactionID)
+        if workflow is None:
+            # the interaction was deleted while the task ran
+            log_manager.log_debug(f"onExecutionFinished: no workflow stored for interaction {interactionID}")
+            return
 
-    def activateDebugDialog(self, logMessage, executedCode):
+        _, executedCode = workflow
+        self.activateDebugDialog(formatExecutionLog(executionLog), executedCode, interactionID)
+
+    def activateDebugDialog(self, logMessage, executedCode, interactionID=None):
         dialog = DebugDialog()
         result = dialog.exec_()
-        self.consoleTracker.stop()
+        self.consoleWatcher.stop()
 
         if result != QDialog.Accepted:
             return
         self.liveConversation.llmReflection.connect(self.onDebugReceived)
-        self.liveConversation.updateReflection(logMessage, executedCode, "code")
+        self.liveConversation.llmToken.connect(self.dockwidget.appendResponseToken)
+        self.liveConversation.updateReflection(logMessage, executedCode, "code", interactionID)
         self.dockwidget.disableAllButtons()
         self.dockwidget.disableAllTextEdit()
 
     def onDebugReceived(self, response, workflow, modelPath):
         self.liveConversation.llmReflection.disconnect(self.onDebugReceived)
+        self.liveConversation.llmToken.disconnect(self.dockwidget.appendResponseToken)
         self.dockwidget.enableAllButtons()
         self.dockwidget.enableAllTextEdit()
         if response == "":
             return
 
         code = extractCode(response)
-        self.consoleText = self.activateConsole(code, False)
-        self.startConsoleTracker()
+        self.startConsoleTracker(self.activateConsole(code, False))
 
         # Dock Interface: Update log & general information
         self.dockwidget.updateConversation(self.liveConversation)
@@ -798,7 +814,12 @@ class IntelliGeo:
                                 editor = topLevelChildwidget.findChild(QTextEdit)
                                 editor.setPlainText("hello")
 
-    def onOpenWorkflow(self, index):
-        show_variable_popup("onOpenWorkflow: " + str(index))
-        code = self.liveConversation.codeList[index]
-        self.activateConsole(code, False)
+    def onOpenWorkflow(self, interactionID):
+        workflow = self.dataloader.selectWorkflow(interactionID)
+        if workflow is None:
+            log_manager.log_debug(f"onOpenWorkflow: no workflow stored for interaction {interactionID}")
+            return
+
+        # the model xml is loaded into the console like code, as before the workflows were stored
+        _, artifact = workflow
+        self.activateConsole(artifact, False)
@@ -38,31 +38,31 @@ Classes:
 Usage:
     - Initialize the IntelliGeoDockWidget with an optional parent widget.
     - Use displayConversationCard to populate the widget with conversation
-      cards based on the data provided by a dataloader.
+      cards based on the data provided by a dataloader. The cards are rows
+      of a ConversationListModel painted by a ConversationCardDelegate.
     - Update or remove conversation cards using the provided methods.
     - Handle user input and events through the event filter and predefined
       slots.
 
 Dependencies:
     - QGIS
-    - datetime
     - utils (local module)
 ***************************************************************************/
 
 """
 
 import os
-from datetime import datetime
+from collections import OrderedDict
     
 from qgis.PyQt import QtGui, QtWidgets, uic
 from qgis.PyQt.QtCore import pyqtSignal, QPoint
 
 from qgis.PyQt.QtCore import QEvent, Qt, QModelIndex
-from qgis.PyQt.QtWidgets import (QVBoxLayout, QHBoxLayout, QLabel, QGroupBox, QPushButton, QSizePolicy, QSpacerItem,
-                                 QScrollArea, QWidget, QPlainTextEdit, QTextEdit, QListView)
-from qgis.PyQt.QtGui import QFont, QTextCursor, QPalette
+from qgis.PyQt.QtWidgets import QPushButton, QPlainTextEdit, QTextEdit, QListView
+from qgis.PyQt.QtGui import QTextCursor, QTextDocument, QPalette
 from .conversation import Conversation
 from .hoverComboBox import HoverComboBox
+from .conversationBrowser import ConversationListModel, ConversationCardDelegate
 from .utils import (handleNoneConversation, pack, unpack, formatDescription, show_variable_popup, createMarkdown,
                     setFontColor)
 
@@ -76,7 +76,9 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     enterPressed = pyqtSignal(str)
     searchPressed = pyqtSignal(str)
     switchClearMode = pyqtSignal(str)
-    modelClicked = pyqtSignal(int)
+    modelClicked = pyqtSignal(str)
+    runWorkflowClicked = pyqtSignal(str)
+    cancelWorkflowClicked = pyqtSignal()
     searchInteractionPressed = pyqtSignal()
 
     def __init__(self, parent=None):
@@ -88,9 +90,6 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # http://doc.qt.io/qt-5/designer-using-a-ui-file.html
         # #widgets-and-dialogs-with-auto-connect
 
-        self.conversationCards = {}
-        self.scrollAreaWidget, self.scrollAreaLayout = None, None
-
         self.conversationCardSearchMode = False
 
         self.setupUi(self)
@@ -107,12 +106,47 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 self.twTabs.removeTab(index)
         self.rbtCode.setChecked(True)
 
+        # conversation cards are painted by a delegate, see `conversationBrowser.py`
+        self.conversationSlots = None
+        self.conversationModel = ConversationListModel(self)
+        self.conversationDelegate = ConversationCardDelegate(self)
+        self.lvConversationCard = QListView()
+        self.lvConversationCard.setModel(self.conversationModel)
+        self.lvConversationCard.setItemDelegate(self.conversationDelegate)
+        self.lvConversationCard.setUniformItemSizes(True)
+        self.lvConversationCard.setResizeMode(QListView.Adjust)
+        self.lvConversationCard.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.lvConversationCard.setSelectionMode(QListView.NoSelection)
+        self.lvConversationCard.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.saConversationCard.parentWidget().layout().replaceWidget(self.saConversationCard,
+                                                                      self.lvConversationCard)
+        self.saConversationCard.hide()
+        # the slots may delete the card that was clicked, they run once the click is handled
+        self.conversationDelegate.buttonClicked.connect(self._onCardButtonClicked, Qt.QueuedConnection)
+
         self.ptMessage.setFixedHeight(64)
         self.itemCounter = 0
+        self.streamingResponse = False
+        # incremental rendering of txHistory, see `updateConversation`
+        self.renderedConversation = None
+        self.lastRenderedSeq, self.firstRenderedSeq = None, None
+        self.workflowIDs = []
+        # paged loading of the chat log
+        self.historyPageSize = 50
+        self.hasOlderHistory = False
+        self.pendingPosition = None
+        self.messageHtmlCache = OrderedDict()
+        self.messageHtmlCacheSize = 1000
         self.cbModel = HoverComboBox()
         self.horizontalLayout_4.addWidget(self.cbModel)
+        # runs the selected workflow in the background, see `executionEngine.py`
+        self.pbRunWorkflow = QPushButton("Run")
+        self.pbRunWorkflow.setToolTip("Run the selected code workflow without blocking QGIS")
+        self.horizontalLayout_4.addWidget(self.pbRunWorkflow)
+        self.pbRunWorkflow.clicked.connect(self.onRunWorkflowClicked)
 
         self.cbModel.activated.connect(self.onModelClicked)
+        self.txHistory.verticalScrollBar().valueChanged.connect(self.onHistoryScrolled)
 
         self.searchInteractionIndex = -1
         self.searchInteractionPressed.connect(self.onSearchInteraction)
@@ -122,113 +156,46 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.closingPlugin.emit()
         event.accept()
 
-    def displayConversationCard(self, dataloader, slotsFunctions,
-                                searchFilter=lambda x: True,
-                                highlightRule=lambda x: x):
+    def _onCardButtonClicked(self, action: str, conversationID: str) -> None:
+        onConversationLoad, onConversationDeleted, onConversationEdited = self.conversationSlots
+        if action == "edit":
+            onConversationEdited(conversationID)
+        elif action == "delete":
+            onConversationDeleted(conversationID)
+        elif action == "open":
+            onConversationLoad(conversationID)
+
+    def displayConversationCard(self, dataloader, slotsFunctions):
         # Tricky Argument Passed Here!
         # the argument 'onConversationLoad' is a function (method) defined in class IntelliGeo
+        self.conversationSlots = slotsFunctions
 
-        self.scrollAreaLayout = QVBoxLayout()
-        self.scrollAreaWidget = QWidget()
-        self.saConversationCard.setWidget(self.scrollAreaWidget)
-        self.scrollAreaWidget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        # sorted by the database, most recently modified first
+        self.conversationModel.setConversations(dataloader.selectConversationInfo())
 
-        metaTable = dataloader.selectConversationInfo()
-        metaTable.sort(key=lambda info: datetime.strptime(info['modified'], "%m %d %Y %H:%M:%S"))
-
-        for metaInfo in metaTable:
-            if searchFilter(metaInfo):
-                self.addConversationCard(metaInfo, slotsFunctions, highlight=highlightRule)
-            else:
-                continue
-
-        self.scrollAreaWidget.setLayout(self.scrollAreaLayout)
+    def displaySearchResult(self, searchResult, slotsFunctions, highlightRule=lambda x: x):
+        """
+        Show the cards of `Dataloader.searchConversations`, in rank order.
+        """
+        self.conversationSlots = slotsFunctions
+        self.conversationModel.setConversations(searchResult, highlightRule)
 
     def updateConversationCard(self, conversationMetaInfo, slotsFunctions):
         """
-        Find the conversation card, remove it and add a new one.
+        Move the conversation card on top with its new meta-information.
         """
-        conversationID = conversationMetaInfo['ID']
-        self.removeConversationCard(conversationID)
         self.addConversationCard(conversationMetaInfo, slotsFunctions)
 
-    def addConversationCard(self, metaInfo, slotsFunctions, order=0, highlight=lambda x: x):
-        onConversationLoad, onConversationDeleted, onConversationEdited = slotsFunctions
-        conversationCard = QGroupBox()
-        cardLayout = QVBoxLayout()
-
-        # "ID", "llmID", "title", "description", "created",
-        # "modified", "messageCount", "workflowCount", "userID"
-        (conversationID,
-         llmID,
-         title,
-         description,
-         created,
-         lastEdit,
-         messageCount,
-         workflowCount,
-         userID) = unpack(metaInfo, "conversation")
-
-        titleLabel = QLabel(highlight(title))
-        font = QFont()
-        font.setBold(True)  # Set the font to bold
-        titleLabel.setFont(font)
-
-        desLabel = QLabel(highlight(description))
-        desLabel.setWordWrap(True)
-
-        verticalSpacer = QSpacerItem(0, 20, QSizePolicy.Minimum, QSizePolicy.Expanding)
-
-        metadata = f"Created: {created} | LLM: {llmID} \n Messages: {messageCount} | Workflow: {workflowCount} "
-        metadataLabel = QLabel(metadata)
-        metadataLabel.setAlignment(Qt.AlignRight)
-
-        horizontalLayout = QHBoxLayout()
-        spacer = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
-        pbEdit = QPushButton("Edit")
-        pbEdit.setStyleSheet("""
-            QPushButton {
-                background-color: #9DDE8B;
-            }
-        """)
-        pbEdit.clicked.connect(lambda: onConversationEdited(conversationID))
-
-        pbDelete = QPushButton("Delete")
-        pbDelete.setStyleSheet("""
-            QPushButton {
-                background-color: #FA7070;
-            }
-        """)
-        pbDelete.clicked.connect(lambda: onConversationDeleted(conversationID))
-
-        pbOpen = QPushButton("Open")
-        pbOpen.clicked.connect(lambda: onConversationLoad(conversationID))
-
-        horizontalLayout.addSpacerItem(spacer)
-        horizontalLayout.addWidget(pbEdit)
-        horizontalLayout.addWidget(pbDelete)
-        horizontalLayout.addWidget(pbOpen)
-
-        cardLayout.addWidget(titleLabel)
-        cardLayout.addWidget(desLabel)
-        cardLayout.addSpacerItem(verticalSpacer)
-        cardLayout.addWidget(metadataLabel)
-        cardLayout.addLayout(horizontalLayout)
-        conversationCard.setLayout(cardLayout)
-
-        self.scrollAreaLayout.insertWidget(order, conversationCard)
-        self.conversationCards[conversationID] = conversationCard
+    def addConversationCard(self, metaInfo, slotsFunctions):
+        self.conversationSlots = slotsFunctions
+        self.conversationModel.upsertConversation(metaInfo)
 
     def removeConversationCard(self, conversationID):
         """
         Remove the Conversation Card only in the 'Conversations' Browser.
 
         """
-        if conversationID in self.conversationCards:
-            card = self.conversationCards[conversationID]
-            self.scrollAreaLayout.removeWidget(card)
-            card.deleteLater()
-            del self.conversationCards[conversationID]
+        self.conversationModel.removeConversation(conversationID)
 
     @handleNoneConversation
     def updateGeneralInfo(self, conversation) -> None:
@@ -244,80 +211,236 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     @handleNoneConversation
     def updateConversation(self, conversation: Conversation) -> None:
         """
-        Update chat log under "Messages" tab.
+        Update chat log under "Messages" tab. Only the interactions stored since the last update are rendered and
+        appended. When another conversation is shown the log is rebuilt from its newest `historyPageSize`
+        interactions, older pages are loaded while scrolling up, see `onHistoryScrolled`.
         """
         # TODO: separators between messages
         # TODO: on chat interface
-        currentHtml = ""
-        self.itemCounter = 0
-        self.cbModel.clear()
-        # get updated log
-        interactionHistory = conversation.fetch()
-        fontColor = setFontColor(self.txHistory.palette().color(QPalette.Base))
-        for interaction in interactionHistory:
-            messageDict = pack(interaction, "interaction")
-            if messageDict["typeMessage"] == "input":
-                newMessage = f"""
-                                <div style="
-                                  margin: 0;
-                                  padding: 0;
-                                  line-height: 1;
-                                  text-align: right;
-                                  color: #6baad1;
-                                  ">
-                                  User {messageDict["requestTime"]}
-                                </div>
-                                <div style="
-                                  margin: 0;
-                                  padding: 0;
-                                  line-height: 1;
-                                  text-align: right;
-                                  color: {fontColor};
-                                  ">
-                                  {messageDict["requestText"]}
-                                </div>
-                            """
-                currentHtml += newMessage
-
-            if messageDict["typeMessage"] == "return":
-                if messageDict["workflow"] in ["withModel", "withCode", "withToolbox"]:
-                    modelTag = f"Model_{self.itemCounter}"
-                    modelTagID = f"id=\"Workflow_{self.itemCounter}\""
-                    self.onNewModelGenerated(modelTag)
-                    self.itemCounter += 1
-                else:
-                    modelTagID = ""
-                newMessage = f"""
-                                <div style="
-                                  margin: 0;
-                                  padding: 0;
-                                  line-height: 1;
-                                  color: #FD8A8A;"
-                                  {modelTagID}>
-                                  IntelliGeo {messageDict["responseTime"]}
-                                </div>
-                                <div style="
-                                  margin: 0;
-                                  padding: 0;
-                                  line-height: 1;
-                                  color: {fontColor};">
-                                  {createMarkdown(messageDict["responseText"])}
-                                </div>
-                                <div>
-                                  <br>
-                                </div>
-                            """
-                currentHtml += newMessage
+        if conversation is not self.renderedConversation or self.txHistory.document().isEmpty():
+            # clearing scrolls to the top, which must not load a page of the previous conversation
+            self.hasOlderHistory = False
+            self.txHistory.clear()
+            self._clearModelItems()
+            self.workflowIDs = []
+            self.pendingPosition = None
+            self.renderedConversation = conversation
+            self.lastRenderedSeq, self.firstRenderedSeq = -1, None
+            interactionHistory = conversation.fetchPage(None, self.historyPageSize)
+            self.hasOlderHistory = len(interactionHistory) == self.historyPageSize
+        else:
+            interactionHistory = conversation.fetchSince(self.lastRenderedSeq)
+
+        # the sent message and the streamed tokens are replaced by the stored interactions
+        self._removePendingMessages()
+        self.streamingResponse = False
+
+        newHtml, newWorkflowIDs = self._renderInteractions(interactionHistory)
+        for interactionID in newWorkflowIDs:
+            self.onNewModelGenerated(f"Model_{len(self.workflowIDs)}", interactionID)
+            self.workflowIDs.append(interactionID)
 
         # update txHistory
-        self.txHistory.setHtml(currentHtml)
+        cursor = self.txHistory.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertHtml(newHtml)
 
         # set text browser read only
         self.txHistory.setReadOnly(True)
 
         # always show the bottom of streaming conversation
+        scrollBar = self.txHistory.verticalScrollBar()
+        scrollBar.setValue(scrollBar.maximum())
+
+        # a log shorter than the view cannot be scrolled up, load a few older pages so that it can
+        for _ in range(4):
+            if not self.hasOlderHistory or scrollBar.maximum() != scrollBar.minimum():
+                break
+            self._loadOlderPage()
+
+    def onHistoryScrolled(self, value: int) -> None:
+        """
+        Prepend the previous page of the rendered conversation once the log is scrolled to the top.
+        """
+        if value == self.txHistory.verticalScrollBar().minimum():
+            self._loadOlderPage()
+
+    def _loadOlderPage(self) -> bool:
+        """
+        Prepend the page preceding the first rendered interaction, return whether a page was loaded.
+        """
+        if not self.hasOlderHistory or self.renderedConversation is None:
+            return False
+        if self.firstRenderedSeq is None:
+            self.hasOlderHistory = False
+            return False
+
+        interactionHistory = self.renderedConversation.fetchPage(self.firstRenderedSeq, self.historyPageSize)
+        self.hasOlderHistory = len(interactionHistory) == self.historyPageSize
+        if not interactionHistory:
+            return False
+
+        olderHtml, olderWorkflowIDs = self._renderInteractions(interactionHistory)
+
+        # keep the message the user was looking at in place
+        scrollBar = self.txHistory.verticalScrollBar()
+        previousMaximum = scrollBar.maximum()
+        previousLength = self.txHistory.document().characterCount()
+        cursor = self.txHistory.textCursor()
+        cursor.movePosition(QTextCursor.Start)
+        cursor.insertHtml(olderHtml)
+        if self.pendingPosition is not None:
+            self.pendingPosition += self.txHistory.document().characterCount() - previousLength
+        scrollBar.setValue(scrollBar.maximum() - previousMaximum)
+
+        # workflow items follow the order of the log
+        self.workflowIDs = olderWorkflowIDs + self.workflowIDs
+        self._clearModelItems()
+        for index, interactionID in enumerate(self.workflowIDs):
+            self.onNewModelGenerated(f"Model_{index}", interactionID)
+
+        return True
+
+    def _renderInteractions(self, interactionHistory: list) -> tuple[str, list]:
+        """
+        Return the HTML of the interaction rows and the IDs of the interactions holding a workflow, in order.
+        """
+        fontColor = setFontColor(self.txHistory.palette().color(QPalette.Base))
+        htmlParts, workflowIDs = [], []
+        for interaction in interactionHistory:
+            messageDict = pack(interaction, "interaction")
+            htmlParts.append(self._interactionHtml(messageDict, fontColor))
+            if messageDict["typeMessage"] == "return" and messageDict["workflow"] in ["withModel", "withCode",
+                                                                                     "withToolbox"]:
+                workflowIDs.append(messageDict["ID"])
+
+        seqs = [interaction[-1] for interaction in interactionHistory if interaction[-1] is not None]
+        if seqs:
+            self.lastRenderedSeq = max(self.lastRenderedSeq, max(seqs))
+            self.firstRenderedSeq = min(seqs) if self.firstRenderedSeq is None else min(self.firstRenderedSeq,
+                                                                                          min(seqs))
+
+        return "".join(htmlParts), workflowIDs
+
+    def _interactionHtml(self, messageDict: dict, fontColor: str) -> str:
+        """
+        HTML of one interaction, cached by interaction ID.
+        """
+        cacheKey = (messageDict["ID"], fontColor)
+        if cacheKey in self.messageHtmlCache:
+            self.messageHtmlCache.move_to_end(cacheKey)
+            return self.messageHtmlCache[cacheKey]
+
+        if messageDict["typeMessage"] == "input":
+            newMessage = self._userMessageHtml(messageDict["requestText"], messageDict["requestTime"], fontColor)
+        else:
+            workflowAnchor = f"Workflow_{messageDict['ID']}"
+            if messageDict["workflow"] in ["withModel", "withCode", "withToolbox"]:
+                modelTagID = f"id=\"{workflowAnchor}\""
+            else:
+                modelTagID = ""
+            newMessage = f"""
+                            <div style="
+                              margin: 0;
+                              padding: 0;
+                              line-height: 1;
+                              color: #FD8A8A;"
+                              {modelTagID}>
+                              <a name="{workflowAnchor}"></a>IntelliGeo {messageDict["responseTime"]}
+                            </div>
+                            <div style="
+                              margin: 0;
+                              padding: 0;
+                              line-height: 1;
+                              color: {fontColor};">
+                              {createMarkdown(messageDict["responseText"])}
+                            </div>
+                            <div>
+                              <br>
+                            </div>
+                        """
+
+        self.messageHtmlCache[cacheKey] = newMessage
+        if len(self.messageHtmlCache) > self.messageHtmlCacheSize:
+            self.messageHtmlCache.popitem(last=False)
+        return newMessage
+
+    def _clearModelItems(self) -> None:
+        self.cbModel.clear()
+        try:
+            # drop the hover actions of the removed items
+            self.cbModel.hovered.disconnect()
+        except TypeError:
+            pass
+
+    def _removePendingMessages(self) -> None:
+        if self.pendingPosition is None:
+            return
+
+        cursor = self.txHistory.textCursor()
+        cursor.setPosition(min(self.pendingPosition, self.txHistory.document().characterCount() - 1))
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self.pendingPosition = None
+
+    def _userMessageHtml(self, requestText: str, requestTime: str, fontColor: str) -> str:
+        return f"""
+                <div style="
+                  margin: 0;
+                  padding: 0;
+                  line-height: 1;
+                  text-align: right;
+                  color: #6baad1;
+                  ">
+                  User {requestTime}
+                </div>
+                <div style="
+                  margin: 0;
+                  padding: 0;
+                  line-height: 1;
+                  text-align: right;
+                  color: {fontColor};
+                  ">
+                  {requestText}
+                </div>
+            """
+
+    def appendUserMessage(self, requestText: str, requestTime: str) -> None:
+        """
+        Show the sent message right away, the response is streamed below it by `appendResponseToken`.
+        """
+        fontColor = setFontColor(self.txHistory.palette().color(QPalette.Base))
+        cursor = self.txHistory.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if self.pendingPosition is None:
+            self.pendingPosition = cursor.position()
+        cursor.insertHtml(self._userMessageHtml(requestText, requestTime, fontColor))
+        self.streamingResponse = False
         self.txHistory.verticalScrollBar().setValue(self.txHistory.verticalScrollBar().maximum())
 
+    def appendResponseToken(self, token: str) -> None:
+        """
+        Append a streamed token of the response as plain text, without re-rendering the rest of the log. The
+        formatted response replaces it when `updateConversation` runs.
+        """
+        # only follow the stream when the log is already scrolled to the bottom
+        scrollBar = self.txHistory.verticalScrollBar()
+        followStream = scrollBar.value() >= scrollBar.maximum() - 20
+
+        cursor = self.txHistory.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if self.pendingPosition is None:
+            self.pendingPosition = cursor.position()
+        if not self.streamingResponse:
+            self.streamingResponse = True
+            cursor.insertBlock()
+            cursor.insertHtml('<div style="margin: 0; padding: 0; line-height: 1; color: #FD8A8A;">IntelliGeo</div>')
+            cursor.insertBlock()
+        cursor.insertText(token)
+
+        if followStream:
+            scrollBar.setValue(scrollBar.maximum())
+
     def disableAllButtons(self):
         """
         disable all button on interface so that won't trigger another response
@@ -328,6 +451,8 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # Disable each button
         for button in buttons:
             button.setDisabled(True)
+        self.conversationDelegate.buttonsEnabled = False
+        self.lvConversationCard.viewport().update()
 
     def enableAllButtons(self):
         """
@@ -339,6 +464,8 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # Enable each button
         for button in buttons:
             button.setDisabled(False)
+        self.conversationDelegate.buttonsEnabled = True
+        self.lvConversationCard.viewport().update()
 
     def disableAllTextEdit(self):
         # Find all Textedit widgets (recursively searches all children)
@@ -385,36 +512,66 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         return super().eventFilter(QTObject, event)
 
-    def onNewModelGenerated(self, newModeltag):
+    def onNewModelGenerated(self, newModeltag, interactionID=None):
+        # the interaction is rendered under the anchor "Workflow_{ID}", see `_interactionHtml`
+        anchor = newModeltag if interactionID is None else f"Workflow_{interactionID}"
+
         # Define a new action for the new item
         def newHoverAction(newModelTagArg):
-            self.txHistory.scrollToAnchor(newModelTagArg)
+            if newModelTagArg == newModeltag:
+                self.txHistory.scrollToAnchor(anchor)
 
         # Add the new item and connect its hover action
-        self.cbModel.add_item_with_action(newModeltag, newHoverAction)
+        self.cbModel.add_item_with_action(newModeltag, newHoverAction, interactionID)
 
     def onModelClicked(self, index):
-        self.modelClicked.emit(index)
+        interactionID = self.cbModel.itemData(index)
+        if interactionID:
+            self.modelClicked.emit(interactionID)
+
+    def _loadHistoryForSearch(self, searchText: str) -> None:
+        """
+        Load the older pages of the chat log down to the first stored interaction matching `searchText`, so that the
+        search also finds messages that were not rendered yet.
+        """
+        if not self.hasOlderHistory or self.renderedConversation is None or self.firstRenderedSeq is None:
+            return
+
+        matchingSeqs = self.renderedConversation.searchInteractionSeqs(searchText)
+        while matchingSeqs and self.firstRenderedSeq is not None and matchingSeqs[0] < self.firstRenderedSeq:
+            if not self._loadOlderPage():
+                break
+
+    def onRunWorkflowClicked(self):
+        if self.pbRunWorkflow.text() == "Cancel":
+            self.cancelWorkflowClicked.emit()
+            return
+
+        interactionID = self.cbModel.currentData()
+        if interactionID:
+            self.runWorkflowClicked.emit(interactionID)
+
+    def setWorkflowRunning(self, running: bool) -> None:
+        self.pbRunWorkflow.setText("Cancel" if running else "Run")
 
     def onSearchInteraction(self):
         searchText = self.txSearchMessage.text()
-        fullInteraction = self.txHistory.toPlainText().lower()
-
-        self.searchInteractionIndex += 1
-        self.searchInteractionIndex = fullInteraction.find(searchText, self.searchInteractionIndex)
+        if searchText == "":
+            return
 
         if self.searchInteractionIndex == -1:
-            return
+            self._loadHistoryForSearch(searchText)
 
-        cursor = self.txHistory.textCursor()
+        # searched by the document itself, without copying the log into a string
+        cursor = self.txHistory.document().find(searchText, self.searchInteractionIndex + 1)
 
-        # Set the cursor position to the start of the found text
-        cursor.setPosition(self.searchInteractionIndex)
+        if cursor.isNull():
+            self.searchInteractionIndex = -1
+            return
 
-        # Move the cursor to select the found text
-        cursor.movePosition(QTextCursor.Right, QTextCursor.KeepAnchor, len(searchText))
+        self.searchInteractionIndex = cursor.selectionStart()
 
-        # Apply the modified cursor back to the text edit
+        # Apply the cursor selecting the found text back to the text edit
         self.txHistory.setTextCursor(cursor)
 
         if self.pbSearchInteraction.text() == "Search":
@@ -424,23 +581,17 @@ class IntelliGeoDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
     def searchPrevInteraction(self):
         searchText = self.txSearchMessage.text()
-        fullInteraction = self.txHistory.toPlainText().lower()
-
-        # self.searchInteractionIndex += 1
-        self.searchInteractionIndex = fullInteraction[:self.searchInteractionIndex].rfind(searchText)
-
-        if self.searchInteractionIndex == -1:
+        if searchText == "" or self.searchInteractionIndex <= 0:
             return
 
-        cursor = self.txHistory.textCursor()
+        cursor = self.txHistory.document().find(searchText, self.searchInteractionIndex, QTextDocument.FindBackward)
 
-        # Set the cursor position to the start of the found text
-        cursor.setPosition(self.searchInteractionIndex)
+        if cursor.isNull():
+            return
 
-        # Move the cursor to select the found text
-        cursor.movePosition(QTextCursor.Right, QTextCursor.KeepAnchor, len(searchText))
+        self.searchInteractionIndex = cursor.selectionStart()
 
-        # Apply the modified cursor back to the text edit
+        # Apply the cursor selecting the found text back to the text edit
         self.txHistory.setTextCursor(cursor)
 
         if self.pbSearchInteraction.text() == "Search":
@@ -0,0 +1,225 @@
+"""
+/***************************************************************************
+
+Local intent classifier
+
+This module decides, without a network call, whether a user message asks
+for a workflow, using the same labels as the LLM classifier prompt:
+"no" (general chat), "yes, no" (produce a workflow) and "yes, yes"
+(refine the previous workflow).
+
+Classes:
+    IntentClassifier: Combines conservative keyword rules with a naive
+                      Bayes model trained on the decisions the LLM
+                      classifier stored in the "interaction" table. The
+                      model is kept in "QGIS_IntelliGeo/intentClassifier.json"
+                      and retrained once enough new decisions were stored.
+
+Usage:
+    - `predict(text)` returns `(label, confidence)`, the Processor only
+      trusts labels whose confidence reaches its threshold and asks the
+      LLM classifier otherwise.
+    - Decisions taken locally are stored with the prompt ID
+      `LOCAL_PROMPT_ID` and are never used as training data.
+***************************************************************************/
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+
+LOCAL_PROMPT_ID = "local::intentClassifier"
+LABELS = ["no", "yes, no", "yes, yes"]
+
+# objects a workflow request acts on, a request verb alone ("make sense of this error") is not enough
+GIS_OBJECTS = (r"layers?|maps?|rasters?|vectors?|shapefiles?|geopackages?|gpkg|geojson|csv|dem|features?|points?|"
+               r"lines?|polygons?|attributes?|fields?|tables?|crs|projections?|coordinates|extent|buffers?|grid|"
+               r"heatmap|contours?|centroids?")
+
+# (label, pattern, confidence), a rule only decides when the rules of a single label match. Questions may still ask
+# for a workflow ("explain how to clip ... and save it"), their rule stays below the threshold of the Processor and
+# only decides together with the trained model
+RULES = [
+    ("no", re.compile(r"^\s*(hi|hello|hey|thanks|thank you|ok|okay|good (morning|afternoon|evening))[\s!.,]*$",
+                      re.IGNORECASE), 0.9),
+    ("no", re.compile(r"^\s*(what is|what are|what does|who|why|explain|tell me about|can you explain)\b",
+                      re.IGNORECASE), 0.6),
+    ("yes, no", re.compile(r"^\s*(please\s+)?(create|generate|write|make|build|calculate|compute|clip|buffer|reproject|"
+                           r"export|load|add|merge|dissolve|extract|convert|count|select|intersect)\b"
+                           rf"(?=.*\b({GIS_OBJECTS})\b)", re.IGNORECASE), 0.9),
+    ("yes, yes", re.compile(r"\b(fix|modify|change|adjust|update|correct) (the|this|that|it|your|previous|last)\b|"
+                            r"\binstead\b|\b(does not|doesn't|did not|didn't) work\b", re.IGNORECASE), 0.9),
+]
+
+
+def normalizeDecision(decision: str):
+    """
+    Map a classifier output to one of `LABELS`, `None` when it cannot be routed.
+    """
+    decision = decision.strip().lower()
+    if decision in LABELS:
+        return decision
+    elif "yes" in decision:
+        return "yes, no"
+    return None
+
+
+class IntentClassifier:
+    def __init__(self, modelPath: str, minTrainingRows: int = 20, retrainEvery: int = 20):
+        self.modelPath = modelPath
+        self.minTrainingRows = minTrainingRows
+        self.retrainEvery = retrainEvery
+        # seconds between two checks for new training rows
+        self.checkInterval = 60
+        # naive Bayes treats the words of a message as independent evidence and is overconfident, its log scores are
+        # divided by `temperature` and the posterior is pulled towards uniform by `priorRows` pseudo rows, so that
+        # only a model trained on many decisions reaches the threshold of the Processor
+        self.temperature = 2.0
+        self.priorRows = 50
+
+        self.labelCounts = {label: 0 for label in LABELS}
+        self.tokenCounts = {label: {} for label in LABELS}
+        self.tokenTotals = {label: 0 for label in LABELS}
+        self.vocabulary = set()
+        self.trainedRows = 0
+        self.lastCheck = 0.0
+        self.lock = threading.Lock()
+        self.tokenPattern = re.compile(r"[a-z0-9_]+")
+
+        self._load()
+
+    def _tokens(self, text: str) -> list:
+        words = self.tokenPattern.findall(text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def train(self, pairs: list) -> None:
+        """
+        Rebuild the model from `(requestText, decision)` pairs.
+        """
+        labelCounts = {label: 0 for label in LABELS}
+        tokenCounts = {label: {} for label in LABELS}
+        tokenTotals = {label: 0 for label in LABELS}
+        for requestText, decision in pairs:
+            label = normalizeDecision(decision or "")
+            if label is None or not requestText:
+                continue
+
+            labelCounts[label] += 1
+            for token in self._tokens(requestText):
+                tokenCounts[label][token] = tokenCounts[label].get(token, 0) + 1
+                tokenTotals[label] += 1
+
+        with self.lock:
+            self.labelCounts, self.tokenCounts, self.tokenTotals = labelCounts, tokenCounts, tokenTotals
+            self.vocabulary = {token for counts in tokenCounts.values() for token in counts}
+            self.trainedRows = len(pairs)
+            self._save()
+
+    def ensureTrained(self, dataloader) -> None:
+        """
+        Retrain from `dataloader` when `retrainEvery` classifier decisions were stored since the last training.
+        """
+        if time.monotonic() - self.lastCheck < self.checkInterval:
+            return
+        self.lastCheck = time.monotonic()
+
+        if dataloader.countClassifierPairs() - self.trainedRows >= self.retrainEvery:
+            self.train(dataloader.selectClassifierPairs())
+
+    def _ruleScores(self, text: str):
+        matchedRules = [(label, confidence) for label, pattern, confidence in RULES if pattern.search(text)]
+        if len({label for label, _ in matchedRules}) != 1:
+            return None
+
+        matchedLabel = matchedRules[0][0]
+        confidence = max(confidence for _, confidence in matchedRules)
+        otherScore = (1 - confidence) / (len(LABELS) - 1)
+        return {label: confidence if label == matchedLabel else otherScore for label in LABELS}
+
+    def _bayesScores(self, text: str):
+        with self.lock:
+            totalRows = sum(self.labelCounts.values())
+            if totalRows < self.minTrainingRows:
+                return None
+
+            # unseen words carry no evidence, with Laplace smoothing they would favour the labels with few rows
+            tokens = [token for token in self._tokens(text) if token in self.vocabulary]
+            vocabularySize = len(self.vocabulary) + 1
+            logScores = {}
+            # a label without any training row cannot be predicted
+            for label in [label for label in LABELS if self.labelCounts[label]]:
+                # Laplace smoothing on both the prior and the token likelihoods
+                logScore = math.log((self.labelCounts[label] + 1) / (totalRows + len(LABELS)))
+                denominator = self.tokenTotals[label] + vocabularySize
+                for token in tokens:
+                    logScore += math.log((self.tokenCounts[label].get(token, 0) + 1) / denominator)
+                logScores[label] = logScore
+
+        maxLogScore = max(logScores.values())
+        expScores = {label: math.exp((score - maxLogScore) / self.temperature) for label, score in logScores.items()}
+        normalizer = sum(expScores.values())
+        uniform = self.priorRows / len(LABELS)
+        return {label: (totalRows * expScores.get(label, 0.0) / normalizer + uniform) / (totalRows + self.priorRows)
+                for label in LABELS}
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """
+        Return the most likely label and its confidence, `(None, 0.0)` when neither rules nor model apply.
+        """
+        ruleScores = self._ruleScores(text)
+        bayesScores = self._bayesScores(text)
+        if ruleScores is None and bayesScores is None:
+            return None, 0.0
+        elif ruleScores is None:
+            scores = bayesScores
+        elif bayesScores is None:
+            scores = ruleScores
+        else:
+            scores = {label: (ruleScores[label] + bayesScores[label]) / 2 for label in LABELS}
+
+        label = max(scores, key=scores.get)
+        return label, scores[label]
+
+    def _load(self):
+        if not os.path.exists(self.modelPath):
+            return
+
+        try:
+            with open(self.modelPath, "r", encoding="utf-8") as file:
+                model = json.load(file)
+            labelCounts, tokenCounts = model["labelCounts"], model["tokenCounts"]
+            trainedRows = model["trainedRows"]
+        except (OSError, ValueError, KeyError):
+            return
+
+        if set(labelCounts) != set(LABELS):
+            return
+
+        self.labelCounts, self.tokenCounts = labelCounts, tokenCounts
+        self.tokenTotals = {label: sum(counts.values()) for label, counts in tokenCounts.items()}
+        self.vocabulary = {token for counts in tokenCounts.values() for token in counts}
+        self.trainedRows = trainedRows
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.modelPath), exist_ok=True)
+        temporaryPath = self.modelPath + ".tmp"
+        with open(temporaryPath, "w", encoding="utf-8") as file:
+            json.dump({"labelCounts": self.labelCounts, "tokenCounts": self.tokenCounts,
+                       "trainedRows": self.trainedRows}, file)
+        os.replace(temporaryPath, self.modelPath)
+
+
+_intentClassifier = None
+_intentClassifierLock = threading.Lock()
+
+
+def getIntentClassifier() -> IntentClassifier:
+    global _intentClassifier
+    with _intentClassifierLock:
+        if _intentClassifier is None:
+            modelPath = os.path.join(os.path.expanduser("~"), "Documents", "QGIS_IntelliGeo", "intentClassifier.json")
+            _intentClassifier = IntentClassifier(modelPath)
+        return _intentClassifier
@@ -0,0 +1,49 @@
+"""
+/***************************************************************************
+
+LLM client registry
+
+Process-wide cache of the LangChain chat clients. A client (and the HTTP
+connection pool it holds) is created the first time a
+(provider, model, API key) combination is used and shared by every
+Processor afterwards, so opening conversations does not construct clients
+and TCP/TLS connections are reused across turns.
+
+Usage:
+    - `getLLM(provider, model, apiKey)` returns the shared client. Only a
+      SHA-256 digest of the API key is kept in the registry key, a changed
+      key creates a new client.
+***************************************************************************/
+"""
+
+import hashlib
+import threading
+
+from langchain_cohere import ChatCohere
+from langchain_openai import ChatOpenAI
+from langchain_deepseek import ChatDeepSeek
+from langchain_groq import ChatGroq
+
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+def _createLLM(provider: str, model: str, apiKey: str):
+    if provider == "OpenAI":
+        return ChatOpenAI(model=model, openai_api_key=apiKey, temperature=0)
+    elif provider == "Cohere":
+        return ChatCohere(model=model, cohere_api_key=apiKey, temperature=0)
+    elif provider == "DeepSeek":
+        return ChatDeepSeek(model=model, api_key=apiKey, temperature=0)
+    elif provider == "Groq":
+        return ChatGroq(model=model, api_key=apiKey, temperature=0)
+
+    raise ValueError(f"Unsupported llm provider: {provider}")
+
+
+def getLLM(provider: str, model: str, apiKey: str):
+    key = (provider, model, hashlib.sha256((apiKey or "").encode("utf-8")).hexdigest())
+    with _clientsLock:
+        if key not in _clients:
+            _clients[key] = _createLLM(provider, model, apiKey)
+        return _clients[key]
@@ -0,0 +1,221 @@
+"""
+/***************************************************************************
+
+Local retrieval
+
+This module defines the embedded vector index used by RetrievalVectorbase
+to answer document and few-shot example queries without a network call.
+
+Classes:
+    HashingEmbedding: Default embedding function. Hashes word unigrams,
+                      bigrams and character trigrams into a fixed number
+                      of buckets, needs no model download and embeds a
+                      query in well under a millisecond.
+    LocalVectorIndex: On-disk index made of a `<name>.npy` matrix of
+                      normalized vectors, loaded memory-mapped, and a
+                      `<name>.json` file holding the texts and payloads.
+
+Usage:
+    - Any callable mapping a list of strings to a 2D numpy array can be
+      used as embedding function, it must expose a `name` attribute so
+      that indexes built with another embedding are rebuilt.
+    - Call `LocalVectorIndex.build` once (or when its sources changed),
+      `add` to extend it and `search` to query it.
+    - Entries added with `add` are searchable right away but written to
+      disk at most once per `saveDelay` seconds, call `flush` before the
+      process ends to write the pending ones.
+***************************************************************************/
+"""
+
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+
+class HashingEmbedding:
+    def __init__(self, dimension: int = 2048):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+        self.tokenPattern = re.compile(r"[a-z0-9_]+")
+
+    def _features(self, text: str) -> list:
+        words = self.tokenPattern.findall(text.lower())
+        features = list(words)
+        features += [f"{first} {second}" for first, second in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+        return features
+
+    def __call__(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # crc32 is stable across sessions, unlike the salted built-in `hash`
+                bucket = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                vectors[row, bucket % self.dimension] += sign
+
+        return vectors
+
+
+class LocalVectorIndex:
+    def __init__(self, indexPath: str, name: str, embeddingFunction):
+        self.indexPath = indexPath
+        self.name = name
+        self.embeddingFunction = embeddingFunction
+        self.vectorPath = os.path.join(indexPath, f"{name}.npy")
+        self.metadataPath = os.path.join(indexPath, f"{name}.json")
+
+        self.vectors = None
+        # vectors of the last entries, added since the index was written
+        self.pendingVectors = []
+        self.entries = []
+        self.fingerprint = None
+        self.lock = threading.RLock()
+
+        self.saveDelay = 30
+        self.saveTimer = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def load(self) -> bool:
+        """
+        Load the index from disk. Returns `False` when there is no index or it was built with another embedding.
+        """
+        with self.lock:
+            if not (os.path.exists(self.vectorPath) and os.path.exists(self.metadataPath)):
+                return False
+
+            try:
+                with open(self.metadataPath, "r", encoding="utf-8") as file:
+                    metadata = json.load(file)
+                if metadata.get("embedding") != self.embeddingFunction.name:
+                    return False
+
+                vectors = np.load(self.vectorPath, mmap_mode="r")
+            except (OSError, ValueError):
+                return False
+
+            if vectors.shape[0] != len(metadata["entries"]):
+                return False
+
+            self.vectors = vectors
+            self.pendingVectors = []
+            self.entries = metadata["entries"]
+            self.fingerprint = metadata.get("fingerprint")
+            return True
+
+    def _save(self, vectors: np.ndarray) -> None:
+        os.makedirs(self.indexPath, exist_ok=True)
+        metadata = {"embedding": self.embeddingFunction.name,
+                    "fingerprint": self.fingerprint,
+                    "entries": self.entries}
+
+        # write next to the target and swap, so that a crash never leaves a truncated index
+        temporaryVectorPath = self.vectorPath + ".tmp.npy"
+        temporaryMetadataPath = self.metadataPath + ".tmp"
+        np.save(temporaryVectorPath, vectors)
+        with open(temporaryMetadataPath, "w", encoding="utf-8") as file:
+            json.dump(metadata, file)
+
+        # Windows refuses to replace a file that is still memory-mapped
+        self._closeVectors()
+        os.replace(temporaryVectorPath, self.vectorPath)
+        os.replace(temporaryMetadataPath, self.metadataPath)
+        self.vectors = np.load(self.vectorPath, mmap_mode="r")
+
+    def _closeVectors(self) -> None:
+        """
+        Close the memory map of the stored vectors. Views of it never leave `lock`, so none is used afterwards.
+        """
+        vectors, self.vectors = self.vectors, None
+        if isinstance(vectors, np.memmap) and vectors._mmap is not None:
+            vectors._mmap.close()
+
+    def build(self, texts: list, payloads: list, fingerprint=None) -> None:
+        """
+        Replace the index content. `texts` are embedded, `payloads` (JSON serializable) are returned by `search`.
+        """
+        with self.lock:
+            self.entries = [{"text": text, "payload": payload} for text, payload in zip(texts, payloads)]
+            self.pendingVectors = []
+            self.fingerprint = fingerprint
+            if texts:
+                vectors = self._normalize(self.embeddingFunction(texts))
+            else:
+                vectors = np.zeros((0, 1), dtype=np.float32)
+            self._save(vectors)
+
+    def _storedVectors(self) -> list:
+        if self.vectors is None or self.vectors.shape[0] == 0:
+            return []
+        return [np.asarray(self.vectors)]
+
+    def add(self, texts: list, payloads: list) -> None:
+        """
+        Append entries, texts already in the index are skipped. The entries are written by the next `flush`.
+        """
+        with self.lock:
+            knownTexts = {entry["text"] for entry in self.entries}
+            newItems = [(text, payload) for text, payload in zip(texts, payloads) if text not in knownTexts]
+            if not newItems:
+                return
+
+            self.pendingVectors.append(self._normalize(self.embeddingFunction([text for text, _ in newItems])))
+            self.entries = self.entries + [{"text": text, "payload": payload} for text, payload in newItems]
+            if self.saveTimer is None:
+                self.saveTimer = threading.Timer(self.saveDelay, self.flush)
+                self.saveTimer.daemon = True
+                self.saveTimer.start()
+
+    def flush(self) -> None:
+        """
+        Write the entries added since the index was saved.
+        """
+        with self.lock:
+            if self.saveTimer is not None:
+                self.saveTimer.cancel()
+                self.saveTimer = None
+            if not self.pendingVectors:
+                return
+
+            vectors = np.vstack(self._storedVectors() + self.pendingVectors)
+            self.pendingVectors = []
+            self._save(vectors)
+
+    def search(self, query: str, topK: int = 4, predicate=None) -> list:
+        """
+        Return up to `topK` `(score, entry)` pairs ordered by cosine similarity. `predicate(entry)` filters entries.
+        """
+        with self.lock:
+            vectorBlocks = self._storedVectors() + self.pendingVectors
+            if not vectorBlocks or len(self.entries) == 0:
+                return []
+
+            queryVector = self._normalize(self.embeddingFunction([query]))[0]
+            scores = np.concatenate([np.asarray(vectors @ queryVector) for vectors in vectorBlocks])
+            entries = self.entries
+
+        results = []
+        for position in np.argsort(-scores):
+            entry = entries[int(position)]
+            if predicate is not None and not predicate(entry):
+                continue
+            results.append((float(scores[position]), entry))
+            if len(results) >= topK:
+                break
+
+        return results
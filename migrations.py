@@ -0,0 +1,317 @@
+"""
+/***************************************************************************
+
+Schema migrations of the IntelliGeo database
+
+The schema version of `IntelliGeo.db` is stored in `PRAGMA user_version`.
+`migrate` applies, in order, every migration whose version is newer than
+the stored one and bumps the version after each step, so a database that
+is up to date is not touched at all.
+
+Usage:
+    - Append a `(version, description, function)` entry to `MIGRATIONS`
+      for every schema change. The function receives the Dataloader and
+      the cursor of the migrating connection.
+    - Never edit a migration that was released, add a new one instead.
+      Adding llm models to `Dataloader.llmFullDict` needs a new
+      `(version, "llm models", _llmModels)` entry, which inserts the
+      missing rows.
+    - Each migration runs in one transaction together with the bump of
+      `user_version`, a failing migration leaves the database unchanged.
+      Migrations must not commit.
+
+Note:
+    Databases created before the migrations existed have version 0 but
+    already contain tables, so every migration must be idempotent
+    (`IF NOT EXISTS`, column checks, ...).
+***************************************************************************/
+"""
+
+import sqlite3
+
+from . import log_manager
+
+
+def _columnNames(cursor, tableName) -> set:
+    cursor.execute(f"PRAGMA table_info({tableName})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _initialSchema(dataloader, cursor):
+    dataloader._createInitialSchema()
+
+
+def _promptCache(dataloader, cursor):
+    """
+    Columns of the prompt cache. Rows shipped with the plugin keep `clientVersion` as NULL, rows fetched from the
+    backend are keyed by (promptType, clientVersion).
+    """
+    existingColumns = _columnNames(cursor, dataloader.promptTableName)
+    columnTypes = {"clientVersion": "TEXT", "etag": "TEXT", "fetchedAt": "REAL"}
+    for column in dataloader.promptCacheColname:
+        if column not in existingColumns:
+            cursor.execute(f"ALTER TABLE {dataloader.promptTableName} ADD COLUMN {column} {columnTypes[column]}")
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxPromptCache "
+                   f"ON {dataloader.promptTableName} (promptType, clientVersion)")
+
+
+def _outbox(dataloader, cursor):
+    columns = ["ID INTEGER PRIMARY KEY AUTOINCREMENT",
+               "endpoint TEXT NOT NULL",
+               "payload TEXT NOT NULL",
+               "created TEXT NOT NULL",
+               "attempts INTEGER NOT NULL DEFAULT 0"]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {dataloader.outboxTableName} ({', '.join(columns)})")
+
+
+def _interactionIndexes(dataloader, cursor):
+    """
+    `idxConversationID` only exists on databases created after it was introduced.
+    """
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxConversationID "
+                   f"ON {dataloader.interactionTableName} (conversationID)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxConversationTypeMessage "
+                   f"ON {dataloader.interactionTableName} (conversationID, typeMessage)")
+
+
+def _interactionSequence(dataloader, cursor):
+    """
+    Integer `seq` column on "interaction" and the per-conversation sequence it is allocated from. Existing rows get the
+    index encoded in their "<conversationID><index>" ID.
+    """
+    if "seq" not in _columnNames(cursor, dataloader.interactionTableName):
+        cursor.execute(f"ALTER TABLE {dataloader.interactionTableName} ADD COLUMN seq INTEGER")
+
+    cursor.execute(f"UPDATE {dataloader.interactionTableName} "
+                   f"SET seq = CAST(substr(ID, length(conversationID) + 1) AS INTEGER) "
+                   f"WHERE seq IS NULL AND substr(ID, 1, length(conversationID)) = conversationID")
+
+    columns = ["conversationID TEXT NOT NULL PRIMARY KEY",
+               "nextSeq INTEGER NOT NULL"]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {dataloader.sequenceTableName} ({', '.join(columns)})")
+    cursor.execute(f"INSERT OR REPLACE INTO {dataloader.sequenceTableName} (conversationID, nextSeq) "
+                   f"SELECT conversationID, MAX(seq) + 1 FROM {dataloader.interactionTableName} "
+                   f"WHERE seq IS NOT NULL GROUP BY conversationID")
+
+
+def _latestInteractionIndex(dataloader, cursor):
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxConversationSeq "
+                   f"ON {dataloader.interactionTableName} (conversationID, seq DESC)")
+
+
+def _interactionTokenUsage(dataloader, cursor):
+    """
+    JSON token counts of the prompt sections and the completion, see `PromptAssembler`.
+    """
+    if "tokenUsage" not in _columnNames(cursor, dataloader.interactionTableName):
+        cursor.execute(f"ALTER TABLE {dataloader.interactionTableName} ADD COLUMN tokenUsage TEXT")
+
+
+def _workflowIndex(dataloader, cursor):
+    """
+    Table of the extracted workflows, filled from the interactions stored so far.
+    """
+    columns = ["interactionID TEXT NOT NULL PRIMARY KEY",
+               "conversationID TEXT NOT NULL",
+               "workflowType TEXT NOT NULL",
+               "artifact TEXT NOT NULL"]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {dataloader.workflowTableName} ({', '.join(columns)})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxWorkflowConversationID "
+                   f"ON {dataloader.workflowTableName} (conversationID)")
+
+    columnNames = ", ".join(dataloader.interactionTableColname)
+    cursor.execute(f"SELECT {columnNames} FROM {dataloader.interactionTableName} "
+                   f"WHERE typeMessage = ? AND workflow IN (?, ?, ?)",
+                   ("return", "withModel", "withCode", "withToolbox"))
+    for row in cursor.fetchall():
+        dataloader._insertWorkflow(dict(zip(dataloader.interactionTableColname, row)))
+
+
+def _conversationModifiedIndex(dataloader, cursor):
+    """
+    The conversation browser lists conversations by `modified`, which is stored as "MM DD YYYY HH:MM:SS".
+    """
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxConversationModified "
+                   f"ON {dataloader.conversationTableName} {dataloader.conversationModifiedKey}")
+
+
+def _fullTextSearch(dataloader, cursor):
+    """
+    FTS5 indexes of the conversation titles and descriptions and of the displayed interactions, external content
+    tables kept in sync by triggers. SQLite builds without FTS5 skip this migration, the Dataloader then searches
+    with LIKE.
+    """
+    conversationTable, interactionTable = dataloader.conversationTableName, dataloader.interactionTableName
+    conversationSearch, interactionSearch = dataloader.conversationSearchTableName, dataloader.interactionSearchTableName
+    displayed = "IN ('input', 'return')"
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                   (conversationSearch, interactionSearch))
+    existingTables = {row[0] for row in cursor.fetchall()}
+
+    try:
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {conversationSearch} "
+                       f"USING fts5(title, description, content='{conversationTable}', content_rowid='rowid')")
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {interactionSearch} "
+                       f"USING fts5(requestText, responseText, content='{interactionTable}', content_rowid='rowid')")
+    except sqlite3.OperationalError as error:
+        log_manager.log_debug(f"Full-text search is not available, falling back to LIKE: {error}")
+        return
+
+    triggers = [
+        f"""CREATE TRIGGER IF NOT EXISTS {conversationSearch}Insert AFTER INSERT ON {conversationTable} BEGIN
+            INSERT INTO {conversationSearch} (rowid, title, description)
+            VALUES (new.rowid, new.title, new.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {conversationSearch}Delete AFTER DELETE ON {conversationTable} BEGIN
+            INSERT INTO {conversationSearch} ({conversationSearch}, rowid, title, description)
+            VALUES ('delete', old.rowid, old.title, old.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {conversationSearch}Update
+            AFTER UPDATE OF title, description ON {conversationTable} BEGIN
+            INSERT INTO {conversationSearch} ({conversationSearch}, rowid, title, description)
+            VALUES ('delete', old.rowid, old.title, old.description);
+            INSERT INTO {conversationSearch} (rowid, title, description)
+            VALUES (new.rowid, new.title, new.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {interactionSearch}Insert AFTER INSERT ON {interactionTable}
+            WHEN new.typeMessage {displayed} BEGIN
+            INSERT INTO {interactionSearch} (rowid, requestText, responseText)
+            VALUES (new.rowid, new.requestText, new.responseText);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {interactionSearch}Delete AFTER DELETE ON {interactionTable}
+            WHEN old.typeMessage {displayed} BEGIN
+            INSERT INTO {interactionSearch} ({interactionSearch}, rowid, requestText, responseText)
+            VALUES ('delete', old.rowid, old.requestText, old.responseText);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {interactionSearch}UpdateOld
+            AFTER UPDATE OF requestText, responseText, typeMessage ON {interactionTable}
+            WHEN old.typeMessage {displayed} BEGIN
+            INSERT INTO {interactionSearch} ({interactionSearch}, rowid, requestText, responseText)
+            VALUES ('delete', old.rowid, old.requestText, old.responseText);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {interactionSearch}UpdateNew
+            AFTER UPDATE OF requestText, responseText, typeMessage ON {interactionTable}
+            WHEN new.typeMessage {displayed} BEGIN
+            INSERT INTO {interactionSearch} (rowid, requestText, responseText)
+            VALUES (new.rowid, new.requestText, new.responseText);
+        END""",
+    ]
+    for trigger in triggers:
+        cursor.execute(trigger)
+
+    # only the interactions shown in the chat log are indexed, so 'rebuild' (which indexes every row) is not used
+    if conversationSearch not in existingTables:
+        cursor.execute(f"INSERT INTO {conversationSearch} (rowid, title, description) "
+                       f"SELECT rowid, title, description FROM {conversationTable}")
+    if interactionSearch not in existingTables:
+        cursor.execute(f"INSERT INTO {interactionSearch} (rowid, requestText, responseText) "
+                       f"SELECT rowid, requestText, responseText FROM {interactionTable} "
+                       f"WHERE typeMessage {displayed}")
+
+
+def _isoTimestamps(dataloader, cursor):
+    """
+    Rewrite the "MM DD YYYY HH:MM:SS" timestamps as "YYYY-MM-DD HH:MM:SS", see `utils.getCurrentTimeStamp`, and
+    index the columns that are sorted or filtered by time. Values in another format are left untouched.
+    """
+    timestampColumns = [(dataloader.conversationTableName, "created"),
+                        (dataloader.conversationTableName, "modified"),
+                        (dataloader.interactionTableName, "requestTime"),
+                        (dataloader.interactionTableName, "responseTime"),
+                        (dataloader.outboxTableName, "created")]
+    for tableName, column in timestampColumns:
+        cursor.execute(f"UPDATE {tableName} "
+                       f"SET {column} = substr({column}, 7, 4) || '-' || substr({column}, 1, 2) || '-' "
+                       f"|| substr({column}, 4, 2) || ' ' || substr({column}, 12) "
+                       f"WHERE {column} GLOB '[0-9][0-9] [0-9][0-9] [0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'")
+
+    cursor.execute("DROP INDEX IF EXISTS idxConversationModified")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxConversationModified "
+                   f"ON {dataloader.conversationTableName} (modified)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idxInteractionRequestTime "
+                   f"ON {dataloader.interactionTableName} (requestTime)")
+
+
+def _llmModels(dataloader, cursor):
+    """
+    Rows of the llms added to `Dataloader.llmFullDict` since the previous "llm models" migration.
+    """
+    dataloader._insertLLMRows()
+
+
+def _promptCacheTable(dataloader, cursor):
+    """
+    Prompt cache keyed by (promptType, clientVersion). The cached prompts were stored in the "prompt" table, whose
+    key is the backend ID, so prompts of different client versions and the shipped prompts could replace each other.
+    The newest cached prompt of every key is copied over.
+    """
+    columns = ["promptType TEXT NOT NULL",
+               "clientVersion TEXT NOT NULL",
+               "ID TEXT NOT NULL",
+               "llmID TEXT NOT NULL",
+               "version INTEGER NOT NULL",
+               "template TEXT NOT NULL",
+               "etag TEXT",
+               "fetchedAt REAL NOT NULL",
+               "PRIMARY KEY (promptType, clientVersion)"]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {dataloader.promptCacheTableName} ({', '.join(columns)})")
+    cursor.execute(f"INSERT OR IGNORE INTO {dataloader.promptCacheTableName} "
+                   f"(promptType, clientVersion, ID, llmID, version, template, etag, fetchedAt) "
+                   f"SELECT promptType, clientVersion, ID, llmID, version, template, etag, COALESCE(fetchedAt, 0) "
+                   f"FROM {dataloader.promptTableName} WHERE clientVersion IS NOT NULL ORDER BY fetchedAt DESC")
+
+
+MIGRATIONS = [
+    (1, "initial schema", _initialSchema),
+    (2, "prompt cache columns", _promptCache),
+    (3, "telemetry outbox", _outbox),
+    (4, "interaction indexes", _interactionIndexes),
+    (5, "interaction sequence", _interactionSequence),
+    (6, "latest interaction index", _latestInteractionIndex),
+    (7, "interaction token usage", _interactionTokenUsage),
+    (8, "workflow index", _workflowIndex),
+    (9, "conversation modified index", _conversationModifiedIndex),
+    (10, "full-text search", _fullTextSearch),
+    (11, "ISO timestamps", _isoTimestamps),
+    (12, "prompt cache table", _promptCacheTable),
+    (13, "llm models", _llmModels),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def getSchemaVersion(connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection, dataloader) -> int:
+    """
+    Apply the pending migrations to `connection` and return the resulting schema version.
+    """
+    currentVersion = getSchemaVersion(connection)
+    if currentVersion >= SCHEMA_VERSION:
+        return currentVersion
+
+    cursor = connection.cursor()
+    if connection.in_transaction:
+        connection.commit()
+    for version, description, migration in MIGRATIONS:
+        if version <= currentVersion:
+            continue
+
+        # the schema changes of sqlite are transactional, the migration and its version are applied together
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            migration(dataloader, cursor)
+            # pragmas cannot be parameterized, `version` is an int from the list above
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            log_manager.log_debug(f"Migration {version} ({description}) failed, the schema stays at {currentVersion}")
+            raise
+        currentVersion = version
+
+    return currentVersion
@@ -2,6 +2,10 @@
 import json
 import os
 import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import time
 
 
 from qgis.PyQt.QtCore import QThreadPool, pyqtSignal, QObject
@@ -12,20 +16,54 @@ from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.runnables import RunnableLambda
 from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
 from langchain_community.vectorstores import FAISS
-from langchain_cohere import ChatCohere
-from langchain_openai import ChatOpenAI
-from langchain_deepseek import ChatDeepSeek
-from langchain_groq import ChatGroq
 
-from .utils import show_variable_popup, getVersion, getCurrentTimeStamp, pack
+from .utils import show_variable_popup, getVersion, getCurrentTimeStamp, pack, getIntelligeoEnvVar
 from .tools import readEnvironment
+from .environment import getEnvironmentSnapshot
+from .promptAssembler import PromptAssembler
 from .responseWorker import ResponseWorker, ReflectWorker
-from .dataloader import Dataloader
+from .llmRegistry import getLLM
+from .intentClassifier import getIntentClassifier, normalizeDecision, LOCAL_PROMPT_ID
 from . import log_manager
 
 
+# shared by every Processor: prompt fetch and retrieval calls of one request run side by side
+contextExecutor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="IntelliGeoContext")
+# runs the branch `reactionRouter` expects while the classifier is still deciding
+speculationExecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="IntelliGeoSpeculation")
+
+# cheap guess of the classifier decision, a request matching none of them is not speculated
+refinePattern = re.compile(r"\b(fix|change|modify|instead|again|previous|update|adjust|error|wrong|still)\b",
+                           re.IGNORECASE)
+producePattern = re.compile(r"\b(create|generate|make|write|build|calculate|compute|buffer|clip|reproject|convert|"
+                            r"export|load|add|count|select|extract|merge|intersect|dissolve|filter|script|code)\b",
+                            re.IGNORECASE)
+chatPattern = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|who|why|what is|what are|what does|explain|tell me)\b",
+                         re.IGNORECASE)
+
+
+class SpeculationCancelled(Exception):
+    """
+    Raised inside a speculative branch once the classifier decided for another branch.
+    """
+
+
+class SpeculativeRun:
+    """
+    State of a branch started before the classifier decided. Its interaction rows and streamed tokens are held back
+    until the branch is accepted, `cancelEvent` is set when it is rejected.
+    """
+    def __init__(self):
+        self.cancelEvent = threading.Event()
+        self.accepted = False
+        self.rows = []
+        self.tokens = []
+        self.lock = threading.Lock()
+
+
 class Processor(QObject):
     responseReady = pyqtSignal(str, str, str, str)
+    tokenReceived = pyqtSignal(str)
     reflectionReady = pyqtSignal(str, str, str, str)
     errorSignal = pyqtSignal(str)
 
@@ -33,96 +71,359 @@ class Processor(QObject):
         super().__init__()
         self.latestInteractionID = None
         self.llmID = llmID
-        self.dataloader = Dataloader("IntelliGeo.db")
+        # the pooled connections make the shared dataloader safe to use from worker threads
+        self.dataloader = dataloader
 
         self.llmProvider, self.llmName = llmID.split("::")
-        _, apiKey = dataloader.fetchAPIKey(self.llmID)
-        if self.llmProvider == "OpenAI":
-            self.llm = ChatOpenAI(model=self.llmName, openai_api_key=apiKey, temperature=0)
-        elif self.llmProvider == "Cohere":
-            self.llm = ChatCohere(model=self.llmName, cohere_api_key=apiKey, temperature=0)
-        elif self.llmProvider == "DeepSeek":
-            self.llm = ChatDeepSeek(model=self.llmName, api_key=apiKey, temperature=0)
-
-        elif self.llmProvider == "Groq":
-            self.llm = ChatGroq(model=self.llmName, api_key=apiKey, temperature=0)
+        # created on first use, see `llm`
+        self._llm = None
 
         self.conversationID = conversationID
         self.retrivalDatabase = retrievalVectorbase
         self.outputParser = StrOutputParser()
         self.version = getVersion()
 
-        self.threadpool = QThreadPool()  # Create a thread pool
+        self.threadpool = QThreadPool.globalInstance()  # Shared by every conversation
+
+        # seconds to wait for each call of the context fan-out
+        self.promptTimeout = 20
+        self.retrievalTimeout = 15
+
+        # start the likely branch together with the classifier, see `reactionRouter`. Opt-in: a rejected branch
+        # costs the tokens it streamed before the classifier decided.
+        self.speculative = getIntelligeoEnvVar("intelliGeo_speculative") == "true"
+        self.speculation = threading.local()
+
+        # decide locally when the intent classifier is confident enough, the LLM classifier is asked otherwise
+        self.localClassifier = getIntelligeoEnvVar("intelliGeo_local_classifier") != "false"
+        self.localClassifierThreshold = 0.85
+        self.intentClassifier = getIntentClassifier()
+
+        # "prefetch" puts the environment description into the producer prompts, "tool" lets the llm request it
+        self.environmentMode = "tool" if getIntelligeoEnvVar("intelliGeo_environment_mode") == "tool" else "prefetch"
+        environmentTokens = getIntelligeoEnvVar("intelliGeo_environment_tokens")
+        self.environmentTokenBudget = int(environmentTokens) if environmentTokens.isdigit() else 1500
+
+        # fits the retrieved documentation & examples into the context window of the llm
+        contextWindow = dataloader.llmContextWindowDict.get(self.llmName, dataloader.llmContextWindowDict["default"])
+        self.promptAssembler = PromptAssembler(self.llmName, contextWindow)
+
+    @property
+    def llm(self):
+        """
+        Client of `llmID` from the process-wide registry, looked up on the first request of this Processor.
+        """
+        if self._llm is None:
+            _, apiKey = self.dataloader.fetchAPIKey(self.llmID)
+            self._llm = getLLM(self.llmProvider, self.llmName, apiKey)
+        return self._llm
+
+    def _gatherContext(self, userInput: str, promptType: str, docTopK=None, exampleTopK=None,
+                       exampleType: str = "Script") -> tuple[dict, list, list]:
+        """
+        Fetch the prompt, the documentation (`docTopK`) and the few-shot examples (`exampleTopK`) concurrently.
+        Retrieval that fails or exceeds its timeout contributes an empty list, so the slowest call bounds the wait.
+        Returns `(promptRow, documentList, exampleList)`.
+        """
+        start = time.monotonic()
+        promptFuture = contextExecutor.submit(self.dataloader.fetchPrompt, self.llmID, promptType=promptType)
+        docFuture, exampleFuture = None, None
+        if docTopK is not None:
+            docFuture = contextExecutor.submit(self.retrivalDatabase.retrieveDocument, userInput, topK=docTopK)
+        if exampleTopK is not None:
+            exampleFuture = contextExecutor.submit(self.retrivalDatabase.retrieveExample, userInput,
+                                                   topK=exampleTopK, exampleType=exampleType)
+
+        def collect(future, name):
+            if future is None:
+                return []
+            remaining = max(0.0, self.retrievalTimeout - (time.monotonic() - start))
+            try:
+                return future.result(timeout=remaining)[0]
+            except FutureTimeoutError as e:
+                log_manager.log_error(f"{name} retrieval timed out after {self.retrievalTimeout}s", e)
+            except Exception as e:
+                log_manager.log_error(f"{name} retrieval failed", e)
+            return []
+
+        retrievedDoc = collect(docFuture, "Document")
+        retrievedExample = collect(exampleFuture, "Example")
+        promptRow = promptFuture.result(timeout=max(0.0, self.promptTimeout - (time.monotonic() - start)))
+
+        return promptRow, retrievedDoc, retrievedExample
+
+    def _environmentContext(self) -> str:
+        """
+        Cached description of the QGIS project, cut after the last layer that fits `environmentTokenBudget`. Empty in
+        "tool" mode, the llm requests the description itself.
+        """
+        if self.environmentMode != "prefetch":
+            return ""
+
+        environmentText = getEnvironmentSnapshot().text()
+        if self.promptAssembler.countTokens(environmentText) <= self.environmentTokenBudget:
+            return environmentText
+
+        header, *layerDescriptions = environmentText.split("\nLayer Name: ")
+        environmentContext = header
+        usedTokens = self.promptAssembler.countTokens(header)
+        for index, layerDescription in enumerate(layerDescriptions):
+            layerDescription = "\nLayer Name: " + layerDescription
+            layerTokens = self.promptAssembler.countTokens(layerDescription)
+            if usedTokens + layerTokens > self.environmentTokenBudget:
+                environmentContext += f"\n... {len(layerDescriptions) - index} more layers not listed;\n"
+                break
+            environmentContext += layerDescription
+            usedTokens += layerTokens
+
+        return environmentContext
+
+    def _environmentMessages(self, humanMessage: HumanMessage, environmentContext: str):
+        """
+        Return `(messageList, llm)` for the final completion of a producer. In "prefetch" mode `environmentContext`
+        is added to `humanMessage` directly, in "tool" mode the llm may request it through the `readEnvironment` tool
+        first, which costs a whole extra round trip.
+        """
+        if self.environmentMode == "prefetch":
+            content = f"{humanMessage.content}\n\nCurrent QGIS project:\n{environmentContext}"
+            return [HumanMessage(content)], self.llm
+
+        messageList = [humanMessage]
+        if self.llmName in ["deepseek-reasoner"]:
+            return messageList, self.llm
+
+        tools = [readEnvironment]
+        toolDict = {"readenvironment": readEnvironment}
+        llmWithTools = self.llm.bind_tools(tools)
+        llmMessage = llmWithTools.invoke(messageList)
+        messageList.append(llmMessage)
+
+        for toolcall in llmMessage.tool_calls:
+            selectedTool = toolDict[toolcall["name"].lower()]
+            toolOutput = selectedTool.invoke(toolcall["args"])
+            messageList.append(ToolMessage(toolOutput, tool_call_id=toolcall["id"]))
+
+        return messageList, llmWithTools
 
-    def classifier(self, userInput: str) -> str:
+    def classifier(self, userInput: str, localDecision=None) -> str:
         """
         Base on the given `userInput`, decide if it is asking about producing workflow (model, code).
-        Return "yes" or "no".
+        Return "yes" or "no". `localDecision` is the result of `_localDecision` for `userInput`, the LLM classifier
+        is only asked when it is `None`.
         """
         requestTime = getCurrentTimeStamp()
-        classifierPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="classifier")
-        show_variable_popup(classifierPromptRow)
-        classifierPrompt = ChatPromptTemplate.from_template(classifierPromptRow["template"])
+        if localDecision is not None:
+            decision, confidence = localDecision
+            promptID, contextText = LOCAL_PROMPT_ID, f"local confidence {confidence:.2f}"
+        else:
+            classifierPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="classifier")
+            show_variable_popup(classifierPromptRow)
+            classifierPrompt = ChatPromptTemplate.from_template(classifierPromptRow["template"])
 
-        classifierChain = classifierPrompt | self.llm | self.outputParser
-        decision = classifierChain.invoke({"input": userInput})
+            classifierChain = classifierPrompt | self.llm | self.outputParser
+            decision = classifierChain.invoke({"input": userInput})
+            promptID, contextText = classifierPromptRow["ID"], ""
         responseTime = getCurrentTimeStamp()
 
         # ["conversationID", "promptID",
         #  "requestText", "contextText", "requestTime", "typeMessage",
         #  "responseText", "responseTime", "workflow", "executionLog"]
-        interactionRow = [self.conversationID, classifierPromptRow["ID"],
-                          userInput, "", requestTime, "input",
+        interactionRow = [self.conversationID, promptID,
+                          userInput, contextText, requestTime, "input",
                           decision, responseTime, "empty", ""]
-        self.dataloader.insertInteraction(interactionRow, self.conversationID)
+        self._recordInteraction(interactionRow)
 
         return decision
 
-    def reactionRouter(self, userInput, responseType):
-        decision = self.classifier(userInput)
-        show_variable_popup(decision)
+    def _localDecision(self, userInput: str):
+        """
+        Return `(decision, confidence)` of the local intent classifier, `None` when it is not confident enough.
+        """
+        if not self.localClassifier:
+            return None
 
-        if decision.lower() in ["no", "yes, yes", "yes, no"]:
-            if decision.lower() == "no":
-                generalChatResponse = self.generalChat(userInput)
+        try:
+            self.intentClassifier.ensureTrained(self.dataloader)
+        except Exception as e:
+            log_manager.log_error("Training the local intent classifier failed", e)
 
-                return generalChatResponse, "empty"
+        decision, confidence = self.intentClassifier.predict(userInput)
+        if decision is None or confidence < self.localClassifierThreshold:
+            return None
+        return decision, confidence
 
-            elif decision.lower() == "yes, no":
-                if responseType == "Visual mode":
-                    modelProducerResponse = self.modelProducer(userInput)
-                    return modelProducerResponse, "withModel"
-                elif responseType == "Code":
-                    codeProducerResponse, interactionID = self.codeProducer(userInput)
-                    return codeProducerResponse, "withCode"
-                else:
-                    codeProducerResponse, interactionID = self.toolBoxProducer(userInput)
-                    return codeProducerResponse, "withToolbox"
+    @staticmethod
+    def _guessDecision(userInput: str):
+        """
+        Keyword guess of the classifier decision. Refinements depend on the latest interaction and are never guessed.
+        """
+        if refinePattern.search(userInput):
+            return None
+        elif producePattern.search(userInput):
+            return "yes, no"
+        elif chatPattern.search(userInput):
+            return "no"
+        return None
+
+    def _selectBranch(self, decision: str, responseType: str):
+        """
+        Return `(branch, workflow)`, `branch(userInput)` returns the response text.
+        """
+        if decision == "no":
+            return self.generalChat, "empty"
 
-            else:
-                if responseType == "Visual mode":
-                    modelProducerResponse = self.modelRefine(userInput)
-                    return modelProducerResponse, "withModel"
-                elif responseType == "Code":
-                    codeProducerResponse, interactionID = self.codeRefine(userInput)
-                    return codeProducerResponse, "withCode"
-                else:
-                    codeProducerResponse, interactionID = self.toolBoxRefine(userInput)
-                    return codeProducerResponse, "withToolbox"
-
-        elif "yes" in decision.lower():
+        if decision == "yes, no":
             if responseType == "Visual mode":
-                modelProducerResponse = self.modelProducer(userInput)
-                return modelProducerResponse, "withModel"
+                return self.modelProducer, "withModel"
             elif responseType == "Code":
-                codeProducerResponse, interactionID = self.codeProducer(userInput)
-                return codeProducerResponse, "withCode"
+                return lambda userInput: self.codeProducer(userInput)[0], "withCode"
             else:
-                codeProducerResponse, interactionID = self.toolBoxProducer(userInput)
-                return codeProducerResponse, "withToolbox"
+                return lambda userInput: self.toolBoxProducer(userInput)[0], "withToolbox"
 
+        if responseType == "Visual mode":
+            return self.modelRefine, "withModel"
+        elif responseType == "Code":
+            return lambda userInput: self.codeRefine(userInput)[0], "withCode"
         else:
+            return lambda userInput: self.toolBoxRefine(userInput)[0], "withToolbox"
+
+    def _recordInteraction(self, interactionRow: list, track: bool = False, tokenUsage: dict = None):
+        """
+        Insert `interactionRow`, or hold it back while running speculatively so that nothing is stored for a branch
+        the classifier rejects. `track` makes the row the `latestInteractionID`.
+        """
+        speculativeRun = getattr(self.speculation, "run", None)
+        if speculativeRun is not None:
+            with speculativeRun.lock:
+                if not speculativeRun.accepted:
+                    self._checkCancelled()
+                    speculativeRun.rows.append((interactionRow, track, tokenUsage))
+                    return None
+
+        interactionID = self.dataloader.insertInteraction(interactionRow, self.conversationID, tokenUsage)
+        if track:
+            self.latestInteractionID = interactionID
+        return interactionID
+
+    def _emitToken(self, token: str):
+        """
+        Forward a streamed token to the dock, a speculative branch keeps its tokens until the classifier agreed.
+        """
+        speculativeRun = getattr(self.speculation, "run", None)
+        if speculativeRun is not None:
+            with speculativeRun.lock:
+                if not speculativeRun.accepted:
+                    speculativeRun.tokens.append(token)
+                    return
+
+        self.tokenReceived.emit(token)
+
+    def _streamText(self, chain, chainInput) -> str:
+        """
+        `chain.invoke(chainInput)` for chains ending with the output parser, emitting the tokens as they arrive.
+        """
+        chunks = []
+        for chunk in self._cancellableStream(chain.stream(chainInput)):
+            chunks.append(chunk)
+            if chunk:
+                self._emitToken(chunk)
+
+        return "".join(chunks)
+
+    def _streamMessage(self, llm, messageList):
+        """
+        `llm.invoke(messageList)` emitting the text tokens as they arrive. The chunks are merged, so the returned
+        message also carries the tool calls. Falls back to `llm.invoke` when the stream yields no chunk.
+        """
+        llmMessage = None
+        for chunk in self._cancellableStream(llm.stream(messageList)):
+            llmMessage = chunk if llmMessage is None else llmMessage + chunk
+            if isinstance(chunk.content, str) and chunk.content:
+                self._emitToken(chunk.content)
+
+        if llmMessage is None:
+            self._checkCancelled()
+            llmMessage = llm.invoke(messageList)
+            if isinstance(llmMessage.content, str) and llmMessage.content:
+                self._emitToken(llmMessage.content)
+
+        return llmMessage
+
+    def _cancellableStream(self, stream):
+        """
+        Yield the chunks of `stream` until the speculative branch is rejected. The stream is closed right away then,
+        which ends the request, so a rejected branch stops streaming tokens.
+        """
+        try:
+            for chunk in stream:
+                self._checkCancelled()
+                yield chunk
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+    def _checkCancelled(self):
+        speculativeRun = getattr(self.speculation, "run", None)
+        if speculativeRun is not None and speculativeRun.cancelEvent.is_set():
+            raise SpeculationCancelled()
+
+    def _runSpeculative(self, branch, userInput: str, speculativeRun):
+        self.speculation.run = speculativeRun
+        try:
+            self.dataloader.connect()
+            return branch(userInput)
+        finally:
+            del self.speculation.run
+
+    def _acceptSpeculative(self, speculativeRun):
+        """
+        Store the rows and emit the tokens the branch held back, from now on it stores and streams directly.
+        """
+        with speculativeRun.lock:
+            speculativeRun.accepted = True
+            for interactionRow, track, tokenUsage in speculativeRun.rows:
+                self._recordInteraction(interactionRow, track, tokenUsage)
+            if speculativeRun.tokens:
+                self.tokenReceived.emit("".join(speculativeRun.tokens))
+
+    def reactionRouter(self, userInput, responseType):
+        # nothing to speculate on when the local classifier answers right away
+        localDecision = self._localDecision(userInput)
+        guess = None
+        if self.speculative and localDecision is None:
+            guess = self._guessDecision(userInput)
+        if guess is None:
+            decision = self.classifier(userInput, localDecision)
+            show_variable_popup(decision)
+            return self._route(decision, userInput, responseType)
+
+        # run the guessed branch while the classifier decides, its rows are stored after the classifier row
+        branch, workflow = self._selectBranch(guess, responseType)
+        speculativeRun = SpeculativeRun()
+        speculativeFuture = speculationExecutor.submit(self._runSpeculative, branch, userInput, speculativeRun)
+        try:
+            decision = self.classifier(userInput)
+        except Exception:
+            speculativeRun.cancelEvent.set()
+            raise
+        show_variable_popup(decision)
+
+        if normalizeDecision(decision) != guess:
+            speculativeRun.cancelEvent.set()
+            log_manager.log_debug(f"Speculative branch '{guess}' discarded, classifier decided '{decision}'")
+            return self._route(decision, userInput, responseType)
+
+        self._acceptSpeculative(speculativeRun)
+        return speculativeFuture.result(), workflow
+
+    def _route(self, decision, userInput, responseType):
+        normalizedDecision = normalizeDecision(decision)
+        if normalizedDecision is None:
             confirmChain = self.confirmChain()
+            return
+
+        branch, workflow = self._selectBranch(normalizedDecision, responseType)
+        return branch(userInput), workflow
 
     def generalChat(self, userInput: str) -> str:
         requestTime = getCurrentTimeStamp()
@@ -138,7 +439,7 @@ class Processor(QObject):
             llmWithTools = self.llm.bind_tools(tools)
         else:
             llmWithTools = self.llm
-        llmMessage = llmWithTools.invoke(messageList)
+        llmMessage = self._streamMessage(llmWithTools, messageList)
         messageList.append(llmMessage)
 
         if len(llmMessage.tool_calls) == 0 or self.llmName in ["deepseek-reasoner"]:
@@ -154,8 +455,9 @@ class Processor(QObject):
             contextText = "-------------".join([message.content for message in messageList])
 
             # langchain inference
+            self._checkCancelled()
             chatChain = llmWithTools | self.outputParser
-            chatReturn = chatChain.invoke(messageList)
+            chatReturn = self._streamText(chatChain, messageList)
         show_variable_popup(chatReturn)
         responseTime = getCurrentTimeStamp()
 
@@ -165,40 +467,30 @@ class Processor(QObject):
         interactionRow = [self.conversationID, generalChatPromptRow["ID"],
                           userInput, contextText, requestTime, "return",
                           chatReturn, responseTime, "empty", ""]
-        self.dataloader.insertInteraction(interactionRow, self.conversationID)
+        self._recordInteraction(interactionRow)
 
         return chatReturn
 
     def modelProducer(self, userInput: str) -> str:
         requestTime = getCurrentTimeStamp()
 
-        generalChatPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="modelProducer")
+        # get prompt & example
+        generalChatPromptRow, _, retrievedExample = self._gatherContext(userInput, "modelProducer",
+                                                                        exampleTopK=2, exampleType="Model")
         template = generalChatPromptRow["template"]
 
-        # get example
-        retrievedExample = self.retrivalDatabase.retrieveExample(userInput, topK=2, exampleType="Model")[0]
-        exampleStr = ""
-        for example in retrievedExample:
-            exampleStr += "\n\n" + example
-
-        humanMessage = HumanMessage(template.format(input=userInput, example=exampleStr))
-        messageList = [humanMessage]
-
-        tools = [readEnvironment]
-        llmWithTools = self.llm.bind_tools(tools)
-        llmMessage = llmWithTools.invoke(messageList)
-        messageList.append(llmMessage)
-
-        for toolcall in llmMessage.tool_calls:
-            selectedTool = {"readenvironment": readEnvironment}[toolcall["name"].lower()]
-            toolOutput = selectedTool.invoke(toolcall["args"])
-            messageList.append(ToolMessage(toolOutput, tool_call_id=toolcall["id"]))
+        environmentContext = self._environmentContext()
+        promptText, tokenUsage = self.promptAssembler.assemble(template, {"input": userInput},
+                                                               {"example": retrievedExample}, environmentContext)
+        humanMessage = HumanMessage(promptText)
+        messageList, llmWithTools = self._environmentMessages(humanMessage, environmentContext)
 
         contextText = "\n-------------\n".join([message.content for message in messageList])
 
         # langchain inference
+        self._checkCancelled()
         modelProducerChain = llmWithTools | self.outputParser
-        modelReturn = modelProducerChain.invoke(messageList)
+        modelReturn = self._streamText(modelProducerChain, messageList)
         responseTime = getCurrentTimeStamp()
 
         # ["conversationID", "promptID",
@@ -207,50 +499,31 @@ class Processor(QObject):
         interactionRow = [self.conversationID, generalChatPromptRow["ID"],
                           userInput, contextText, requestTime, "return",
                           modelReturn, responseTime, "withModel", ""]
-        self.dataloader.insertInteraction(interactionRow, self.conversationID)
+        tokenUsage["completion"] = self.promptAssembler.countTokens(modelReturn)
+        self._recordInteraction(interactionRow, tokenUsage=tokenUsage)
 
         return modelReturn
 
     def codeProducer(self, userInput: str) -> tuple[str, str]:
         requestTime = getCurrentTimeStamp()
-        codeProducerPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="codeProducer")
+        # get prompt, documentation & few-shot examples
+        codeProducerPromptRow, retrievedDoc, retrievedExample = self._gatherContext(userInput, "codeProducer",
+                                                                                    docTopK=4, exampleTopK=2)
         template = codeProducerPromptRow["template"]
 
-        # get documentation
-        retrievedDoc = self.retrivalDatabase.retrieveDocument(userInput)[0]
-        docStr = ""
-        for doc in retrievedDoc:
-            docStr += "\n\n" + doc
-
-        # get few-shot examples
-        retrievedExample = self.retrivalDatabase.retrieveExample(userInput, topK=2, exampleType="Script")[0]
-        exampleStr = ""
-        """
-        for example in retrievedExample:
-            exampleStr += "\n\n" + example
-        """
-        humanMessage = HumanMessage(template.format(input=userInput, doc=docStr, example=exampleStr))
-        messageList = [humanMessage]
-
-        tools = [readEnvironment]
-        toolDict = {"readenvironment": readEnvironment}
-        if self.llmName not in ["deepseek-reasoner"]:
-            llmWithTools = self.llm.bind_tools(tools)
-            llmMessage = llmWithTools.invoke(messageList)
-            messageList.append(llmMessage)
-        else:
-            llmWithTools = self.llm
-
-        if self.llmName not in ["deepseek-reasoner"]:
-            for toolcall in llmMessage.tool_calls:
-                selectedTool = toolDict[toolcall["name"].lower()]
-                toolOutput = selectedTool.invoke(toolcall["args"])
-                messageList.append(ToolMessage(toolOutput, tool_call_id=toolcall["id"]))
+        # the few-shot examples are left out of the code prompt
+        environmentContext = self._environmentContext()
+        promptText, tokenUsage = self.promptAssembler.assemble(template, {"input": userInput},
+                                                               {"doc": retrievedDoc, "example": []},
+                                                               environmentContext)
+        humanMessage = HumanMessage(promptText)
+        messageList, llmWithTools = self._environmentMessages(humanMessage, environmentContext)
 
         contextText = "-------------\n".join([message.content for message in messageList])
         # langchain inference
+        self._checkCancelled()
         codeProducerChain = llmWithTools | self.outputParser
-        codeReturn = codeProducerChain.invoke(messageList)
+        codeReturn = self._streamText(codeProducerChain, messageList)
         responseTime = getCurrentTimeStamp()
 
         # ["conversationID", "promptID",
@@ -259,54 +532,33 @@ class Processor(QObject):
         interactionRow = [self.conversationID, codeProducerPromptRow["ID"],
                           userInput, contextText, requestTime, "return",
                           codeReturn, responseTime, "withCode", ""]
-        interactionID = self.dataloader.insertInteraction(interactionRow, self.conversationID)
-        self.latestInteractionID = interactionID
+        tokenUsage["completion"] = self.promptAssembler.countTokens(codeReturn)
+        interactionID = self._recordInteraction(interactionRow, track=True, tokenUsage=tokenUsage)
 
         return codeReturn, interactionID
 
     def toolBoxProducer(self, userInput: str) -> tuple[str, str]:
         requestTime = getCurrentTimeStamp()
-        toolBoxProducerPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="toolBoxProducer")
+        # get prompt, documentation & few-shot examples
+        toolBoxProducerPromptRow, retrievedDoc, retrievedExample = self._gatherContext(userInput, "toolBoxProducer",
+                                                                                       docTopK=1, exampleTopK=2)
         template = toolBoxProducerPromptRow["template"]
 
-        # get documentation
-        retrievedDoc = self.retrivalDatabase.retrieveDocument(userInput, topK=1)[0]
-        docStr = ""
-        for doc in retrievedDoc:
-            docStr += "\n\n" + doc
-
-        # get few-shot examples
-        retrievedExample = self.retrivalDatabase.retrieveExample(userInput, topK=2, exampleType="Script")[0]
-        exampleStr = ""
-
-        for example in retrievedExample:
-            exampleStr += "\n\n" + example
-
-        humanMessage = HumanMessage(template.format(input=userInput, doc=docStr, example=exampleStr))
-        messageList = [humanMessage]
+        environmentContext = self._environmentContext()
+        promptText, tokenUsage = self.promptAssembler.assemble(template, {"input": userInput},
+                                                               {"doc": retrievedDoc, "example": retrievedExample},
+                                                               environmentContext)
+        humanMessage = HumanMessage(promptText)
+        messageList, llmWithTools = self._environmentMessages(humanMessage, environmentContext)
 
         show_variable_popup(messageList)
 
-        tools = [readEnvironment]
-        toolDict = {"readenvironment": readEnvironment}
-        if self.llmName not in ["deepseek-reasoner"]:
-            llmWithTools = self.llm.bind_tools(tools)
-            llmMessage = llmWithTools.invoke(messageList)
-            messageList.append(llmMessage)
-        else:
-            llmWithTools = self.llm
-
-        if self.llmName not in ["deepseek-reasoner"]:
-            for toolcall in llmMessage.tool_calls:
-                selectedTool = toolDict[toolcall["name"].lower()]
-                toolOutput = selectedTool.invoke(toolcall["args"])
-                messageList.append(ToolMessage(toolOutput, tool_call_id=toolcall["id"]))
-
         contextText = "-------------".join([message.content for message in messageList])
 
         # langchain inference
+        self._checkCancelled()
         codeProducerChain = llmWithTools | self.outputParser
-        codeReturn = codeProducerChain.invoke(messageList)
+        codeReturn = self._streamText(codeProducerChain, messageList)
         responseTime = getCurrentTimeStamp()
 
         # ["conversationID", "promptID",
@@ -315,8 +567,8 @@ class Processor(QObject):
         interactionRow = [self.conversationID, toolBoxProducerPromptRow["ID"],
                           userInput, contextText, requestTime, "return",
                           codeReturn, responseTime, "withCode", ""]
-        interactionID = self.dataloader.insertInteraction(interactionRow, self.conversationID)
-        self.latestInteractionID = interactionID
+        tokenUsage["completion"] = self.promptAssembler.countTokens(codeReturn)
+        interactionID = self._recordInteraction(interactionRow, track=True, tokenUsage=tokenUsage)
 
         return codeReturn, interactionID
 
@@ -349,8 +601,8 @@ class Processor(QObject):
         response, workflow = self.reactionRouter(userInput, responseType)
         return response, workflow
 
-    def asyncReflect(self, logMessage, executedCode, responseType: str = "code"):
-        worker = ReflectWorker(self, logMessage, executedCode, responseType)
+    def asyncReflect(self, logMessage, executedCode, responseType: str = "code", interactionID=None):
+        worker = ReflectWorker(self, logMessage, executedCode, responseType, interactionID)
         worker.signals.finished.connect(
             lambda response, workflow: self.handleReflect(logMessage,
                                                           responseType,
@@ -367,12 +619,17 @@ class Processor(QObject):
                                   response,
                                   workflow)
 
-    def reflect(self, logMessage, executedCode, responseType: str = "code"):
+    def reflect(self, logMessage, executedCode, responseType: str = "code", interactionID=None):
+        """
+        Ask the llm to fix `executedCode`, which failed with `logMessage`. The request and response of the
+        interaction `interactionID` (the latest interaction when `None`) are given as context.
+        """
         try:
             requestTime = getCurrentTimeStamp()
             codeProducerPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="codeProducer")
 
-            latestRow = self.dataloader.selectLatestInteraction(self.conversationID, self.latestInteractionID)
+            latestRow = self.dataloader.selectLatestInteraction(self.conversationID,
+                                                                interactionID or self.latestInteractionID)
             latestInteraction = pack(latestRow, "interaction")
 
             userInput = latestInteraction["requestText"]  # get the user Input
@@ -417,11 +674,11 @@ class Processor(QObject):
             contextText = "-------------".join([message.content for message in messageList])
 
             codeDebuggerChain = self.llm | self.outputParser
-            codeReturn = codeDebuggerChain.invoke(messageList)
+            codeReturn = self._streamText(codeDebuggerChain, messageList)
             responseTime = getCurrentTimeStamp()
             interactionRow = [self.conversationID, codeProducerPromptRow["ID"],
                               userInput, contextText, requestTime, "return",
-                              codeReturn, responseTime, "withModel", ""]
+                              codeReturn, responseTime, "withCode", ""]
 
             interactionID = self.dataloader.insertInteraction(interactionRow, self.conversationID)
             self.latestInteractionID = interactionID
@@ -437,22 +694,11 @@ class Processor(QObject):
 
     def codeRefine(self, userInput: str) -> tuple[str, str]:
         requestTime = getCurrentTimeStamp()
-        codeRefinerPromptRow = self.dataloader.fetchPrompt(self.llmID, promptType="codeRefiner")
+        # get prompt, documentation & few-shot examples
+        codeRefinerPromptRow, retrievedDoc, retrievedExample = self._gatherContext(userInput, "codeRefiner",
+                                                                                   docTopK=1, exampleTopK=2)
         template = codeRefinerPromptRow["template"]
 
-        # get documentation
-        retrievedDoc = self.retrivalDatabase.retrieveDocument(userInput, topK=1)[0]
-        docStr = ""
-        for doc in retrievedDoc:
-            docStr += "\n\n" + doc
-
-        # get few-shot examples
-        retrievedExample = self.retrivalDatabase.retrieveExample(userInput, topK=2, exampleType="Script")[0]
-        exampleStr = ""
-        """
-        for example in retrievedExample:
-            exampleStr += "\n\n" + example
-        """
         # get last interaction
         latestInteractionRow = self.dataloader.selectLatestInteraction(self.conversationID,
                                                                        self.latestInteractionID)
@@ -461,26 +707,22 @@ class Processor(QObject):
         # get the AI response
         previousRequest, AIResponse = latestInteraction["requestText"], latestInteraction["responseText"]
         show_variable_popup(previousRequest)
-        humanMessage = HumanMessage(template.format(input=userInput, previousRequest=previousRequest,
-                                                    previousResponse=AIResponse, doc=docStr, example=exampleStr))
+        # the few-shot examples are left out of the code prompt
+        environmentContext = self._environmentContext()
+        promptText, tokenUsage = self.promptAssembler.assemble(template,
+                                                               {"input": userInput, "previousRequest": previousRequest,
+                                                                "previousResponse": AIResponse},
+                                                               {"doc": retrievedDoc, "example": []},
+                                                               environmentContext)
+        humanMessage = HumanMessage(promptText)
         show_variable_popup(humanMessage)
-        messageList = [humanMessage]
-
-        tools = [readEnvironment]
-        toolDict = {"readenvironment": readEnvironment}
-        llmWithTools = self.llm.bind_tools(tools)
-        llmMessage = llmWithTools.invoke(messageList)
-        messageList.append(llmMessage)
-
-        for toolcall in llmMessage.tool_calls:
-            selectedTool = toolDict[toolcall["name"].lower()]
-            toolOutput = selectedTool.invoke(toolcall["args"])
-            messageList.append(ToolMessage(toolOutput, tool_call_id=toolcall["id"]))
+        messageList, llmWithTools = self._environmentMessages(humanMessage, environmentContext)
 
         contextText = "-------------\n".join([message.content for message in messageList])
         # langchain inference
+        self._checkCancelled()
         codeProducerChain = llmWithTools | self.outputParser
-        codeReturn = codeProducerChain.invoke(messageList)
+        codeReturn = self._streamText(codeProducerChain, messageList)
         responseTime = getCurrentTimeStamp()
 
         # ["conversationID", "promptID",
@@ -489,8 +731,8 @@ class Processor(QObject):
         interactionRow = [self.conversationID, codeRefinerPromptRow["ID"],
                           userInput, contextText, requestTime, "return",
                           codeReturn, responseTime, "withCode", ""]
-        interactionID = self.dataloader.insertInteraction(interactionRow, self.conversationID)
-        self.latestInteractionID = interactionID
+        tokenUsage["completion"] = self.promptAssembler.countTokens(codeReturn)
+        interactionID = self._recordInteraction(interactionRow, track=True, tokenUsage=tokenUsage)
 
         return codeReturn, interactionID
 
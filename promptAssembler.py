@@ -0,0 +1,88 @@
+"""
+/***************************************************************************
+
+Prompt assembler
+
+This module fits the retrieved context of a request into the context
+window of the selected llm.
+
+Classes:
+    PromptAssembler: Formats a prompt template with its fixed fields and
+                     fills the chunk fields (documentation, examples, ...)
+                     with as many retrieved chunks as the token budget
+                     allows, the budget being the model's context window
+                     minus the tokens reserved for the response and for
+                     text added after the template (e.g. the environment).
+
+Usage:
+    - Chunks are expected in rank order (best first). The fields are
+      filled round-robin, so each field keeps its best chunks, and a chunk
+      that does not fit is cut when it is the first one of its field and
+      dropped otherwise.
+    - `assemble` returns the prompt and the token counts it used, the
+      Processor stores them in the "tokenUsage" column of "interaction".
+***************************************************************************/
+"""
+
+from .utils import countTokens, trimText2TokenLimit
+
+
+class PromptAssembler:
+    def __init__(self, modelName: str, contextWindow: int, responseReserve: int = 2048):
+        self.modelName = modelName
+        self.contextWindow = contextWindow
+        # small windows keep at least half of their size for the prompt
+        self.responseReserve = min(responseReserve, contextWindow // 2)
+
+    def countTokens(self, text: str) -> int:
+        return countTokens(text, self.modelName)
+
+    def trim(self, text: str, limit: int) -> str:
+        return trimText2TokenLimit(text, limit, self.modelName)
+
+    def assemble(self, template: str, fields: dict, chunkFields: dict, reservedText: str = "",
+                 separator: str = "\n\n") -> tuple[str, dict]:
+        """
+        Format `template` with `fields` and the chunks of `chunkFields` (`{placeholder: [chunk, ...]}`) that fit the
+        budget, `reservedText` is counted but not inserted. Returns `(prompt, tokenUsage)`.
+        """
+        emptyChunkFields = {placeholder: "" for placeholder in chunkFields}
+        baseTokens = self.countTokens(template.format(**fields, **emptyChunkFields))
+        reservedTokens = self.countTokens(reservedText) if reservedText else 0
+        budget = self.contextWindow - self.responseReserve - baseTokens - reservedTokens
+
+        selectedChunks = {placeholder: [] for placeholder in chunkFields}
+        chunkTokens = {placeholder: 0 for placeholder in chunkFields}
+        droppedChunks = 0
+        rank = 0
+        while any(rank < len(chunks) for chunks in chunkFields.values()):
+            for placeholder, chunks in chunkFields.items():
+                if rank >= len(chunks):
+                    continue
+
+                chunk = separator + chunks[rank]
+                tokens = self.countTokens(chunk)
+                if tokens > budget and not selectedChunks[placeholder] and budget > 0:
+                    chunk = self.trim(chunk, budget)
+                    tokens = self.countTokens(chunk)
+                if tokens > budget:
+                    droppedChunks += 1
+                    continue
+
+                selectedChunks[placeholder].append(chunk)
+                chunkTokens[placeholder] += tokens
+                budget -= tokens
+            rank += 1
+
+        chunkText = {placeholder: "".join(chunks) for placeholder, chunks in selectedChunks.items()}
+        prompt = template.format(**fields, **chunkText)
+
+        tokenUsage = {"model": self.modelName,
+                      "contextWindow": self.contextWindow,
+                      "template": baseTokens,
+                      "reserved": reservedTokens,
+                      "droppedChunks": droppedChunks}
+        tokenUsage.update(chunkTokens)
+        tokenUsage["prompt"] = baseTokens + reservedTokens + sum(chunkTokens.values())
+
+        return prompt, tokenUsage
@@ -0,0 +1,140 @@
+"""
+/***************************************************************************
+
+QueryCache
+
+This module defines the QueryCache class, a thread-safe LRU cache for
+retrieval results, optionally persisted to a JSON file.
+
+Classes:
+    QueryCache: Maps a normalized query key to its results, evicting the
+                least recently used entries once `maxEntries` or
+                `maxBytes` is exceeded, and counts hits and misses.
+
+Usage:
+    - Build keys with `QueryCache.makeKey(kind, query, ...)`, the query
+      is lowercased and its whitespace and trailing punctuation removed so
+      that resent or slightly reformatted requests share an entry.
+    - `get` returns `None` on a miss, `put` stores a JSON serializable
+      result.
+    - A persisted cache is written at most once per `saveDelay` seconds
+      after a change, call `flush` before the process ends to write the
+      last changes.
+***************************************************************************/
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    def __init__(self, maxEntries: int = 256, maxBytes: int = 2 * 1024 * 1024, persistPath: str = None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.persistPath = persistPath
+
+        self.entries = OrderedDict()
+        self.entrySizes = {}
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.saveDelay = 30
+        self.saveTimer = None
+
+        if self.persistPath is not None:
+            self._load()
+
+    @staticmethod
+    def makeKey(kind: str, query: str, *parameters) -> str:
+        normalizedQuery = re.sub(r"\s+", " ", str(query).lower()).strip(" \t\n.!?,;:")
+        return json.dumps([kind, normalizedQuery] + [str(parameter) for parameter in parameters])
+
+    def get(self, key: str):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key: str, value) -> None:
+        size = len(json.dumps(value))
+        if size > self.maxBytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.totalBytes -= self.entrySizes[key]
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.entrySizes[key] = size
+            self.totalBytes += size
+            self._evict()
+            self._scheduleSave()
+
+    def _evict(self):
+        while len(self.entries) > self.maxEntries or self.totalBytes > self.maxBytes:
+            key, _ = self.entries.popitem(last=False)
+            self.totalBytes -= self.entrySizes.pop(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.entrySizes.clear()
+            self.totalBytes = 0
+            self._scheduleSave()
+
+    def _scheduleSave(self):
+        # called with the lock held, changes made before the timer fires are written together
+        if self.persistPath is not None and self.saveTimer is None:
+            self.saveTimer = threading.Timer(self.saveDelay, self.flush)
+            self.saveTimer.daemon = True
+            self.saveTimer.start()
+
+    def flush(self) -> None:
+        """
+        Write the pending changes of a persisted cache.
+        """
+        with self.lock:
+            if self.saveTimer is None:
+                return
+
+            self.saveTimer.cancel()
+            self.saveTimer = None
+            self._save()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.totalBytes}
+
+    def _load(self):
+        if not os.path.exists(self.persistPath):
+            return
+
+        try:
+            with open(self.persistPath, "r", encoding="utf-8") as file:
+                storedEntries = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        # stored from least to most recently used
+        for key, value in storedEntries:
+            size = len(json.dumps(value))
+            self.entries[key] = value
+            self.entrySizes[key] = size
+            self.totalBytes += size
+        self._evict()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.persistPath), exist_ok=True)
+        temporaryPath = self.persistPath + ".tmp"
+        with open(temporaryPath, "w", encoding="utf-8") as file:
+            json.dump(list(self.entries.items()), file)
+        os.replace(temporaryPath, self.persistPath)
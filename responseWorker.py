@@ -22,29 +22,35 @@ class ResponseWorker(QRunnable):
             response, workflow = self.processor.response(self.userInput, self.responseType)
             # Emit the finished signal with the response and workflow
             self.signals.finished.emit(response, workflow)
-            self.processor.dataloader.close()
         except Exception as e:
             errorStr = traceback.format_exc()
             self.signals.error.emit(errorStr)
+        finally:
+            # pool threads expire and are recreated, their connections would stay open
+            self.processor.dataloader.close()
 
 
 class ReflectWorker(QRunnable):
-    def __init__(self, processor, executedCode, logMessage, responseType):
+    def __init__(self, processor, logMessage, executedCode, responseType, interactionID=None):
         super().__init__()
         self.processor = processor
         self.logMessage = logMessage
         self.executedCode = executedCode
         self.responseType = responseType
+        self.interactionID = interactionID
         self.signals = WorkerSignals()
 
     def run(self):
         try:
             # Execute the long-running task
             self.processor.dataloader.connect()
-            response, workflow = self.processor.reflect(self.logMessage, self.executedCode, self.responseType)
+            response, workflow = self.processor.reflect(self.logMessage, self.executedCode, self.responseType,
+                                                        self.interactionID)
             # Emit the finished signal with the response and workflow
             self.signals.finished.emit(response, workflow)
-            self.processor.dataloader.close()
         except Exception as e:
             errorStr = traceback.format_exc()
             self.signals.error.emit(errorStr)
+        finally:
+            # pool threads expire and are recreated, their connections would stay open
+            self.processor.dataloader.close()
@@ -3,10 +3,10 @@
 
 RetrievalVectorbase
 
-This module defines the RetrievalVectorbase class, which manages vector
-stores for document retrieval and few-shot learning examples. It leverages
-FAISS for efficient vector storage and search, and SentenceTransformer for
-encoding text into embeddings.
+This module defines the RetrievalVectorbase class, which retrieves PyQGIS
+documentation and few-shot examples for the LLM prompts. Queries are
+answered by local vector indexes; the IntelliGeo backend is only used as a
+fallback.
 
 Classes:
     RetrievalVectorbase: Handles the creation, loading, and querying of
@@ -14,74 +14,242 @@ Classes:
                          examples.
 
 Usage:
-    - Initialize the RetrievalVectorbase with a specified version.
-    - Use createDocumentStore and createFewshotStore to set up the vector
-      stores.
+    - Initialize the RetrievalVectorbase with a specified version and,
+      optionally, an embedding function (see `localRetrieval.py`).
     - Retrieve relevant documents or examples based on user input using
       retrieveDocument and retrieveExample methods.
 
 Dependencies:
     - requests
-    - faiss
-    - re
-    - os
-    - json
+    - numpy
     - csv
-    - BeautifulSoup from bs4
-    - SentenceTransformer from sentence_transformers
-    - WebBaseLoader from langchain_community.document_loaders
-    - RecursiveCharacterTextSplitter, HTMLSectionSplitter from
-      langchain_text_splitters
+    - json
+    - localRetrieval (local module)
     - utils (local module)
 
 Note:
     The vector stores are saved in the user's Documents folder under
-    "QGIS_IntelliGeo/.vectorDB".
+    "QGIS_IntelliGeo/.vectorDB". The example store is built from the
+    scripts, models and `few_shot_examples.csv` shipped in
+    `resources/Model_examples`, the documentation store from
+    `resources/Documentation`. The documentation store also caches every
+    document returned by the backend, so repeated topics are answered
+    offline. Set `intelliGeo_remote_retrieval=false` in
+    `intelligeo_var.txt` to never contact the backend.
 ***************************************************************************/
 """
 
+import csv
+import hashlib
+import json
+import os
+import threading
+
 import requests
 
 
-from .utils import splitAtPattern, show_variable_popup
+from .httpSession import getSession
+from .localRetrieval import HashingEmbedding, LocalVectorIndex
+from .queryCache import QueryCache
+from .utils import splitAtPattern, show_variable_popup, getIntelligeoEnvVar
+from . import log_manager
 # from .utils import readURL
 
 class RetrievalVectorbase:
-    def __init__(self, version):
+    def __init__(self, version, embeddingFunction=None):
         self.version = version
         self.backendURL = "https://owsgip.itc.utwente.nl/intelligeo/"
+        self.requestTimeout = 15
+        self.remoteFallback = getIntelligeoEnvVar("intelliGeo_remote_retrieval") != "false"
+
+        self.vectorDBPath = os.path.join(os.path.expanduser("~"), "Documents", "QGIS_IntelliGeo", ".vectorDB")
+        self.examplePath = os.path.join(os.path.dirname(__file__), "resources", "Model_examples")
+        self.documentationPath = os.path.join(os.path.dirname(__file__), "resources", "Documentation")
+        self.embeddingFunction = embeddingFunction or HashingEmbedding()
+
+        # local documents are only trusted when they are similar enough to the query
+        self.documentMinScore = 0.35
+
+        self.exampleIndex = LocalVectorIndex(self.vectorDBPath, "examples", self.embeddingFunction)
+        self.documentIndex = LocalVectorIndex(self.vectorDBPath, f"documents_{self.version}", self.embeddingFunction)
+        self.indexesLoaded = False
+        # retrievals run concurrently, the indexes are loaded (or rebuilt) by one of them
+        self.indexLock = threading.Lock()
+
+        # results of repeated or reformatted queries, persisted unless `intelliGeo_retrieval_cache=memory`
+        cachePath = None
+        if getIntelligeoEnvVar("intelliGeo_retrieval_cache") != "memory":
+            cachePath = os.path.join(self.vectorDBPath, f"queryCache_{self.version}.json")
+        self.queryCache = QueryCache(persistPath=cachePath)
+
+    def _loadIndexes(self):
+        """
+        Load the indexes on first use, (re)building an index when the shipped examples or documentation changed.
+        """
+        if self.indexesLoaded:
+            return
+
+        with self.indexLock:
+            if self.indexesLoaded:
+                return
+
+            fingerprint = self._folderFingerprint(self.examplePath)
+            if not self.exampleIndex.load() or self.exampleIndex.fingerprint != fingerprint:
+                self._buildExampleIndex(fingerprint)
+            fingerprint = self._folderFingerprint(self.documentationPath)
+            if not self.documentIndex.load() or self.documentIndex.fingerprint != fingerprint:
+                self._buildDocumentIndex(fingerprint)
+            self.indexesLoaded = True
+
+    def flush(self):
+        """
+        Write the documents and query results cached since the last save, called when the plugin is unloaded.
+        """
+        self.documentIndex.flush()
+        self.queryCache.flush()
+
+    @staticmethod
+    def _folderFingerprint(folderPath):
+        digest = hashlib.sha1()
+        for folder, _, fileNames in sorted(os.walk(folderPath)):
+            for fileName in sorted(fileNames):
+                filePath = os.path.join(folder, fileName)
+                digest.update(f"{filePath}:{os.path.getsize(filePath)}:{os.path.getmtime(filePath)}".encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def _buildExampleIndex(self, fingerprint):
+        """
+        Every question of `few_shot_examples.csv` is indexed once for the model (.model3) and once for the script (.py)
+        of the example it belongs to. The example name is indexed as well.
+        """
+        exampleFolders = {"Model": ("Models", ".model3"), "Script": ("Scripts", ".py")}
+        questions = {}
+        with open(os.path.join(self.examplePath, "few_shot_examples.csv"), "r", encoding="utf-8") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 2 and row[0]:
+                    # questions containing commas are split over the remaining columns
+                    questions.setdefault(row[0], []).append(",".join(row[1:]).strip(", "))
+
+        texts, payloads = [], []
+        for exampleName, exampleQuestions in questions.items():
+            for exampleType, (folderName, extension) in exampleFolders.items():
+                filePath = os.path.join(self.examplePath, folderName, exampleName + extension)
+                if not os.path.exists(filePath):
+                    continue
+                for text in [exampleName.replace("_", " ")] + exampleQuestions:
+                    texts.append(text)
+                    payloads.append({"exampleType": exampleType, "name": exampleName,
+                                     "path": os.path.relpath(filePath, self.examplePath)})
+
+        self.exampleIndex.build(texts, payloads, fingerprint)
+
+    def _buildDocumentIndex(self, fingerprint):
+        """
+        Index the documentation shipped in `resources/Documentation`, so that documents are found on a fresh install
+        and offline. The documents cached from the backend so far are kept.
+        """
+        texts, payloads = [], []
+        for fileName in sorted(os.listdir(self.documentationPath)):
+            if not fileName.endswith(".json"):
+                continue
+            with open(os.path.join(self.documentationPath, fileName), "r", encoding="utf-8") as file:
+                for document in json.load(file):
+                    texts.append(f"{document['title']}\n{document['text']}")
+                    payloads.append({"source": "bundled", "title": document["title"]})
+
+        for entry in self.documentIndex.entries:
+            if entry["payload"].get("source") == "remote":
+                texts.append(entry["text"])
+                payloads.append(entry["payload"])
+
+        self.documentIndex.build(texts, payloads, fingerprint)
+
+    def _readExample(self, relativePath):
+        with open(os.path.join(self.examplePath, relativePath), "r", encoding="utf-8") as file:
+            return file.read()
+
+    def _postRemote(self, endpoint, payload):
+        url = self.backendURL + endpoint
+        try:
+            response = getSession().post(url, json=payload, timeout=self.requestTimeout)
+            response.raise_for_status()  # Raise an exception for HTTP errors
+            data = response.json()
+            return data["results"]
+        except requests.exceptions.RequestException as e:
+            log_manager.log_error(f"Remote retrieval '{endpoint}' failed", e)
+            return None
 
     def retrieveDocument(self, userInput, topK=4):
-        url = self.backendURL + "/retrieve_document/"
+        cacheKey = QueryCache.makeKey("document", userInput, topK, self.version, self.embeddingFunction.name)
+        results = self.queryCache.get(cacheKey)
+        if results is None:
+            results, cacheable = self._retrieveDocument(userInput, topK)
+            if cacheable:
+                self.queryCache.put(cacheKey, results)
+
+        return results
+
+    def _retrieveDocument(self, userInput, topK):
+        """
+        Returns `(results, cacheable)`, results of a failed backend request are not cached.
+        """
+        self._loadIndexes()
+        localResults = [(score, entry["text"]) for score, entry in self.documentIndex.search(str(userInput), topK)]
+        confidentResults = [text for score, text in localResults if score >= self.documentMinScore]
+        if len(confidentResults) >= topK or not self.remoteFallback:
+            return [[text for _, text in localResults]], True
+
         payload = {
             "version": str(self.version),
             "query": str(userInput),
             "topK": topK
         }
+        results = self._postRemote("/retrieve_document/", payload)
+        if results is None:
+            return [[text for _, text in localResults]], False
 
-        try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            data = response.json()
-            return data["results"]
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return [[]]
+        # cache the returned documentation, the corpus grows with every topic asked about
+        documents = [document for document in results[0] if document] if results else []
+        if documents:
+            try:
+                self.documentIndex.add(documents, [{"source": "remote"}] * len(documents))
+            except OSError as e:
+                log_manager.log_error("Failed to cache retrieved documents", e)
+
+        return results, True
 
     def retrieveExample(self, userInput, topK=4, exampleType="Model"):
-        url = self.backendURL + "/retrieve_example/"
+        cacheKey = QueryCache.makeKey("example", userInput, topK, exampleType, self.version,
+                                      self.embeddingFunction.name)
+        results = self.queryCache.get(cacheKey)
+        if results is None:
+            results, cacheable = self._retrieveExample(userInput, topK, exampleType)
+            if cacheable:
+                self.queryCache.put(cacheKey, results)
+
+        return results
+
+    def _retrieveExample(self, userInput, topK, exampleType):
+        self._loadIndexes()
+        hits = self.exampleIndex.search(str(userInput), topK * 8,
+                                        predicate=lambda entry: entry["payload"]["exampleType"] == exampleType)
+        examplePaths = []
+        for _, entry in hits:
+            if entry["payload"]["path"] not in examplePaths:
+                examplePaths.append(entry["payload"]["path"])
+        examplePaths = examplePaths[:topK]
+
+        if examplePaths or not self.remoteFallback:
+            return [[self._readExample(path) for path in examplePaths]], True
+
         payload = {
             "version": self.version,
             "query": userInput,
             "topK": topK,
             "exampleType": exampleType
         }
-
-        try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            data = response.json()
-            return data["results"]
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return [[]]
\ No newline at end of file
+        results = self._postRemote("/retrieve_example/", payload)
+        return (results, True) if results is not None else ([[]], False)
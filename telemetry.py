@@ -0,0 +1,302 @@
+"""
+/***************************************************************************
+
+TelemetrySender
+
+This module defines the TelemetrySender class, which delivers the
+interaction and conversation records queued in the local "outbox" table to
+the IntelliGeo backend from a background thread.
+
+Classes:
+    TelemetrySender: Drains the outbox in batches, retrying with
+                     exponential backoff, so that the LLM response path
+                     never waits on telemetry.
+
+Usage:
+    - Insert a row into the outbox table and call `notify()` on the sender
+      returned by `getTelemetrySender(databasePath, backendURL)`.
+    - `stopTelemetrySenders()` stops the background threads when the
+      plugin is unloaded.
+    - Rows are only deleted once the backend acknowledged them, pending
+      rows of a previous session are sent on the next start. A row the
+      backend rejected `maxAttempts` times is dropped, so that it does
+      not block the rows queued after it.
+
+Note:
+    When the backend asks for a captcha the request is forwarded to the
+    main (GUI) thread through the `captchaRequired` signal, the sender
+    waits until the dialog is answered, at most `captchaTimeout` seconds,
+    and retries the delivery later.
+***************************************************************************/
+"""
+
+import json
+import queue
+import threading
+
+import requests
+
+from qgis.PyQt.QtCore import QObject, QCoreApplication, pyqtSignal
+
+from .connectionPool import getConnectionPool
+from .httpSession import getSession
+from .utils import getSystemInfo, getCurrentTimeStamp, toBackendTimeStamp, captchaPopup
+from . import log_manager
+
+
+class TelemetrySender(QObject):
+    captchaRequired = pyqtSignal(object)
+
+    def __init__(self, databasePath, backendURL):
+        super().__init__()
+        self.databasePath = databasePath
+        self.backendURL = backendURL
+        self.outboxTableName = "outbox"
+        self.credentialTableName = "credential"
+
+        self.batchSize = 50
+        self.maxOutboxRows = 5000
+        self.maxAttempts = 5
+        self.captchaTimeout = 300
+        self.requestTimeout = 15
+        self.initialRetryDelay = 2
+        self.maxRetryDelay = 300
+        self.failureCount = 0
+        # `None` until the backend told us whether it accepts batched records
+        self.batchSupported = None
+
+        # bounded wake-up queue, the outbox table itself is the durable queue
+        self.wakeQueue = queue.Queue(maxsize=100)
+        self.stopEvent = threading.Event()
+        self.captchaAnswered = threading.Event()
+        self.session = getSession()
+
+        # captcha dialogs must be shown by the GUI thread
+        application = QCoreApplication.instance()
+        if application is not None:
+            self.moveToThread(application.thread())
+        self.captchaRequired.connect(self.onCaptchaRequired)
+
+        self.thread = threading.Thread(target=self._run, name="IntelliGeoTelemetry", daemon=True)
+        self.thread.start()
+
+    def notify(self):
+        """
+        Wake the sender up after a row was added to the outbox. Never blocks: if the queue is full the sender is
+        already awake and will pick the row up from the table.
+        """
+        try:
+            self.wakeQueue.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def stop(self, timeout=5):
+        """
+        Stop the background thread once its current delivery is done. The rows left in the outbox are sent by the
+        sender of the next session.
+        """
+        self.stopEvent.set()
+        self.captchaAnswered.set()
+        self.notify()
+        self.thread.join(timeout)
+
+    def _run(self):
+        pool = getConnectionPool(self.databasePath)
+        connection = pool.getConnection()
+        try:
+            while not self.stopEvent.is_set():
+                self._drain(connection)
+
+                # wait for new records, or for the backoff delay when the last delivery failed
+                timeout = self._retryDelay() if self.failureCount else None
+                try:
+                    self.wakeQueue.get(timeout=timeout)
+                except queue.Empty:
+                    pass
+                while not self.wakeQueue.empty():
+                    self.wakeQueue.get_nowait()
+        except Exception as error:
+            log_manager.log_error("Telemetry sender stopped", error)
+        finally:
+            pool.release()
+
+    def _retryDelay(self):
+        return min(self.initialRetryDelay * 2 ** (self.failureCount - 1), self.maxRetryDelay)
+
+    def _drain(self, connection):
+        cursor = connection.cursor()
+        self._trimOutbox(connection)
+        while True:
+            cursor.execute(f"SELECT ID, endpoint, payload FROM {self.outboxTableName} ORDER BY ID LIMIT ?",
+                           (self.batchSize,))
+            rows = cursor.fetchall()
+            if not rows:
+                self.failureCount = 0
+                return
+
+            delivered = self._send(connection, rows)
+            self._dropRejected(connection)
+            if not delivered:
+                self.failureCount += 1
+                return
+
+            self.failureCount = 0
+
+    def _deleteRows(self, connection, IDs):
+        connection.execute(f"DELETE FROM {self.outboxTableName} WHERE ID IN ({', '.join('?' * len(IDs))})", IDs)
+        connection.commit()
+
+    def _countRejection(self, connection, ID):
+        connection.execute(f"UPDATE {self.outboxTableName} SET attempts = attempts + 1 WHERE ID = ?", (ID,))
+        connection.commit()
+
+    def _dropRejected(self, connection):
+        """
+        Drop the rows the backend rejected `maxAttempts` times, they would block the outbox otherwise.
+        """
+        cursor = connection.execute(f"DELETE FROM {self.outboxTableName} WHERE attempts >= ?", (self.maxAttempts,))
+        if cursor.rowcount > 0:
+            log_manager.log_debug(f"Dropped {cursor.rowcount} telemetry records rejected by the backend")
+        connection.commit()
+
+    def _trimOutbox(self, connection):
+        """
+        Keep the outbox bounded when the backend is unreachable for a long time, the oldest records are dropped.
+        """
+        connection.execute(f"DELETE FROM {self.outboxTableName} WHERE ID NOT IN "
+                           f"(SELECT ID FROM {self.outboxTableName} ORDER BY ID DESC LIMIT ?)",
+                           (self.maxOutboxRows,))
+        connection.commit()
+
+    def _loadCredential(self, cursor):
+        cursor.execute(f"SELECT sessionID, sessionKey FROM {self.credentialTableName} ORDER BY ID LIMIT 1")
+        row = cursor.fetchone()
+        return row if row is not None else ("", "")
+
+    def _send(self, connection, rows) -> bool:
+        """
+        Deliver `rows` in one batched request. Falls back to one request per record when the backend has no batch
+        endpoint or rejected the batch, so that only the faulty records are counted as rejected. A row is deleted as
+        soon as the backend acknowledged it. Returns `True` when every record was accepted.
+        """
+        sessionID, sessionKey = self._loadCredential(connection.cursor())
+        header = getSystemInfo()
+        records = [(ID, endpoint, json.loads(payload)) for ID, endpoint, payload in rows]
+
+        try:
+            if self.batchSupported is not False:
+                body = {"records": [{"endpoint": endpoint, "data": data} for _, endpoint, data in records],
+                        "sessionID": sessionID, "sessionKey": sessionKey}
+                response = self.session.post(f"{self.backendURL}/batch", json=body, headers=header,
+                                             timeout=self.requestTimeout)
+                if response.status_code in (404, 405):
+                    self.batchSupported = False
+                else:
+                    self.batchSupported = True
+                    outcome = self._handleResponse(response)
+                    if outcome == "accepted":
+                        self._deleteRows(connection, [ID for ID, _, _ in records])
+                        return True
+                    if outcome == "retry":
+                        return False
+
+            delivered = True
+            for ID, endpoint, data in records:
+                dataDict = dict(data, sessionID=sessionID, sessionKey=sessionKey)
+                response = self.session.post(f"{self.backendURL}/{endpoint}", json=dataDict,
+                                             headers=header, timeout=self.requestTimeout)
+                outcome = self._handleResponse(response)
+                if outcome == "accepted":
+                    self._deleteRows(connection, [ID])
+                elif outcome == "rejected":
+                    self._countRejection(connection, ID)
+                    delivered = False
+                else:
+                    return False
+            return delivered
+
+        except requests.exceptions.RequestException as error:
+            log_manager.log_debug(f"Telemetry delivery failed: {error}")
+            return False
+
+    def _handleResponse(self, response) -> str:
+        """
+        Return "accepted", "rejected" when the backend refused the record(s), or "retry" when the delivery should be
+        tried again later (server error, rate limit or captcha).
+        """
+        if response.status_code == 200:
+            return "accepted"
+
+        try:
+            captchaDict = response.json().get('detail', {})
+        except ValueError:
+            captchaDict = {}
+
+        if isinstance(captchaDict, dict) and "question" in captchaDict:
+            # wait for the GUI thread to register new credentials, then retry the batch
+            self.captchaAnswered.clear()
+            self.captchaRequired.emit(captchaDict)
+            if not self.captchaAnswered.wait(self.captchaTimeout):
+                log_manager.log_debug("Captcha not answered, telemetry delivery postponed")
+            return "retry"
+
+        if response.status_code >= 500 or response.status_code == 429:
+            return "retry"
+        return "rejected"
+
+    def onCaptchaRequired(self, captchaDict):
+        try:
+            answer = captchaPopup(captchaDict)
+            if answer is None:
+                return
+
+            header = getSystemInfo()
+            header["sendtime"] = toBackendTimeStamp(getCurrentTimeStamp())
+            response = self.session.post(f"{self.backendURL}/register", headers=header, json={"answer": answer},
+                                         timeout=self.requestTimeout)
+            if response.status_code == 200:
+                responseData = response.json()
+                self._updateCredential(responseData.get("sessionID"), responseData.get("sessionKey"))
+
+        except Exception as error:
+            log_manager.log_error("Telemetry registration failed", error)
+        finally:
+            self.captchaAnswered.set()
+
+    def _updateCredential(self, sessionID, sessionKey):
+        connection = getConnectionPool(self.databasePath).getConnection()
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT ID FROM {self.credentialTableName} ORDER BY ID LIMIT 1")
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(f"UPDATE {self.credentialTableName} SET sessionID = ?, sessionKey = ? WHERE ID = ?",
+                           (sessionID, sessionKey, row[0]))
+        else:
+            cursor.execute(f"INSERT INTO {self.credentialTableName} (ID, sessionID, sessionKey) VALUES (?, ?, ?)",
+                           ("1", sessionID, sessionKey))
+        connection.commit()
+
+
+_senders = {}
+_sendersLock = threading.Lock()
+
+
+def getTelemetrySender(databasePath, backendURL) -> TelemetrySender:
+    """
+    Return the process-wide sender of `databasePath`, starting it on first use.
+    """
+    with _sendersLock:
+        if databasePath not in _senders:
+            _senders[databasePath] = TelemetrySender(databasePath, backendURL)
+        return _senders[databasePath]
+
+
+def stopTelemetrySenders():
+    """
+    Stop every sender, called when the plugin is unloaded so that a reloaded plugin starts fresh ones.
+    """
+    with _sendersLock:
+        senders = list(_senders.values())
+        _senders.clear()
+    for sender in senders:
+        sender.stop()
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""SQLite connection pool test."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from ..connectionPool import ConnectionPool, getConnectionPool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Test one connection per thread and a single schema bootstrap."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.databasePath = os.path.join(self.directory, "IntelliGeo.db")
+        self.bootstraps = []
+        self.pool = ConnectionPool(self.databasePath, self._bootstrap)
+
+    def tearDown(self):
+        self.pool.closeAll()
+        shutil.rmtree(self.directory)
+
+    def _bootstrap(self, connection):
+        self.bootstraps.append(connection)
+        # the bootstrap goes through the pool again, like `Dataloader._bootstrap`
+        self.pool.getCursor().execute("CREATE TABLE IF NOT EXISTS conversation (ID TEXT PRIMARY KEY)")
+
+    def test_sameConnectionPerThread(self):
+        connection = self.pool.getConnection()
+        self.assertIs(self.pool.getConnection(), connection)
+        self.assertIs(self.pool.getCursor().connection, connection)
+
+        workerConnections = []
+        worker = threading.Thread(target=lambda: workerConnections.append(self.pool.getConnection()))
+        worker.start()
+        worker.join()
+        self.assertIsNot(workerConnections[0], connection)
+        self.assertEqual(len(self.pool.connections), 2)
+
+    def test_walJournal(self):
+        connection = self.pool.getConnection()
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        # NORMAL
+        self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 1)
+
+    def test_bootstrapOnce(self):
+        def connect():
+            self.pool.getConnection()
+
+        workers = [threading.Thread(target=connect) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        connect()
+
+        self.assertEqual(len(self.bootstraps), 1)
+        self.assertTrue(self.pool.bootstrapped)
+        self.pool.getCursor().execute("SELECT * FROM conversation")
+
+    def test_failedBootstrapIsRetried(self):
+        def failingBootstrap(connection):
+            raise sqlite3.OperationalError("database is locked")
+
+        pool = ConnectionPool(self.databasePath, failingBootstrap)
+        with self.assertRaises(sqlite3.OperationalError):
+            pool.getConnection()
+        self.assertFalse(pool.bootstrapped)
+
+        bootstraps = []
+        pool.bootstrap = bootstraps.append
+        pool.getConnection()
+        self.assertEqual(len(bootstraps), 1)
+        pool.closeAll()
+
+    def test_release(self):
+        connection = self.pool.getConnection()
+        self.pool.release()
+        self.assertEqual(self.pool.connections, [])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+
+        # a new connection is opened, without bootstrapping again
+        self.assertIsNot(self.pool.getConnection(), connection)
+        self.assertEqual(len(self.bootstraps), 1)
+        self.pool.release()
+        self.pool.release()
+
+    def test_closeAll(self):
+        connection = self.pool.getConnection()
+        self.pool.closeAll()
+        self.assertEqual(self.pool.connections, [])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+        self.pool.getConnection().execute("SELECT 1")
+
+    def test_getConnectionPool(self):
+        databasePath = os.path.join(self.directory, "pooled.db")
+        pool = getConnectionPool(databasePath)
+        self.assertIsNone(pool.bootstrap)
+
+        # the bootstrap of a later caller is kept
+        self.assertIs(getConnectionPool(databasePath, self._bootstrap), pool)
+        self.assertEqual(pool.bootstrap, self._bootstrap)
+        self.assertIsNot(getConnectionPool(self.databasePath), pool)
+        pool.closeAll()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+# coding=utf-8
+"""Dataloader test: interaction sequence, paging and search."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from .. import dataloader as dataloaderModule
+from ..dataloader import Dataloader, SNIPPET_MARKERS
+from ..utils import getCurrentTimeStamp
+
+
+class TelemetrySender:
+    def notify(self):
+        pass
+
+
+class DataloaderTestCase(unittest.TestCase):
+    """Dataloader on a database in a temporary home folder, without telemetry."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.environ.get("HOME")
+        os.environ["HOME"] = self.directory
+        self.getTelemetrySender = dataloaderModule.getTelemetrySender
+        dataloaderModule.getTelemetrySender = lambda databasePath, backendURL: TelemetrySender()
+
+        self.dataloader = Dataloader("IntelliGeo.db")
+        for conversationID in ["c1", "c2"]:
+            self._createConversation(conversationID, f"conversation {conversationID}", "")
+
+    def tearDown(self):
+        self.dataloader.pool.closeAll()
+        dataloaderModule.getTelemetrySender = self.getTelemetrySender
+        if self.home is None:
+            os.environ.pop("HOME")
+        else:
+            os.environ["HOME"] = self.home
+        shutil.rmtree(self.directory)
+
+    def _createConversation(self, conversationID, title, description):
+        timeStamp = getCurrentTimeStamp()
+        self.dataloader.createConversation({"ID": conversationID, "llmID": "Cohere::command-r", "title": title,
+                                            "description": description, "created": timeStamp, "modified": timeStamp,
+                                            "messageCount": 0, "workflowCount": 0, "userID": "user"})
+
+    def _insert(self, conversationID, typeMessage="input", requestText="buffer the roads", responseText="yes, no"):
+        timeStamp = getCurrentTimeStamp()
+        return self.dataloader.insertInteraction([conversationID, "promptID", requestText, "context", timeStamp,
+                                                  typeMessage, responseText, timeStamp, "empty", "{}"],
+                                                 conversationID)
+
+
+class InteractionSequenceTest(DataloaderTestCase):
+    """Test the per-conversation sequence numbers of the interactions."""
+
+    def test_sequencePerConversation(self):
+        self.assertEqual([self._insert("c1") for _ in range(3)], ["c10", "c11", "c12"])
+        self.assertEqual(self._insert("c2"), "c20")
+        self.assertEqual(self._insert("c1"), "c13")
+
+        self.dataloader.cursor.execute("SELECT seq FROM interaction WHERE conversationID = 'c1' ORDER BY seq")
+        self.assertEqual([row[0] for row in self.dataloader.cursor.fetchall()], [0, 1, 2, 3])
+
+    def test_failedInsertIsRolledBack(self):
+        self._insert("c1")
+        with self.assertRaises(Exception):
+            # one value missing
+            self.dataloader.insertInteraction(["c1", "promptID"], "c1")
+        self.assertFalse(self.dataloader.connection.in_transaction)
+        self.assertEqual(self._insert("c1"), "c11")
+
+    def test_concurrentInserts(self):
+        interactionIDs = []
+
+        def insertInteractions():
+            try:
+                for _ in range(10):
+                    interactionIDs.append(self._insert("c1"))
+            finally:
+                self.dataloader.close()
+
+        workers = [threading.Thread(target=insertInteractions) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(sorted(interactionIDs), sorted(f"c1{seq}" for seq in range(40)))
+
+    def test_deleteConversationResetsSequence(self):
+        self._insert("c1")
+        self._insert("c1")
+        self.dataloader.deleteConversation("c1")
+        self.assertEqual(self.dataloader.selectInteractionSince("c1"), [])
+
+        self._createConversation("c1", "conversation c1", "")
+        self.assertEqual(self._insert("c1"), "c10")
+
+    def test_paging(self):
+        for index in range(7):
+            self._insert("c1", typeMessage="input" if index % 2 == 0 else "return")
+        # internal interactions are not displayed
+        self._insert("c1", typeMessage="internal")
+
+        seqs = [row[-1] for row in self.dataloader.selectInteractionPage("c1", limit=3)]
+        self.assertEqual(seqs, [4, 5, 6])
+        seqs = [row[-1] for row in self.dataloader.selectInteractionPage("c1", beforeSeq=4, limit=3)]
+        self.assertEqual(seqs, [1, 2, 3])
+        seqs = [row[-1] for row in self.dataloader.selectInteractionPage("c1", beforeSeq=1, limit=3)]
+        self.assertEqual(seqs, [0])
+        seqs = [row[-1] for row in self.dataloader.selectInteractionSince("c1", 4)]
+        self.assertEqual(seqs, [5, 6])
+
+        row = self.dataloader.selectInteractionPage("c1", limit=1)[0]
+        self.assertEqual(row[0], "c16")
+        # the large columns are not loaded for the chat log
+        self.assertEqual((row[4], row[10]), ("", ""))
+        self.assertEqual(self.dataloader.selectLatestInteraction("c1")[0], "c16")
+
+
+class SearchTest(DataloaderTestCase):
+    """Test the conversation search, with FTS5 and with the LIKE fallback."""
+
+    def setUp(self):
+        super().setUp()
+        self._createConversation("c3", "Roads", "buffer of the road network")
+        self._insert("c1", requestText="clip the parcels by the city boundary")
+        self._insert("c1", typeMessage="return", requestText="", responseText="clipped 100% of the parcels")
+        self._insert("c1", typeMessage="internal", requestText="", responseText="internal roads")
+        self._insert("c2", requestText="roads roads roads, which roads are the longest roads")
+        self._insert("c2", typeMessage="return", requestText="", responseText="1000 roads")
+
+    def _searchIDs(self, keyword):
+        return [metaInfo["ID"] for metaInfo in self.dataloader.searchConversations(keyword)]
+
+    def test_search(self):
+        results = self.dataloader.searchConversations("parcel")
+        self.assertEqual([metaInfo["ID"] for metaInfo in results], ["c1"])
+        self.assertEqual(results[0]["messageCount"], 2)
+        if self.dataloader.hasFullTextSearch():
+            startMarker, endMarker = SNIPPET_MARKERS
+            self.assertIn(f"{startMarker}parcels{endMarker}", results[0]["snippet"])
+
+        # internal interactions are not searched
+        self.assertEqual(self._searchIDs("internal"), [])
+        self.assertEqual(self._searchIDs("city parcels"), ["c1"])
+        self.assertEqual(self.dataloader.searchInteractionSeqs("c1", "parcels"), [0, 1])
+        self.assertEqual(self.dataloader.searchInteractionSeqs("c2", "parcels"), [])
+
+    def test_ranking(self):
+        if not self.dataloader.hasFullTextSearch():
+            self.skipTest("SQLite is built without FTS5")
+
+        self._createConversation("c4", "Hydrology", "")
+        self._insert("c4", requestText="load the dem, fill the sinks and derive the river network from the flow "
+                                       "accumulation, then style it by stream order")
+        self._createConversation("c5", "Hydrology", "")
+        self._insert("c5", requestText="river river river")
+        self.assertEqual(self._searchIDs("river"), ["c5", "c4"])
+
+        results = {metaInfo["ID"]: metaInfo for metaInfo in self.dataloader.searchConversations("roads")}
+        self.assertEqual(set(results), {"c2", "c3"})
+        # the title of "c3" matched, there is no message snippet
+        self.assertIsNone(results["c3"]["snippet"])
+        self.assertIn("roads", results["c2"]["snippet"])
+
+    def test_specialCharacters(self):
+        for keyword in ["100%", '"x OR', "parcels*", "NEAR(", "", "%", "_"]:
+            self.dataloader.searchConversations(keyword)
+            self.dataloader.searchInteractionSeqs("c1", keyword)
+        self.assertEqual(self.dataloader.searchConversations("  "), [])
+
+    def test_indexFollowsChanges(self):
+        metaInfo = dict(self.dataloader.selectConversationInfo("c3"))
+        metaInfo["title"] = "Rivers"
+        metaInfo["description"] = ""
+        self.dataloader.updateConversationInfo(metaInfo)
+        self.assertEqual(self._searchIDs("rivers"), ["c3"])
+        self.assertNotIn("c3", self._searchIDs("road"))
+
+        self.dataloader.deleteConversation("c2")
+        self.assertEqual(self._searchIDs("roads"), [])
+        self.assertEqual(self.dataloader.searchInteractionSeqs("c2", "roads"), [])
+
+    def test_likeFallback(self):
+        self.dataloader._fullTextSearch = False
+
+        self.assertEqual(self._searchIDs("parcel"), ["c1"])
+        self.assertIsNone(self.dataloader.searchConversations("parcel")[0]["snippet"])
+        self.assertEqual(self.dataloader.searchInteractionSeqs("c1", "parcels"), [0, 1])
+        # "%" and "_" are matched literally
+        self.assertEqual(self._searchIDs("100%"), ["c1"])
+        self.assertEqual(self._searchIDs("1_00"), [])
+        self.assertEqual(self._searchIDs("internal"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
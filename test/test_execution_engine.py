@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Execution engine test: routing of the main thread calls."""
+
+import ast
+import unittest
+
+from ..executionEngine import prepareCode
+
+
+class Layer:
+    def __init__(self, path):
+        self.path = path
+
+
+class Iface:
+    def addVectorLayer(self, path, name, provider):
+        return Layer(path)
+
+    def addRasterLayer(self, path, name):
+        return Layer(path)
+
+
+class PrepareCodeTest(unittest.TestCase):
+    """Test which calls are queued, run on the main thread, or left in the task."""
+
+    def _prepare(self, code):
+        return ast.unparse(prepareCode(code))
+
+    def test_addedLayerIsReturned(self):
+        code = ("layer = iface.addVectorLayer('roads.shp', 'roads', 'ogr')\n"
+                "iface.addRasterLayer('dem.tif', 'dem')\n"
+                "path = layer.path\n")
+        deferred, mainThread = [], []
+
+        def callOnMainThread(function, *args, **kwargs):
+            mainThread.append(function.__name__)
+            return function(*args, **kwargs)
+
+        namespace = {"iface": Iface(), "__callOnMainThread__": callOnMainThread,
+                     "__deferToMainThread__": lambda function, *args, **kwargs: deferred.append(function.__name__)}
+        exec(compile(prepareCode(code), "<test>", "exec"), namespace)
+
+        self.assertEqual(namespace["path"], "roads.shp")
+        self.assertEqual(mainThread, ["addVectorLayer", "addRasterLayer"])
+        self.assertEqual(deferred, [])
+
+    def test_unusedGuiCallsAreQueued(self):
+        prepared = self._prepare("iface.setActiveLayer(layer)\n"
+                                 "iface.messageBar().pushMessage('done')\n"
+                                 "QgsProject.instance().removeMapLayer(layer)\n"
+                                 "QgsProject.instance().addMapLayer(layer)\n")
+        self.assertIn("__deferToMainThread__(iface.setActiveLayer, layer)", prepared)
+        self.assertIn("__deferToMainThread__(__callOnMainThread__(iface.messageBar).pushMessage, 'done')", prepared)
+        self.assertIn("__deferToMainThread__(QgsProject.instance().removeMapLayer, layer)", prepared)
+        self.assertIn("__callOnMainThread__(QgsProject.instance().addMapLayer, layer)", prepared)
+
+    def test_usedResultsRunOnMainThread(self):
+        prepared = self._prepare("added = QgsProject.instance().addMapLayer(layer)\n"
+                                 "ok = iface.openLayerProperties(layer)\n"
+                                 "layers = iface.activeLayer()\n")
+        self.assertNotIn("__deferToMainThread__", prepared)
+        self.assertIn("added = __callOnMainThread__(QgsProject.instance().addMapLayer, layer)", prepared)
+        self.assertIn("ok = __callOnMainThread__(iface.openLayerProperties, layer)", prepared)
+
+    def test_guiObjectsOfIface(self):
+        code = ("canvas = iface.mapCanvas()\n"
+                "canvas.setExtent(extent)\n"
+                "scale = canvas.scale()\n"
+                "canvas = other()\n"
+                "canvas.refresh()\n")
+        prepared = self._prepare(code)
+        self.assertIn("__deferToMainThread__(canvas.setExtent, extent)", prepared)
+        self.assertIn("scale = __callOnMainThread__(canvas.scale)", prepared)
+        # rebound to an object that is not a GUI object of `iface`
+        self.assertTrue(prepared.endswith("canvas.refresh()"))
+
+    def test_untrackedObjectsStayInTask(self):
+        # known limitation: a GUI object reached through an attribute is not tracked
+        prepared = self._prepare("bar = plugin.iface.messageBar()\n"
+                                 "bar.pushMessage('done')\n")
+        self.assertNotIn("__deferToMainThread__", prepared)
+        self.assertNotIn("__callOnMainThread__", prepared)
+
+    def test_processingFeedback(self):
+        prepared = self._prepare("processing.run('native:buffer', parameters)\n"
+                                 "processing.runAndLoadResults('native:buffer', parameters)\n")
+        self.assertIn("processing.run('native:buffer', parameters, feedback=__feedback__)", prepared)
+        self.assertIn("__runAndLoadResults__('native:buffer', parameters, feedback=__feedback__)", prepared)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Chat log paging test."""
+
+import unittest
+
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+from ..intelli_geo_dockwidget import IntelliGeoDockWidget  # noqa: E402
+
+
+class PagedConversation:
+    """Conversation serving `interactionCount` stored interactions the way the Dataloader pages them."""
+
+    def __init__(self, interactionCount: int):
+        self.rows = []
+        for seq in range(interactionCount):
+            typeMessage = "input" if seq % 2 == 0 else "return"
+            self.rows.append((f"interaction_{seq}", "conversation", "prompt", f"request {seq}", "",
+                              "2024-01-18 10:00:00", typeMessage, f"response {seq}", "2024-01-18 10:00:01",
+                              "withCode" if seq % 10 == 1 else "no", "", seq))
+
+    def fetchPage(self, beforeSeq=None, limit: int = 50):
+        rows = self.rows if beforeSeq is None else [row for row in self.rows if row[-1] < beforeSeq]
+        return rows[-limit:]
+
+    def fetchSince(self, seq):
+        return [row for row in self.rows if row[-1] > seq]
+
+    def searchInteractionSeqs(self, keyword: str):
+        return [row[-1] for row in self.rows if keyword in row[3] or keyword in row[7]]
+
+
+class HistoryPagingTest(unittest.TestCase):
+    """Test the chat log loads its older pages."""
+
+    def setUp(self):
+        self.dockwidget = IntelliGeoDockWidget(None)
+        self.dockwidget.historyPageSize = 20
+        self.conversation = PagedConversation(70)
+
+    def tearDown(self):
+        self.dockwidget = None
+
+    def test_loadOlderPage(self):
+        self.dockwidget.updateConversation(self.conversation)
+        firstRenderedSeq = self.dockwidget.firstRenderedSeq
+        self.assertIsNotNone(firstRenderedSeq)
+        self.assertLess(firstRenderedSeq, 70)
+
+        while self.dockwidget.hasOlderHistory:
+            workflowCount = len(self.dockwidget.workflowIDs)
+            self.assertTrue(self.dockwidget._loadOlderPage())
+            self.assertLess(self.dockwidget.firstRenderedSeq, firstRenderedSeq)
+            self.assertGreaterEqual(len(self.dockwidget.workflowIDs), workflowCount)
+            firstRenderedSeq = self.dockwidget.firstRenderedSeq
+
+        self.assertEqual(self.dockwidget.firstRenderedSeq, 0)
+        self.assertFalse(self.dockwidget._loadOlderPage())
+        self.assertIn("request 0", self.dockwidget.txHistory.toPlainText())
+        self.assertEqual(self.dockwidget.workflowIDs, [f"interaction_{seq}" for seq in range(1, 70, 10)])
+
+    def test_loadHistoryForSearch(self):
+        self.dockwidget.updateConversation(self.conversation)
+        self.dockwidget._loadHistoryForSearch("request 4")
+        self.assertLessEqual(self.dockwidget.firstRenderedSeq, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
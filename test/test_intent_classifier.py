@@ -0,0 +1,120 @@
+# coding=utf-8
+"""Local intent classifier test."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..intentClassifier import IntentClassifier, LABELS, normalizeDecision
+
+# the acceptance threshold of the Processor
+THRESHOLD = 0.85
+
+
+class IntentClassifierTest(unittest.TestCase):
+    """Test the rules and the naive Bayes model."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.modelPath = os.path.join(self.directory, "QGIS_IntelliGeo", "intentClassifier.json")
+        self.classifier = IntentClassifier(self.modelPath, minTrainingRows=6)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_normalizeDecision(self):
+        self.assertEqual(normalizeDecision(" Yes, Yes "), "yes, yes")
+        self.assertEqual(normalizeDecision("yes"), "yes, no")
+        self.assertEqual(normalizeDecision("no"), "no")
+        self.assertIsNone(normalizeDecision("maybe"))
+
+    def test_rules(self):
+        self.assertEqual(self.classifier.predict("Hello!"), ("no", 0.9))
+        label, confidence = self.classifier.predict("Clip the roads layer by the city boundary")
+        self.assertEqual(label, "yes, no")
+        self.assertGreaterEqual(confidence, THRESHOLD)
+        label, confidence = self.classifier.predict("That didn't work, fix the previous code")
+        self.assertEqual(label, "yes, yes")
+        self.assertGreaterEqual(confidence, THRESHOLD)
+
+    def test_questionRuleIsBelowThreshold(self):
+        label, confidence = self.classifier.predict("explain how to clip layer A by B and save it")
+        self.assertEqual(label, "no")
+        self.assertLess(confidence, THRESHOLD)
+
+    def test_requestVerbNeedsGisObject(self):
+        self.assertEqual(self.classifier.predict("make sense of this error for me"), (None, 0.0))
+        self.assertEqual(self.classifier.predict("Create a summary of our chat"), (None, 0.0))
+        self.assertEqual(self.classifier.predict("Please create a 100 m buffer around the rivers")[0], "yes, no")
+
+    def test_conflictingRulesDoNotDecide(self):
+        # a workflow verb at the start and a refinement
+        self.assertEqual(self.classifier.predict("buffer the roads layer instead"), (None, 0.0))
+
+    def test_noModelBelowMinTrainingRows(self):
+        self.classifier.train([("how do rivers form", "no")])
+        self.assertEqual(self.classifier.predict("how do rivers form"), (None, 0.0))
+
+    def test_naiveBayes(self):
+        pairs = [("how are river networks formed", "no"),
+                 ("how is the weather in enschede", "no"),
+                 ("how old is the qgis project", "no"),
+                 ("the roads layer needs a 100 m buffer", "yes, no"),
+                 ("i need the parcels layer as a shapefile", "yes, no"),
+                 ("the parcels layer needs a buffer", "yes, no"),
+                 ("the result has the wrong projection", "yes, yes"),
+                 ("nonsense decision", "maybe")]
+        self.classifier.train(pairs)
+
+        label, confidence = self.classifier.predict("the rivers layer needs a buffer")
+        self.assertEqual(label, "yes, no")
+        self.assertGreater(confidence, 1 / len(LABELS))
+        self.assertEqual(self.classifier.predict("how are lakes formed")[0], "no")
+
+        # the model is saved and loaded again
+        self.assertTrue(os.path.exists(self.modelPath))
+        reloaded = IntentClassifier(self.modelPath, minTrainingRows=6)
+        self.assertEqual(reloaded.predict("the rivers layer needs a buffer"), (label, confidence))
+
+    def test_posteriorIsCalibrated(self):
+        questions = ["how are river networks formed", "how is the weather in enschede", "how old is the qgis project",
+                     "who maintains qgis", "how does a projection distort area"]
+        requests = ["the roads layer needs a 100 m buffer", "i need the parcels layer as a shapefile",
+                    "the parcels layer needs a buffer", "i want the rivers as geojson", "the dem needs a hillshade"]
+
+        # a few decisions are not enough to skip the LLM classifier
+        self.classifier.train([(text, "no") for text in questions] * 3 + [(text, "yes, no") for text in requests] * 3)
+        label, confidence = self.classifier.predict("the rivers layer needs a buffer")
+        self.assertEqual(label, "yes, no")
+        self.assertLess(confidence, THRESHOLD)
+        # unknown words do not favour the label without training rows
+        label, confidence = self.classifier.predict("make sense of this error for me")
+        self.assertNotEqual(label, "yes, yes")
+        self.assertLess(confidence, THRESHOLD)
+
+        # many consistent decisions are
+        self.classifier.train([(text, "no") for text in questions] * 40 + [(text, "yes, no") for text in requests] * 40)
+        label, confidence = self.classifier.predict("the rivers layer needs a buffer")
+        self.assertEqual(label, "yes, no")
+        self.assertGreaterEqual(confidence, THRESHOLD)
+        self.assertLess(self.classifier.predict("make sense of this error for me")[1], THRESHOLD)
+
+    def test_ensureTrained(self):
+        class Dataloader:
+            pairs = [("how are river networks formed", "no")] * 3 + [("the roads layer needs a buffer", "yes, no")] * 3
+
+            def countClassifierPairs(self):
+                return len(self.pairs)
+
+            def selectClassifierPairs(self):
+                return self.pairs
+
+        classifier = IntentClassifier(self.modelPath, minTrainingRows=6, retrainEvery=5)
+        classifier.checkInterval = 0
+        classifier.ensureTrained(Dataloader())
+        self.assertEqual(classifier.trainedRows, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
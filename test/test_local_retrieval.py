@@ -0,0 +1,176 @@
+# coding=utf-8
+"""Local vector index test."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from ..localRetrieval import HashingEmbedding, LocalVectorIndex
+from ..queryCache import QueryCache
+from ..retrievalVectorbase import RetrievalVectorbase
+
+
+class HashingEmbeddingTest(unittest.TestCase):
+    """Test the default embedding function."""
+
+    def test_embedding(self):
+        embedding = HashingEmbedding(dimension=256)
+        vectors = embedding(["buffer the roads", "buffer the roads", ""])
+
+        self.assertEqual(vectors.shape, (3, 256))
+        self.assertEqual(embedding.name, "hashing-256")
+        np.testing.assert_array_equal(vectors[0], vectors[1])
+        self.assertFalse(vectors[2].any())
+
+
+class LocalVectorIndexTest(unittest.TestCase):
+    """Test building, searching and extending an index."""
+
+    def setUp(self):
+        self.indexPath = tempfile.mkdtemp()
+        self.embedding = HashingEmbedding(dimension=512)
+        self.index = LocalVectorIndex(self.indexPath, "documents", self.embedding)
+        self.index.build(["buffer a vector layer", "reproject a raster layer", "count the points in polygons"],
+                         [{"ID": 0}, {"ID": 1}, {"ID": 2}], fingerprint="v1")
+
+    def tearDown(self):
+        self.index.flush()
+        shutil.rmtree(self.indexPath)
+
+    def test_search(self):
+        results = self.index.search("how do I buffer a layer", topK=2)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][1]["payload"], {"ID": 0})
+        self.assertGreaterEqual(results[0][0], results[1][0])
+        predicateResults = self.index.search("buffer", topK=3, predicate=lambda entry: entry["payload"]["ID"] != 0)
+        self.assertNotIn({"ID": 0}, [entry["payload"] for _, entry in predicateResults])
+
+    def test_load(self):
+        index = LocalVectorIndex(self.indexPath, "documents", self.embedding)
+        self.assertTrue(index.load())
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.fingerprint, "v1")
+
+        # built with another embedding
+        self.assertFalse(LocalVectorIndex(self.indexPath, "documents", HashingEmbedding(dimension=64)).load())
+        self.assertFalse(LocalVectorIndex(self.indexPath, "missing", self.embedding).load())
+
+    def test_addIsWrittenOnFlush(self):
+        vectorMtime = os.path.getmtime(self.index.vectorPath)
+        self.index.add(["clip roads by the city boundary", "buffer a vector layer"], [{"ID": 3}, {"ID": 4}])
+
+        # searchable right away, the known text is skipped
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.search("clip the roads", topK=1)[0][1]["payload"], {"ID": 3})
+        self.assertEqual(os.path.getmtime(self.index.vectorPath), vectorMtime)
+        self.assertEqual(len(LocalVectorIndex(self.indexPath, "documents", self.embedding).entries), 0)
+
+        self.index.add(["dissolve the parcels"], [{"ID": 5}])
+        self.index.flush()
+        self.assertIsNone(self.index.saveTimer)
+        reloaded = LocalVectorIndex(self.indexPath, "documents", self.embedding)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(len(reloaded), 5)
+        self.assertEqual(reloaded.search("dissolve parcels", topK=1)[0][1]["payload"], {"ID": 5})
+
+    def test_addToEmptyIndex(self):
+        index = LocalVectorIndex(self.indexPath, "empty", self.embedding)
+        index.build([], [])
+        self.assertEqual(index.search("buffer"), [])
+
+        index.add(["buffer a vector layer"], [{"ID": 0}])
+        self.assertEqual(index.search("buffer", topK=1)[0][1]["payload"], {"ID": 0})
+        index.flush()
+        self.assertEqual(index.vectors.shape, (1, 512))
+
+    def test_memoryMapIsClosedBeforeReplace(self):
+        storedVectors = self.index.vectors
+        self.assertIsInstance(storedVectors, np.memmap)
+        self.index.add(["dissolve the parcels"], [{"ID": 3}])
+        self.index.flush()
+
+        self.assertTrue(storedVectors._mmap.closed)
+        self.assertEqual(self.index.vectors.shape[0], 4)
+        self.assertFalse(os.path.exists(self.index.vectorPath + ".tmp.npy"))
+
+    def test_concurrentAdd(self):
+        def addDocuments(worker):
+            for number in range(20):
+                self.index.add([f"document {worker} {number}"], [{"worker": worker}])
+                self.index.search(f"document {worker}")
+
+        threads = [threading.Thread(target=addDocuments, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.index.flush()
+        self.assertEqual(len(self.index), 83)
+        self.assertEqual(self.index.vectors.shape[0], 83)
+
+
+class RetrievalVectorbaseTest(unittest.TestCase):
+    """Test the indexes built from the shipped resources."""
+
+    def setUp(self):
+        self.indexPath = tempfile.mkdtemp()
+        embedding = HashingEmbedding(dimension=256)
+        self.retriever = RetrievalVectorbase("test", embedding)
+        self.retriever.exampleIndex = LocalVectorIndex(self.indexPath, "examples", embedding)
+        self.retriever.documentIndex = LocalVectorIndex(self.indexPath, "documents_test", embedding)
+
+    def tearDown(self):
+        shutil.rmtree(self.indexPath)
+
+    def test_bundledDocumentation(self):
+        self.retriever.remoteFallback = False
+        self.retriever.queryCache = QueryCache()
+
+        documents = self.retriever.retrieveDocument("run the buffer processing algorithm on a layer", topK=2)[0]
+        self.assertEqual(len(documents), 2)
+        self.assertTrue(any("native:buffer" in document for document in documents))
+
+    def test_rebuildKeepsRemoteDocuments(self):
+        self.retriever._loadIndexes()
+        bundledDocuments = len(self.retriever.documentIndex)
+        self.retriever.documentIndex.add(["QgsRasterLayer.renderer() returns the raster renderer"],
+                                         [{"source": "remote"}])
+        self.retriever.documentIndex.flush()
+
+        # the shipped documentation changed
+        self.retriever._folderFingerprint = lambda folderPath: "changed"
+        self.retriever.indexesLoaded = False
+        self.retriever._loadIndexes()
+        self.assertEqual(len(self.retriever.documentIndex), bundledDocuments + 1)
+        self.assertEqual(self.retriever.documentIndex.fingerprint, "changed")
+
+    def test_loadIndexesOnce(self):
+        builds = []
+
+        def buildExampleIndex(fingerprint):
+            builds.append(fingerprint)
+            # slow build, so that the other workers arrive while it runs
+            time.sleep(0.1)
+            self.retriever.exampleIndex.build(["buffer a layer"], [{"type": "Script"}], fingerprint)
+
+        self.retriever._buildExampleIndex = buildExampleIndex
+        workers = [threading.Thread(target=self.retriever._loadIndexes) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertTrue(self.retriever.indexesLoaded)
+        self.assertEqual(len(self.retriever.exampleIndex), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
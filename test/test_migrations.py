@@ -0,0 +1,159 @@
+# coding=utf-8
+"""Schema migrations test."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from .. import dataloader as dataloaderModule
+from ..dataloader import Dataloader
+from ..migrations import SCHEMA_VERSION, getSchemaVersion, migrate
+
+
+class TelemetrySender:
+    def notify(self):
+        pass
+
+
+class MigrationsTest(unittest.TestCase):
+    """Test fresh databases, databases created before the migrations existed, and idempotency."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.environ.get("HOME")
+        os.environ["HOME"] = self.directory
+        self.getTelemetrySender = dataloaderModule.getTelemetrySender
+        dataloaderModule.getTelemetrySender = lambda databasePath, backendURL: TelemetrySender()
+
+    def tearDown(self):
+        dataloaderModule.getTelemetrySender = self.getTelemetrySender
+        if self.home is None:
+            os.environ.pop("HOME")
+        else:
+            os.environ["HOME"] = self.home
+        shutil.rmtree(self.directory)
+
+    def _dataloader(self, databaseName):
+        dataloader = Dataloader(databaseName)
+        self.addCleanup(dataloader.pool.closeAll)
+        return dataloader
+
+    def _indexSQL(self, dataloader, indexName):
+        dataloader.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (indexName,))
+        return dataloader.cursor.fetchone()[0]
+
+    def test_freshDatabase(self):
+        dataloader = self._dataloader("fresh.db")
+        self.assertEqual(getSchemaVersion(dataloader.connection), SCHEMA_VERSION)
+        for tableName in [dataloader.outboxTableName, dataloader.sequenceTableName, dataloader.workflowTableName,
+                          dataloader.promptCacheTableName]:
+            self.assertTrue(dataloader._checkExistence(tableName), tableName)
+        self.assertIn("(modified)", self._indexSQL(dataloader, "idxConversationModified"))
+
+        # an up to date database is not touched
+        self.assertEqual(migrate(dataloader.connection, dataloader), SCHEMA_VERSION)
+
+    def test_migrationsAreIdempotent(self):
+        dataloader = self._dataloader("idempotent.db")
+        dataloader.connection.execute("PRAGMA user_version = 0")
+        self.assertEqual(migrate(dataloader.connection, dataloader), SCHEMA_VERSION)
+
+    def test_failedMigrationIsRolledBack(self):
+        dataloader = self._dataloader("failed.db")
+        dataloader.connection.execute("PRAGMA user_version = 12")
+
+        def insertLLMRows():
+            dataloader.cursor.execute("CREATE TABLE partial (ID TEXT)")
+            dataloader.cursor.execute("DELETE FROM llm")
+            raise sqlite3.OperationalError("disk I/O error")
+
+        dataloader._insertLLMRows = insertLLMRows
+        with self.assertRaises(sqlite3.OperationalError):
+            migrate(dataloader.connection, dataloader)
+
+        self.assertEqual(getSchemaVersion(dataloader.connection), 12)
+        self.assertFalse(dataloader._checkExistence("partial"))
+        dataloader.cursor.execute("SELECT COUNT(*) FROM llm")
+        self.assertGreater(dataloader.cursor.fetchone()[0], 0)
+
+    def test_llmModels(self):
+        dataloader = self._dataloader("llmModels.db")
+        dataloader.connection.execute("PRAGMA user_version = 12")
+        dataloader.cursor.execute("UPDATE llm SET apiKey = 'user key' WHERE ID = 'Cohere::command-r'")
+        dataloader.connection.commit()
+        dataloader.llmFullDict["Cohere"].append("command-a")
+
+        self.assertEqual(migrate(dataloader.connection, dataloader), SCHEMA_VERSION)
+        dataloader.cursor.execute("SELECT ID, apiKey FROM llm WHERE ID IN ('Cohere::command-a', 'Cohere::command-r') "
+                                  "ORDER BY ID")
+        rows = dataloader.cursor.fetchall()
+        self.assertEqual(rows[0][0], "Cohere::command-a")
+        # the existing rows are kept
+        self.assertEqual(rows[1], ("Cohere::command-r", "user key"))
+
+    def test_legacyDatabase(self):
+        dataloader = self._dataloader("legacy.db")
+        # tables of a plugin version without migrations, `user_version` stays 0
+        dataloader.pool.bootstrapped = True
+        dataloader._createInitialSchema()
+        dataloader.cursor.execute("INSERT INTO conversation VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  ("c1", "Cohere::command-r", "Roads", "buffer the roads", "01 31 2024 09:15:00",
+                                   "02 01 2024 10:00:00", 2, 1, "user"))
+        for index, typeMessage, responseText in [(0, "input", "yes, no"), (1, "return", "```python\nprint(1)\n```")]:
+            dataloader.cursor.execute("INSERT INTO interaction VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (f"c1{index}", "c1", "promptID", "buffer the roads", "", "01 31 2024 09:15:00",
+                                       typeMessage, responseText, "01 31 2024 09:15:05",
+                                       "withCode" if typeMessage == "return" else "empty", "{}"))
+        dataloader.connection.commit()
+        self.assertEqual(getSchemaVersion(dataloader.connection), 0)
+
+        self.assertEqual(migrate(dataloader.connection, dataloader), SCHEMA_VERSION)
+
+        # the index encoded in the ID becomes `seq`, the next interaction continues after it
+        dataloader.cursor.execute("SELECT ID, seq FROM interaction ORDER BY seq")
+        self.assertEqual(dataloader.cursor.fetchall(), [("c10", 0), ("c11", 1)])
+        self.assertEqual(dataloader._allocateInteractionSeq("c1"), 2)
+        dataloader.connection.rollback()
+
+        dataloader.cursor.execute("SELECT created, modified FROM conversation")
+        self.assertEqual(dataloader.cursor.fetchone(), ("2024-01-31 09:15:00", "2024-02-01 10:00:00"))
+        dataloader.cursor.execute("SELECT requestTime, responseTime FROM interaction WHERE ID = 'c11'")
+        self.assertEqual(dataloader.cursor.fetchone(), ("2024-01-31 09:15:00", "2024-01-31 09:15:05"))
+
+        self.assertEqual(dataloader.selectWorkflow("c11")[0], "withCode")
+        if dataloader.hasFullTextSearch():
+            self.assertEqual([metaInfo["ID"] for metaInfo in dataloader.searchConversations("roads")], ["c1"])
+
+    def test_promptCacheTable(self):
+        dataloader = self._dataloader("promptCache.db")
+        # prompt rows cached in the "prompt" table before migration 12
+        dataloader.cursor.execute(f"DROP TABLE {dataloader.promptCacheTableName}")
+        cachedPrompts = [("backend::1", "generalChat", "0.0.3", "old", time.time() - 100),
+                         ("backend::2", "generalChat", "0.0.3", "new", time.time()),
+                         ("backend::3", "generalChat", "0.0.4", "other client", time.time() - 50)]
+        for ID, promptType, clientVersion, template, fetchedAt in cachedPrompts:
+            dataloader.cursor.execute("INSERT INTO prompt (ID, llmID, version, template, promptType, clientVersion, "
+                                      "etag, fetchedAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (ID, "Cohere::command-r-plus", 1, template, promptType, clientVersion, None,
+                                       fetchedAt))
+        dataloader.connection.execute("PRAGMA user_version = 11")
+        dataloader.connection.commit()
+
+        self.assertEqual(migrate(dataloader.connection, dataloader), SCHEMA_VERSION)
+        dataloader.cursor.execute(f"SELECT clientVersion, ID, template FROM {dataloader.promptCacheTableName} "
+                                  f"WHERE promptType = 'generalChat' ORDER BY clientVersion")
+        self.assertEqual(dataloader.cursor.fetchall(), [("0.0.3", "backend::2", "new"),
+                                                        ("0.0.4", "backend::3", "other client")])
+
+        # offline, the newest cached prompt is used, then the prompt shipped with the plugin
+        self.assertEqual(dataloader._selectFallbackPrompt("generalChat")["template"], "new")
+        dataloader.cursor.execute(f"DELETE FROM {dataloader.promptCacheTableName}")
+        self.assertEqual(dataloader._selectFallbackPrompt("generalChat")["ID"],
+                         "Cohere::command-r-plus::0::generalChat")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Processor test: speculative branches."""
+
+import os
+import threading
+import time
+import unittest
+
+from ..processor import Processor
+from .test_dataloader import DataloaderTestCase
+
+
+class Chain:
+    """Stream of an llm answer that never ends by itself."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.streaming = threading.Event()
+        self.closed = threading.Event()
+
+    def stream(self, chainInput):
+        try:
+            while True:
+                self.chunks += 1
+                self.streaming.set()
+                yield "token "
+                time.sleep(0.01)
+        finally:
+            self.closed.set()
+
+
+class SpeculationTest(DataloaderTestCase):
+    """Test a branch started before the classifier decided."""
+
+    def _setVariables(self, variables):
+        variablePath = os.path.join(self.directory, "Documents", "QGIS_IntelliGeo", "intelligeo_var.txt")
+        with open(variablePath, "w", encoding="utf-8") as file:
+            file.writelines(f"{key}={value}\n" for key, value in variables.items())
+
+    def test_speculationIsOptIn(self):
+        self.assertFalse(Processor("Cohere::command-r", "c1", None, self.dataloader).speculative)
+
+    def test_rejectedBranchStops(self):
+        self._setVariables({"intelliGeo_speculative": "true", "intelliGeo_local_classifier": "false"})
+        processor = Processor("Cohere::command-r", "c1", None, self.dataloader)
+        self.assertTrue(processor.speculative)
+        tokens = []
+        processor.tokenReceived.connect(tokens.append)
+        chain = Chain()
+
+        def row(responseText, typeMessage):
+            return ["c1", "promptID", "buffer the roads", "", "2024-01-31 09:15:00", typeMessage, responseText,
+                    "2024-01-31 09:15:05", "empty", ""]
+
+        def codeProducer(userInput):
+            code = processor._streamText(chain, {"input": userInput})
+            processor._recordInteraction(row(code, "return"))
+            return code
+
+        def generalChat(userInput):
+            processor._recordInteraction(row("a buffer is a zone around a feature", "return"))
+            return "a buffer is a zone around a feature"
+
+        def classifier(userInput, localDecision=None):
+            # decides once the guessed branch is streaming
+            chain.streaming.wait(5)
+            return "no"
+
+        processor._selectBranch = lambda decision, responseType: ((codeProducer, "withCode") if decision == "yes, no"
+                                                                  else (generalChat, "empty"))
+        processor.classifier = classifier
+
+        self.assertEqual(processor.reactionRouter("buffer the roads", "Code"),
+                         ("a buffer is a zone around a feature", "empty"))
+
+        # the stream of the rejected branch is closed at its next chunk
+        self.assertTrue(chain.closed.wait(5))
+        chunks = chain.chunks
+        time.sleep(0.05)
+        self.assertEqual(chain.chunks, chunks)
+        self.assertEqual(tokens, [])
+
+        self.dataloader.cursor.execute("SELECT responseText FROM interaction WHERE conversationID = 'c1'")
+        self.assertEqual(self.dataloader.cursor.fetchall(), [("a buffer is a zone around a feature",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# coding=utf-8
+"""Token budget test: tokenizer fallback and PromptAssembler."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import utils
+from ..promptAssembler import PromptAssembler
+from ..utils import CharacterTokenizer, countTokens, trimText2TokenLimit
+
+
+class TokenizerTest(unittest.TestCase):
+    """Test the tokenizer selection never waits for a download."""
+
+    def setUp(self):
+        self.tiktoken = utils.tiktoken
+        self.downloadEncoding = utils._downloadEncoding
+        self.getTokenizer = utils.getTokenizer
+        self.environment = dict(os.environ)
+        self.cacheDir = tempfile.mkdtemp()
+        os.environ["TIKTOKEN_CACHE_DIR"] = self.cacheDir
+        self.downloads = []
+        utils._downloadEncoding = self.downloads.append
+        utils.getTokenizer.cache_clear()
+
+    def tearDown(self):
+        utils.tiktoken = self.tiktoken
+        utils._downloadEncoding = self.downloadEncoding
+        utils.getTokenizer = self.getTokenizer
+        os.environ.clear()
+        os.environ.update(self.environment)
+        shutil.rmtree(self.cacheDir)
+        utils.getTokenizer.cache_clear()
+
+    def _cacheEncoding(self, encodingName):
+        blobPath = f"https://openaipublic.blob.core.windows.net/encodings/{encodingName}.tiktoken"
+        with open(os.path.join(self.cacheDir, hashlib.sha1(blobPath.encode()).hexdigest()), "w") as file:
+            file.write("")
+
+    def test_characterTokenizer(self):
+        tokenizer = CharacterTokenizer()
+        tokens = tokenizer.encode("clip the roads")
+        self.assertEqual(len(tokens), 4)
+        self.assertEqual(tokenizer.decode(tokens), "clip the roads")
+        self.assertEqual(tokenizer.decode(tokens[:2]), "clip the")
+
+    def test_withoutTiktoken(self):
+        utils.tiktoken = None
+        self.assertIsInstance(utils.getTokenizer("gpt-4o"), CharacterTokenizer)
+        self.assertEqual(countTokens("a" * 10, "gpt-4o"), 3)
+        self.assertEqual(trimText2TokenLimit("a" * 10, 2, "gpt-4o"), "a" * 8)
+
+    @unittest.skipIf(utils.tiktoken is None, "tiktoken is not installed")
+    def test_uncachedEncodingIsEstimated(self):
+        self.assertIsInstance(utils.getTokenizer("command-r-plus"), CharacterTokenizer)
+        self.assertEqual(self.downloads, ["cl100k_base"])
+
+    def test_specialTokenText(self):
+        class Encoding:
+            """Like a tiktoken encoding, special tokens in the text are refused unless they are allowed as text."""
+
+            def encode(self, text, disallowed_special="all"):
+                if disallowed_special != () and "<|endoftext|>" in text:
+                    raise ValueError("Encountered text corresponding to disallowed special token")
+                return text.split()
+
+            def decode(self, tokens):
+                return " ".join(tokens)
+
+        text = "the log ends with <|endoftext|> and more"
+        utils.getTokenizer = lambda modelName: Encoding()
+        self.assertEqual(countTokens(text, "gpt-4o"), 7)
+        self.assertEqual(trimText2TokenLimit(text, 5, "gpt-4o"), "the log ends with <|endoftext|>")
+
+    @unittest.skipIf(utils.tiktoken is None, "tiktoken is not installed")
+    def test_specialTokenTextWithTiktoken(self):
+        utils._downloadEncoding = self.downloadEncoding
+        utils._downloadEncoding("cl100k_base")
+        utils.getTokenizer.cache_clear()
+        if not utils._isEncodingCached("cl100k_base"):
+            self.skipTest("the tiktoken encoding could not be downloaded")
+
+        self.assertGreater(countTokens("<|endoftext|>", "gpt-4"), 1)
+        self.assertEqual(trimText2TokenLimit("<|endoftext|>", 100, "gpt-4"), "<|endoftext|>")
+
+    def test_cachingDisabled(self):
+        os.environ["TIKTOKEN_CACHE_DIR"] = ""
+        self.assertFalse(utils._isEncodingCached("cl100k_base"))
+
+    def test_isEncodingCached(self):
+        self.assertFalse(utils._isEncodingCached("cl100k_base"))
+        self._cacheEncoding("cl100k_base")
+        self.assertTrue(utils._isEncodingCached("cl100k_base"))
+        self.assertFalse(utils._isEncodingCached("o200k_base"))
+
+
+class PromptAssemblerTest(unittest.TestCase):
+    """Test the retrieved chunks are fitted into the budget, with the 4 characters per token estimate."""
+
+    def setUp(self):
+        self.tiktoken = utils.tiktoken
+        utils.tiktoken = None
+        utils.getTokenizer.cache_clear()
+        self.template = "Q: {input}\nDocs:{documentation}\nExamples:{examples}"
+
+    def tearDown(self):
+        utils.tiktoken = self.tiktoken
+        utils.getTokenizer.cache_clear()
+
+    def test_responseReserve(self):
+        self.assertEqual(PromptAssembler("model", 1000).responseReserve, 500)
+        self.assertEqual(PromptAssembler("model", 100000).responseReserve, 2048)
+
+    def test_everythingFits(self):
+        assembler = PromptAssembler("model", 10000)
+        prompt, tokenUsage = assembler.assemble(self.template, {"input": "buffer"},
+                                                {"documentation": ["doc one", "doc two"], "examples": ["example"]})
+
+        self.assertIn("doc one\n\ndoc two", prompt)
+        self.assertIn("example", prompt)
+        self.assertEqual(tokenUsage["droppedChunks"], 0)
+        self.assertEqual(tokenUsage["prompt"], tokenUsage["template"] + tokenUsage["documentation"]
+                         + tokenUsage["examples"])
+
+    def test_budget(self):
+        assembler = PromptAssembler("model", 120, responseReserve=40)
+        chunks = {"documentation": ["d" * 80, "e" * 80, "f" * 80], "examples": ["x" * 80, "y" * 80]}
+        prompt, tokenUsage = assembler.assemble(self.template, {"input": "buffer"}, chunks, reservedText="r" * 40)
+
+        self.assertLessEqual(tokenUsage["prompt"], 120 - 40)
+        self.assertEqual(tokenUsage["reserved"], 10)
+        # round-robin: the best chunk of each field is kept first, the rest is dropped once the budget is spent
+        self.assertEqual(tokenUsage["droppedChunks"], 2)
+        for chunk in ["d" * 80, "x" * 80, "e" * 80]:
+            self.assertIn(chunk, prompt)
+        for chunk in ["y" * 80, "f" * 80]:
+            self.assertNotIn(chunk, prompt)
+
+    def test_firstChunkIsCut(self):
+        assembler = PromptAssembler("model", 60, responseReserve=20)
+        prompt, tokenUsage = assembler.assemble(self.template, {"input": "buffer"},
+                                                {"documentation": ["d" * 400], "examples": []})
+
+        self.assertIn("d" * 40, prompt)
+        self.assertNotIn("d" * 400, prompt)
+        self.assertEqual(tokenUsage["droppedChunks"], 0)
+        self.assertLessEqual(tokenUsage["prompt"], 60 - 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Retrieval query cache test."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ..queryCache import QueryCache
+
+
+class QueryCacheTest(unittest.TestCase):
+    """Test the LRU eviction, the key normalization and the persistence."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.persistPath = os.path.join(self.directory, "queryCache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_makeKey(self):
+        self.assertEqual(QueryCache.makeKey("document", "  Buffer the   roads?! ", 4),
+                         QueryCache.makeKey("document", "buffer the roads", "4"))
+        self.assertNotEqual(QueryCache.makeKey("document", "buffer the roads", 4),
+                            QueryCache.makeKey("example", "buffer the roads", 4))
+
+    def test_getAndStats(self):
+        cache = QueryCache()
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", ["result"])
+        self.assertEqual(cache.get("key"), ["result"])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "entries": 1, "bytes": len(json.dumps(["result"]))})
+
+    def test_evictLeastRecentlyUsed(self):
+        cache = QueryCache(maxEntries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_evictByBytes(self):
+        cache = QueryCache(maxBytes=20)
+        cache.put("a", "x" * 10)
+        cache.put("b", "y" * 10)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "y" * 10)
+
+        # larger than the whole cache, never stored
+        cache.put("c", "z" * 40)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["bytes"], 12)
+
+    def test_putDoesNotWrite(self):
+        cache = QueryCache(persistPath=self.persistPath)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        self.assertFalse(os.path.exists(self.persistPath))
+        self.assertIsNotNone(cache.saveTimer)
+        cache.flush()
+        self.assertIsNone(cache.saveTimer)
+
+        reloaded = QueryCache(persistPath=self.persistPath)
+        self.assertEqual(reloaded.get("a"), 1)
+        self.assertEqual(reloaded.get("b"), 2)
+
+    def test_debouncedSave(self):
+        cache = QueryCache(persistPath=self.persistPath)
+        cache.saveDelay = 0.05
+        cache.put("a", 1)
+        saveTimer = cache.saveTimer
+        saveTimer.join()
+
+        self.assertTrue(os.path.exists(self.persistPath))
+        self.assertIsNone(cache.saveTimer)
+        self.assertEqual(QueryCache(persistPath=self.persistPath).get("a"), 1)
+
+    def test_flushWithoutChanges(self):
+        cache = QueryCache(persistPath=self.persistPath)
+        cache.flush()
+        self.assertFalse(os.path.exists(self.persistPath))
+        QueryCache().flush()
+
+    def test_reloadKeepsRecency(self):
+        cache = QueryCache(persistPath=self.persistPath)
+        for key in ["a", "b", "c"]:
+            cache.put(key, key)
+        cache.get("a")
+        cache.flush()
+
+        reloaded = QueryCache(maxEntries=2, persistPath=self.persistPath)
+        self.assertIsNone(reloaded.get("b"))
+        self.assertEqual(reloaded.get("a"), "a")
+
+    def test_corruptFile(self):
+        with open(self.persistPath, "w", encoding="utf-8") as file:
+            file.write("{not json")
+        self.assertEqual(QueryCache(persistPath=self.persistPath).stats()["entries"], 0)
+
+    def test_concurrentPut(self):
+        cache = QueryCache(maxEntries=50, persistPath=self.persistPath)
+
+        def putResults(worker):
+            for number in range(100):
+                cache.put(f"{worker}:{number}", number)
+                cache.get(f"{worker}:{number // 2}")
+
+        workers = [threading.Thread(target=putResults, args=(worker,)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        cache.flush()
+
+        self.assertEqual(cache.stats()["entries"], 50)
+        self.assertEqual(QueryCache(persistPath=self.persistPath).stats()["entries"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
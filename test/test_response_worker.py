@@ -0,0 +1,50 @@
+# coding=utf-8
+"""Response worker test."""
+
+import threading
+import unittest
+
+from ..responseWorker import ReflectWorker, ResponseWorker
+from .test_dataloader import DataloaderTestCase
+
+
+class Processor:
+    def __init__(self, dataloader):
+        self.dataloader = dataloader
+
+    def response(self, userInput, responseType):
+        return self.dataloader.selectConversationInfo("c1")["title"], "empty"
+
+    def reflect(self, logMessage, executedCode, responseType, interactionID=None):
+        raise RuntimeError("the llm is not reachable")
+
+
+class ResponseWorkerTest(DataloaderTestCase):
+    """Test the workers release the connection of their thread."""
+
+    def _runInThread(self, worker):
+        results = []
+        worker.signals.finished.connect(lambda response, workflow: results.append(response))
+        worker.signals.error.connect(results.append)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        thread.join()
+        return results
+
+    def test_connectionIsReleased(self):
+        pool = self.dataloader.pool
+        pool.getConnection()
+        baseline = len(pool.connections)
+
+        processor = Processor(self.dataloader)
+        self.assertEqual(self._runInThread(ResponseWorker(processor, "buffer the roads", "Code")),
+                         ["conversation c1"])
+        self.assertEqual(len(pool.connections), baseline)
+
+        results = self._runInThread(ReflectWorker(processor, "NameError", "print(x)", "Code"))
+        self.assertIn("the llm is not reachable", results[0])
+        self.assertEqual(len(pool.connections), baseline)
+
+
+if __name__ == "__main__":
+    unittest.main()
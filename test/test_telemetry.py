@@ -0,0 +1,141 @@
+# coding=utf-8
+"""Telemetry outbox test."""
+
+import json
+import time
+import unittest
+
+from .. import telemetry
+from ..telemetry import TelemetrySender
+from .test_dataloader import DataloaderTestCase
+
+
+class Response:
+    def __init__(self, statusCode, data=None):
+        self.status_code = statusCode
+        self.data = data or {}
+
+    def json(self):
+        return self.data
+
+
+class Backend:
+    """Backend answering the batch endpoint with `batchStatus`, rejecting the records listed in `rejected`."""
+
+    def __init__(self, rejected=(), batchStatus=404, batchData=None):
+        self.rejected = set(rejected)
+        self.batchStatus = batchStatus
+        self.batchData = batchData
+        self.received = []
+
+    def post(self, url, json=None, **kwargs):
+        if url.endswith("/batch"):
+            return Response(self.batchStatus, self.batchData)
+        if json["n"] in self.rejected:
+            return Response(422)
+        self.received.append(json["n"])
+        return Response(200)
+
+
+class TelemetrySenderTest(DataloaderTestCase):
+    """Test the delivery of the outbox rows by the background thread of the sender."""
+
+    def setUp(self):
+        super().setUp()
+        self.getSession = telemetry.getSession
+        self.getSystemInfo = telemetry.getSystemInfo
+        self.captchaPopup = telemetry.captchaPopup
+        telemetry.getSystemInfo = lambda: {}
+        # the captcha dialog is dismissed
+        telemetry.captchaPopup = lambda captchaDict: None
+        self.sender = None
+
+    def tearDown(self):
+        if self.sender is not None:
+            self.sender.stop()
+        telemetry.getSession = self.getSession
+        telemetry.getSystemInfo = self.getSystemInfo
+        telemetry.captchaPopup = self.captchaPopup
+        super().tearDown()
+
+    def _startSender(self, backend):
+        # drop the conversation records queued by `setUp`
+        self.dataloader.cursor.execute("DELETE FROM outbox")
+        telemetry.getSession = lambda: backend
+        # the outbox is empty until `_queue`, the first delivery uses the settings below
+        self.sender = TelemetrySender(self.dataloader.databasePath, "http://backend")
+        self.sender.maxAttempts = 3
+        self.sender.captchaTimeout = 0.01
+        self.sender.initialRetryDelay = 0.01
+        self.sender.maxRetryDelay = 0.02
+        return self.sender
+
+    def _queue(self, numbers):
+        for n in numbers:
+            self.dataloader.postData("interaction", {"n": n})
+        self.sender.notify()
+
+    def _pendingRows(self):
+        self.dataloader.cursor.execute("SELECT payload, attempts FROM outbox ORDER BY ID")
+        return self.dataloader.cursor.fetchall()
+
+    def _waitFor(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out waiting for the sender")
+            time.sleep(0.01)
+
+    def test_acceptedRecordsAreSentOnce(self):
+        backend = Backend(rejected=[2])
+        sender = self._startSender(backend)
+        self._queue(range(6))
+
+        # the rejected record is retried, then dropped, without sending the accepted ones again
+        self._waitFor(lambda: not self._pendingRows())
+        self.assertEqual(backend.received, [0, 1, 3, 4, 5])
+
+        self._queue([6])
+        self._waitFor(lambda: backend.received[-1] == 6)
+        self.assertEqual(backend.received, [0, 1, 3, 4, 5, 6])
+        self._waitFor(lambda: sender.failureCount == 0)
+
+    def test_rejectedRecordWaitsForBackoff(self):
+        backend = Backend(rejected=[0])
+        sender = self._startSender(backend)
+        sender.initialRetryDelay = sender.maxRetryDelay = 60
+        self._queue(range(3))
+
+        self._waitFor(lambda: backend.received == [1, 2] and sender.failureCount > 0)
+        rows = self._pendingRows()
+        self.assertEqual([json.loads(payload)["n"] for payload, _ in rows], [0])
+        self.assertLess(rows[0][1], sender.maxAttempts)
+
+    def test_rejectedBatchIsSentPerRecord(self):
+        backend = Backend(rejected=[3], batchStatus=400)
+        sender = self._startSender(backend)
+        self._queue(range(6))
+
+        self._waitFor(lambda: len(backend.received) == 5)
+        self.assertTrue(sender.batchSupported)
+        self.assertEqual(backend.received, [0, 1, 2, 4, 5])
+
+    def test_serverErrorIsRetried(self):
+        sender = self._startSender(Backend(batchStatus=503))
+        self._queue(range(6))
+
+        self._waitFor(lambda: sender.failureCount > sender.maxAttempts)
+        self.assertEqual(len(self._pendingRows()), 6)
+
+    def test_unansweredCaptchaIsRetried(self):
+        backend = Backend(batchStatus=403, batchData={"detail": {"question": "1 + 1"}})
+        sender = self._startSender(backend)
+        self._queue(range(2))
+
+        self._waitFor(lambda: sender.failureCount > 1)
+        self.assertEqual(backend.received, [])
+        self.assertEqual([attempts for _, attempts in self._pendingRows()], [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,7 @@ from qgis.utils import iface
 
 from qgis.PyQt import QtWidgets, QtGui
 
-from .environment import QgisEnvironment
+from .environment import QgisEnvironment, getEnvironmentSnapshot
 
 
 @tool
@@ -28,9 +28,7 @@ def readEnvironment() -> str:
         - Resolution
         - Attributes (including Band Names and Data Types)
     """
-    environment = QgisEnvironment()
-    environment.refresh()
-    return environment.getLayerAttributes()
+    return getEnvironmentSnapshot().text()
 
 def readVersion() -> str:
     environment = QgisEnvironment()
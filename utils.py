@@ -6,14 +6,23 @@ Last modified by: Zehao Lu @com3dian
 """
 
 from datetime import datetime
-from functools import wraps
+from functools import wraps, lru_cache
 from typing import Literal
 import uuid
 import re
 import os
+import hashlib
+import tempfile
+import threading
 import requests
 import psutil
 
+try:
+    import tiktoken
+    from tiktoken.model import encoding_name_for_model
+except ImportError:
+    tiktoken = None
+
 from qgis.core import Qgis
 from PyQt5.QtWidgets import (
     QApplication,
@@ -34,6 +43,11 @@ import platform
 from . import log_manager
 
 
+# local timestamps, sortable, and the timestamps sent to the backend
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+BACKEND_TIMESTAMP_FORMAT = "%m %d %Y %H:%M:%S"
+
+
 def generateUniqueID():
     ID = str(uuid.uuid4())
     return ID.replace("-", "_")
@@ -44,21 +58,33 @@ def getCurrentTimeStamp():
     Returns the current timestamp as a formatted string.
 
     This function retrieves the current date and time using the system's local time,
-    and formats it into a string in the format "MM DD YYYY HH:MM:SS".
+    and formats it into a string in the ISO-8601 format "YYYY-MM-DD HH:MM:SS", which sorts like the time it
+    represents, so the database can order and filter on it.
 
     Returns:
-        str: The current timestamp in the format "MM DD YYYY HH:MM:SS".
+        str: The current timestamp in the format "YYYY-MM-DD HH:MM:SS".
 
     Example:
         current_time = getCurrentTimeStamp()
-        # current_time might return something like "09 15 2023 14:30:45"
+        # current_time might return something like "2023-09-15 14:30:45"
     """
     currentTime = datetime.now()
-    timeString = currentTime.strftime("%m %d %Y %H:%M:%S")
+    timeString = currentTime.strftime(TIMESTAMP_FORMAT)
 
     return timeString
 
 
+def toBackendTimeStamp(timeString):
+    """
+    Convert a timestamp of `getCurrentTimeStamp` to the "MM DD YYYY HH:MM:SS" format the backend expects, the
+    ISO-8601 format is only used locally. Values in another format are returned unchanged.
+    """
+    try:
+        return datetime.strptime(timeString, TIMESTAMP_FORMAT).strftime(BACKEND_TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return timeString
+
+
 def handleNoneConversation(func):
     @wraps(func)
     def wrapper(self, conversation, *args, **kwargs):
@@ -457,25 +483,90 @@ def createMarkdown(markdownText):
     return htmlText
 
 
-def countTokens(text: str, modelName: str) -> int:
-    encoding = tiktoken.encoding_for_model(modelName)
+class CharacterTokenizer:
+    """
+    Stand-in for a tiktoken encoding when tiktoken or its encoding files are not available, counts 4 characters
+    per token.
+    """
+    charactersPerToken = 4
+
+    def encode(self, text: str, disallowed_special=()) -> list:
+        return [text[i:i + self.charactersPerToken] for i in range(0, len(text), self.charactersPerToken)]
+
+    def decode(self, tokens: list) -> str:
+        return "".join(tokens)
 
-    return len(encoding.encode(text))
 
+def _isEncodingCached(encodingName: str) -> bool:
+    """
+    Whether the file of the tiktoken encoding `encodingName` is in the tiktoken cache, so that loading it needs no
+    download. Follows the cache location of `tiktoken.load`.
+    """
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cacheDir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cacheDir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cacheDir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if cacheDir == "":
+        # caching disabled
+        return False
+
+    blobPath = f"https://openaipublic.blob.core.windows.net/encodings/{encodingName}.tiktoken"
+    return os.path.exists(os.path.join(cacheDir, hashlib.sha1(blobPath.encode()).hexdigest()))
+
+
+def _downloadEncoding(encodingName: str) -> None:
+    try:
+        tiktoken.get_encoding(encodingName)
+    except Exception as e:
+        log_manager.log_debug(f"Downloading the tiktoken encoding '{encodingName}' failed: {e}")
+
+
+@lru_cache(maxsize=None)
+def getTokenizer(modelName: str):
+    """
+    Cached tokenizer of `modelName`. Models unknown to tiktoken (Cohere, DeepSeek, Groq hosted models) are
+    approximated with "cl100k_base".
+
+    tiktoken downloads its encoding files on first use, without timeout, so an encoding is only used when its file is
+    cached already. Otherwise the file is downloaded in the background, for the next session, and the token counts
+    are estimated by `CharacterTokenizer`.
+    """
+    if tiktoken is None:
+        return CharacterTokenizer()
+
+    try:
+        encodingName = encoding_name_for_model(modelName)
+    except KeyError:
+        encodingName = "cl100k_base"
+
+    if not _isEncodingCached(encodingName):
+        log_manager.log_debug(f"tiktoken encoding '{encodingName}' is not cached yet, token counts are estimated")
+        threading.Thread(target=_downloadEncoding, args=(encodingName,), daemon=True).start()
+        return CharacterTokenizer()
+
+    try:
+        return tiktoken.get_encoding(encodingName)
+    except Exception as e:
+        log_manager.log_error("Loading the tiktoken encoding failed, token counts are estimated", e)
+        return CharacterTokenizer()
+
+
+def countTokens(text: str, modelName: str) -> int:
+    encoding = getTokenizer(modelName)
 
-def trimText2TokenLimit(template, docPlaceholder, document, limit, modelName):
-    encoding = tiktoken.encoding_for_model(modelName)
+    # special tokens such as "<|endoftext|>" in user or document text are counted as plain text
+    return len(encoding.encode(text, disallowed_special=()))
 
-    tokens = encoding.encode(text)
 
-    templateWithoutDoc = template.format(docPlaceholder="")
-    tokens_used = count_tokens(template_without_doc)
-    max_model_tokens = 4  # or your model's max token limit
-    allowed_doc_tokens = max_model_tokens - tokens_used
+def trimText2TokenLimit(text: str, limit: int, modelName: str) -> str:
+    encoding = getTokenizer(modelName)
 
+    tokens = encoding.encode(text, disallowed_special=())
     if len(tokens) > limit:
         # Take only the first 'limit' tokens and decode back to text.
-        tokens = tokens[:limit]
+        tokens = tokens[:max(limit, 0)]
         return encoding.decode(tokens)
     return text
 